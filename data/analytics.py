@@ -0,0 +1,173 @@
+"""
+Аналитика скорости ответов операторов.
+
+Всё считается одним SQL-запросом с оконными функциями (LAG / MAX OVER /
+ROW_NUMBER / LEAD) прямо в SQLite: строки сообщений не поднимаются в Python
+и не проходят через _message_row_to_dict, наружу выходят только агрегаты.
+
+Определения:
+- ход пользователя — подряд идущие сообщения пользователя; его начало —
+  первое из них;
+- ответ оператора — сообщение оператора сразу после сообщения пользователя,
+  задержка ответа = время ответа − начало хода пользователя;
+- время до первого ответа (first response) — задержка первого ответа в чате;
+- время в статусе — по журналу chat_status_log; открытый интервал
+  считается до «сейчас», кроме закрытых чатов.
+
+Чаты в холодном архиве (data/archive.py) в аналитику не входят: их
+сообщения и журнал статусов лежат в архиве сжатыми. Журнал статусов
+архивируется вместе с чатом и при возврате из архива восстанавливается.
+
+Область выборки (scope): один чат, чаты пользователя или период
+[since_ms, until_ms) по времени сообщений. Для периода используется индекс
+по created_ms, для чата и пользователя — по chat_id, поэтому запрос по
+месяцу на базе в миллион сообщений занимает доли секунды.
+
+Оконные функции требуют SQLite 3.25+ (есть во всех сборках Python 3.8+ для Windows).
+"""
+import sqlite3
+import time
+
+CLOSED_STATUS = "Закрыта"
+
+# base материализуется отдельно: иначе ради порядка окна (chat_id, id) планировщик
+# выбирает полный проход по idx_messages_chat_id вместо индекса по периоду.
+# MATERIALIZED — с SQLite 3.35; со старой (сборки Python 3.8–3.9) запрос тот же, только медленнее
+_MATERIALIZED = "MATERIALIZED" if sqlite3.sqlite_version_info >= (3, 35, 0) else ""
+
+_REPLIES_SQL = """
+WITH base AS {materialized} (
+    SELECT id, chat_id, sender, operator, created_ms FROM messages WHERE {where}
+),
+m AS (
+    SELECT *, LAG(sender) OVER (PARTITION BY chat_id ORDER BY id) AS prev_sender
+    FROM base
+),
+t AS (
+    SELECT *, MAX(CASE WHEN sender = 'user' AND prev_sender IS NOT 'user' THEN created_ms END)
+              OVER (PARTITION BY chat_id ORDER BY id ROWS UNBOUNDED PRECEDING) AS turn_ms
+    FROM m
+),
+replies AS (
+    SELECT chat_id, operator, max(created_ms - turn_ms, 0) AS latency_ms,
+           ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id) AS n
+    FROM t
+    WHERE sender = 'operator' AND prev_sender = 'user' AND turn_ms IS NOT NULL
+)
+"""
+
+_DWELL_SQL = """
+WITH s AS (
+    SELECT chat_id, status, changed_ms,
+           LEAD(changed_ms) OVER (PARTITION BY chat_id ORDER BY changed_ms, id) AS next_ms
+    FROM chat_status_log WHERE {where}
+)
+SELECT chat_id, status,
+       sum(coalesce(next_ms, CASE WHEN status <> :closed THEN :now END) - changed_ms) AS dwell_ms
+FROM s GROUP BY chat_id, status
+"""
+
+
+def _scope(chat_id=None, user_id=None):
+    """WHERE для messages / chat_status_log и его параметры"""
+    clauses, params = [], {}
+    if chat_id is not None:
+        clauses.append("chat_id = :chat_id")
+        params["chat_id"] = chat_id
+    if user_id is not None:
+        clauses.append("chat_id IN (SELECT id FROM chats WHERE user_id = :user_id)")
+        params["user_id"] = user_id
+    return clauses, params
+
+
+def _time_scope(clauses, params, column, since_ms, until_ms):
+    clauses = list(clauses)
+    if since_ms is not None:
+        clauses.append(f"{column} >= :since_ms")
+        params["since_ms"] = since_ms
+    if until_ms is not None:
+        clauses.append(f"{column} < :until_ms")
+        params["until_ms"] = until_ms
+    return " AND ".join(clauses) or "1"
+
+
+def chat_metrics(conn, *, chat_id=None, user_id=None, since_ms=None, until_ms=None, now_ms=None) -> dict:
+    """{chat_id: {first_response_ms, avg_reply_ms, max_reply_ms, replies, dwell_ms: {статус: мс}}}"""
+    clauses, params = _scope(chat_id, user_id)
+    where = _time_scope(clauses, params, "created_ms", since_ms, until_ms)
+    result = {}
+    for row in conn.execute(_REPLIES_SQL.format(where=where, materialized=_MATERIALIZED) + """
+            SELECT chat_id, max(CASE WHEN n = 1 THEN latency_ms END), avg(latency_ms), max(latency_ms), count(*)
+            FROM replies GROUP BY chat_id""", params):
+        result[row[0]] = {"first_response_ms": row[1], "avg_reply_ms": row[2], "max_reply_ms": row[3],
+                          "replies": row[4], "dwell_ms": {}}
+    for chat, status, dwell in _dwell_rows(conn, chat_id, user_id, since_ms, until_ms, now_ms):
+        entry = result.setdefault(chat, {"first_response_ms": None, "avg_reply_ms": None, "max_reply_ms": None,
+                                         "replies": 0, "dwell_ms": {}})
+        if dwell is not None:
+            entry["dwell_ms"][status] = dwell
+    return result
+
+
+def operator_metrics(conn, *, chat_id=None, user_id=None, since_ms=None, until_ms=None) -> list:
+    """По операторам: ответов, чатов с первым ответом, средняя/максимальная задержка; быстрые — выше"""
+    clauses, params = _scope(chat_id, user_id)
+    where = _time_scope(clauses, params, "created_ms", since_ms, until_ms)
+    rows = conn.execute(_REPLIES_SQL.format(where=where, materialized=_MATERIALIZED) + """
+            SELECT coalesce(operator, '—'), count(*), avg(latency_ms), max(latency_ms),
+                   sum(n = 1), avg(CASE WHEN n = 1 THEN latency_ms END)
+            FROM replies GROUP BY 1 ORDER BY 3""", params).fetchall()
+    return [{"operator": r[0], "replies": r[1], "avg_reply_ms": r[2], "max_reply_ms": r[3],
+             "first_responses": r[4], "avg_first_response_ms": r[5]} for r in rows]
+
+
+def status_dwell(conn, *, chat_id=None, user_id=None, since_ms=None, until_ms=None, now_ms=None) -> dict:
+    """Среднее время в каждом статусе по чатам области: {статус: {avg_ms, chats}}"""
+    totals = {}
+    for _, status, dwell in _dwell_rows(conn, chat_id, user_id, since_ms, until_ms, now_ms):
+        if dwell is None:
+            continue
+        total, n = totals.get(status, (0, 0))
+        totals[status] = (total + dwell, n + 1)
+    return {status: {"avg_ms": total / n, "chats": n} for status, (total, n) in totals.items()}
+
+
+def _dwell_rows(conn, chat_id, user_id, since_ms, until_ms, now_ms):
+    clauses, params = _scope(chat_id, user_id)
+    # Период относится к смене статуса; интервал, начавшийся раньше, не режется
+    where = _time_scope(clauses, params, "changed_ms", since_ms, until_ms)
+    params.update(closed=CLOSED_STATUS, now=now_ms or int(time.time() * 1000))
+    return conn.execute(_DWELL_SQL.format(where=where), params).fetchall()
+
+
+def summary(conn, *, chat_id=None, user_id=None, since_ms=None, until_ms=None, now_ms=None) -> dict:
+    """Всё для панели: по операторам, средние по статусам и общие значения"""
+    operators = operator_metrics(conn, chat_id=chat_id, user_id=user_id, since_ms=since_ms, until_ms=until_ms)
+    replies = sum(o["replies"] for o in operators)
+    firsts = sum(o["first_responses"] for o in operators)
+    return {
+        "replies": replies,
+        "avg_reply_ms": (sum(o["avg_reply_ms"] * o["replies"] for o in operators) / replies) if replies else None,
+        "avg_first_response_ms": (sum(o["avg_first_response_ms"] * o["first_responses"]
+                                      for o in operators if o["first_responses"]) / firsts) if firsts else None,
+        "operators": operators,
+        "dwell": status_dwell(conn, chat_id=chat_id, user_id=user_id, since_ms=since_ms, until_ms=until_ms,
+                              now_ms=now_ms),
+    }
+
+
+def format_duration(ms) -> str:
+    """1234567 -> '20 мин 34 с'; None -> '—'"""
+    if ms is None:
+        return "—"
+    seconds = int(ms // 1000)
+    if seconds < 60:
+        return f"{seconds} с"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes} мин {seconds} с" if seconds else f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 48:
+        return f"{hours} ч {minutes} мин" if minutes else f"{hours} ч"
+    days, hours = divmod(hours, 24)
+    return f"{days} д {hours} ч" if hours else f"{days} д"
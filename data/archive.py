@@ -0,0 +1,193 @@
+"""
+Холодный архив закрытых чатов.
+
+Отдельная база (по умолчанию support_chat_archive.db рядом с основной):
+одна строка на чат, все его сообщения — одним сжатым (zlib) JSON-блоком.
+Горячие таблицы chats/messages от этого становятся меньше, а архив почти
+не занимает места и не участвует в обычных запросах.
+
+Вместе с чатом хранится его журнал смен статуса (chat_status_log) —
+при возврате из архива он восстанавливается, и аналитика времени
+в статусах для чата не теряется. Пока чат в архиве, в аналитику он
+не входит: она считается только по горячим таблицам.
+
+Поиск по архиву — contentless FTS5 (текст индексируется, но не хранится
+второй раз): одна запись на чат, название + текст всех сообщений.
+
+Переносом управляет SQLiteRepo.archive_closed_chats() (его вызывает фоновое
+задание data/maintenance.py); чтение архивных чатов (get_chat, get_messages,
+search) идёт через SQLiteRepo прозрачно.
+"""
+import json
+import sqlite3
+import threading
+import zlib
+
+COMPRESS_LEVEL = 6
+
+
+def _pack(messages) -> bytes:
+    return zlib.compress(json.dumps(messages, ensure_ascii=False).encode("utf-8"), COMPRESS_LEVEL)
+
+
+def _unpack(blob) -> list:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _fts_body(messages) -> str:
+    return "\n".join(m.get("text") or m.get("attachment_name") or "" for m in messages)
+
+
+class ChatArchive:
+    def __init__(self, db_path, synchronous: str = "NORMAL"):
+        self.db_path = db_path
+        # Одно соединение на все потоки: запросы к нему — под self._lock
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA busy_timeout = 5000;")
+        self.conn.execute("PRAGMA journal_mode = WAL;")
+        self.conn.execute(f"PRAGMA synchronous = {synchronous};")
+        self._lock = threading.Lock()
+        self._ensure_schema()
+        # id архивных чатов: проверка «чат в архиве?» без запроса к базе
+        self._ids = {r[0] for r in self.conn.execute("SELECT id FROM archived_chats")}
+
+    def _ensure_schema(self):
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_chats (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            user_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            status TEXT NOT NULL,
+            updated_at TEXT,
+            archived_at TEXT NOT NULL,
+            chat TEXT NOT NULL,       -- JSON всех колонок строки chats
+            messages BLOB NOT NULL,   -- zlib(JSON списка строк messages)
+            status_log TEXT           -- JSON [[status, changed_ms], ...] из chat_status_log
+        )
+        """)
+        # Архивы, созданные до переноса журнала статусов
+        cols = {r["name"] for r in self.conn.execute("PRAGMA table_info(archived_chats)")}
+        if "status_log" not in cols:
+            self.conn.execute("ALTER TABLE archived_chats ADD COLUMN status_log TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_archived_user_updated ON archived_chats(user_id, updated_at)")
+        self.conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5(
+            title, body, content='',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """)
+        self.conn.commit()
+
+    def __contains__(self, chat_id) -> bool:
+        return chat_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def put(self, chat: dict, messages: list, archived_at: str, status_log=None):
+        """Кладёт чат (строка chats как dict), его сообщения (строки messages)
+        и журнал статусов ([(status, changed_ms)]) в архив"""
+        with self._lock:
+            cur = self.conn.cursor()
+            try:
+                cur.execute("BEGIN")
+                self._remove(cur, chat["id"])
+                cur.execute(
+                    """INSERT INTO archived_chats (id,user_id,title,status,updated_at,archived_at,chat,messages,
+                                                  status_log)
+                       VALUES (?,?,?,?,?,?,?,?,?)""",
+                    (chat["id"], chat["user_id"], chat["title"], chat["status"], chat.get("updated_at"),
+                     archived_at, json.dumps(chat, ensure_ascii=False), _pack(messages),
+                     None if status_log is None else json.dumps([list(r) for r in status_log], ensure_ascii=False)))
+                cur.execute("INSERT INTO archive_fts(rowid, title, body) VALUES (?,?,?)",
+                            (cur.lastrowid, chat["title"], _fts_body(messages)))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            self._ids.add(chat["id"])
+
+    def get(self, chat_id):
+        """(chat, messages) архивного чата или None"""
+        if chat_id not in self._ids:
+            return None
+        with self._lock:
+            row = self.conn.execute("SELECT chat, messages FROM archived_chats WHERE id=?", (chat_id,)).fetchone()
+        if not row:
+            return None
+        return json.loads(row["chat"]), _unpack(row["messages"])
+
+    def status_log(self, chat_id):
+        """[(status, changed_ms)] архивного чата; None — чат в архиве без журнала (или его там нет)"""
+        if chat_id not in self._ids:
+            return None
+        with self._lock:
+            row = self.conn.execute("SELECT status_log FROM archived_chats WHERE id=?", (chat_id,)).fetchone()
+        if not row or row["status_log"] is None:
+            return None
+        return [tuple(r) for r in json.loads(row["status_log"])]
+
+    def remove(self, chat_ids):
+        """Удаляет чаты из архива. Возвращает их (chat, messages) — для учёта вложений."""
+        removed = []
+        with self._lock:
+            cur = self.conn.cursor()
+            try:
+                cur.execute("BEGIN")
+                for chat_id in chat_ids:
+                    if chat_id in self._ids:
+                        entry = self._remove(cur, chat_id)
+                        if entry:
+                            removed.append(entry)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            self._ids.difference_update(chat_ids)
+        return removed
+
+    def _remove(self, cur, chat_id):
+        row = cur.execute("SELECT rowid, title, chat, messages FROM archived_chats WHERE id=?", (chat_id,)).fetchone()
+        if not row:
+            return None
+        messages = _unpack(row["messages"])
+        # contentless FTS5 удаляет запись только по исходным значениям
+        cur.execute("INSERT INTO archive_fts(archive_fts, rowid, title, body) VALUES ('delete', ?, ?, ?)",
+                    (row["rowid"], row["title"], _fts_body(messages)))
+        cur.execute("DELETE FROM archived_chats WHERE rowid=?", (row["rowid"],))
+        return json.loads(row["chat"]), messages
+
+    def list_chats(self, user_id: str):
+        """Строки chats архивных чатов пользователя (без сообщений), новее — выше"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT chat FROM archived_chats WHERE user_id=? ORDER BY updated_at DESC", (user_id,)).fetchall()
+        return [json.loads(r["chat"]) for r in rows]
+
+    def expired(self, status, updated_before: str):
+        """id архивных чатов со статусом status (None — любым), изменённых раньше updated_before"""
+        with self._lock:
+            if status is None:
+                rows = self.conn.execute("SELECT id FROM archived_chats WHERE updated_at < ?",
+                                         (updated_before,)).fetchall()
+            else:
+                rows = self.conn.execute("SELECT id FROM archived_chats WHERE status = ? AND updated_at < ?",
+                                         (status, updated_before)).fetchall()
+        return [r["id"] for r in rows]
+
+    def search(self, user_id: str, match: str, limit: int = 50):
+        """[(bm25, chat, messages)] архивных чатов пользователя по запросу FTS5"""
+        if not self._ids:
+            return []
+        with self._lock:
+            rows = self.conn.execute(
+                """SELECT a.chat, a.messages, bm25(archive_fts) AS score
+                   FROM archive_fts f JOIN archived_chats a ON a.rowid = f.rowid
+                   WHERE archive_fts MATCH ? AND a.user_id = ?
+                   ORDER BY score LIMIT ?""", (match, user_id, limit)).fetchall()
+        return [(r["score"], json.loads(r["chat"]), _unpack(r["messages"])) for r in rows]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,107 @@
+"""
+Асинхронный фасад над SQLiteRepo для GUI.
+
+Все обращения к базе выполняются в отдельном рабочем потоке (один поток —
+операции строго по порядку вызова), а результат возвращается в поток Qt
+через сигнал. Так UI-поток не проводит времени внутри sqlite3.
+
+    mw.repo.get_chat(chat_id, callback=self._show_chat)
+    mw.repo.add_message(chat_id, sender="user", text=text)   # fire-and-forget
+
+Каждый вызов возвращает concurrent.futures.Future; callback(result) и
+errback(exc) вызываются уже в потоке, которому принадлежит AsyncRepo.
+
+Методы из PARALLEL_READS (поиск, история, аналитика) идут в отдельный пул потоков
+чтения и не ждут очереди записи: SQLiteRepo читает через свои
+соединения только для чтения (data/connections.py). Порядок относительно
+записей для них не гарантируется.
+
+Вместо готового репозитория можно передать фабрику (например,
+sqlite_store.get_repo): база откроется первой задачей в потоке базы,
+а UI-поток не будет ждать миграций.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from PySide6.QtCore import QObject, Signal, Slot
+
+
+PARALLEL_READS = frozenset({"search", "list_archived_chats", "chat_analytics", "response_analytics"})
+
+
+class AsyncRepo(QObject):
+    _finished = Signal(object, object, object, str)  # future, callback, errback, имя метода
+
+    def __init__(self, repo, parent=None, read_workers: int = 2):
+        """repo — SQLiteRepo или вызываемая фабрика, открывающая его"""
+        super().__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="repo")
+        self._read_executor = ThreadPoolExecutor(max_workers=max(1, read_workers), thread_name_prefix="repo-read")
+        self._finished.connect(self._deliver)
+        self._opened = Future()
+        if callable(repo):
+            self._executor.submit(self._open, repo)
+        else:
+            self._opened.set_result(repo)
+
+    def _open(self, factory):
+        try:
+            self._opened.set_result(factory())
+        except Exception as e:
+            print(f"Repo open error: {e}")
+            self._opened.set_exception(e)
+
+    @property
+    def repo(self):
+        """Открытый репозиторий (ждёт открытия; вызывать из рабочих потоков)"""
+        return self._opened.result()
+
+    def submit(self, fn, *args, callback=None, errback=None, parallel=False, **kwargs):
+        """Выполнить fn(*args, **kwargs) в потоке базы (parallel=True — в пуле чтения)"""
+        name = getattr(fn, "__name__", "call")
+        executor = self._read_executor if parallel else self._executor
+        fut = executor.submit(fn, *args, **kwargs)
+        # Сигнал из рабочего потока доставляется в поток Qt очередью событий
+        fut.add_done_callback(lambda f: self._finished.emit(f, callback, errback, name))
+        return fut
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        parallel = name in PARALLEL_READS
+
+        def method(*args, **kwargs):
+            # Метод берётся в рабочем потоке — когда репозиторий уже открыт
+            return getattr(self.repo, name)(*args, **kwargs)
+
+        method.__name__ = name
+
+        def call(*args, callback=None, errback=None, **kwargs):
+            return self.submit(method, *args, callback=callback, errback=errback, parallel=parallel, **kwargs)
+
+        call.__name__ = name
+        return call
+
+    @Slot(object, object, object, str)
+    def _deliver(self, fut, callback, errback, name):
+        err = fut.exception()
+        if err is not None:
+            if errback:
+                errback(err)
+            else:
+                print(f"Repo error in {name}: {err}")
+            return
+        if callback:
+            try:
+                callback(fut.result())
+            except Exception as e:
+                print(f"Error in {name} callback: {e}")
+                import traceback
+                traceback.print_exc()
+
+    def shutdown(self):
+        """Дождаться всех поставленных операций и сбросить запись на диск"""
+        self._read_executor.shutdown(wait=True)
+        self._executor.shutdown(wait=True)
+        if self._opened.done() and self._opened.exception() is None:
+            repo = self._opened.result()
+            repo.stop_maintenance()
+            repo.flush()
@@ -0,0 +1,363 @@
+"""
+Замеры производительности локального хранилища.
+
+Запуск: python -m data.bench [load|plans|ingest|search|suite]
+
+plans — проверка планов горячих запросов: код возврата 1, если какой-то
+из них ушёл в полный просмотр таблицы (годится как проверка в CI).
+
+suite — набор замеров SQLiteRepo на синтетической базе (data/synthetic.py,
+по умолчанию 10 000 чатов и 1 000 000 сообщений); результат пишется в JSON,
+чтобы сравнивать версии. Параметры — переменные окружения:
+    BENCH_CHATS, BENCH_MESSAGES, BENCH_SEED — размер и seed базы;
+    BENCH_DB  — где хранить сгенерированную базу между запусками (замеры идут на копии);
+    BENCH_OUT — файл результата (по умолчанию bench_results/storage-<время>.json).
+
+Каждый замер работает на временной базе, рабочий support_chat.db не трогается.
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from .sqlite_store import SQLiteRepo
+from .migrations import check_query_plans
+from . import synthetic
+
+USER_ID = "BENCH"
+
+
+def _timeit(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def _ms(text):
+    """Локальное время строкой -> мс эпохи, как migrations.MS_FROM_TEXT_SQL"""
+    return int(datetime.fromisoformat(text).timestamp() * 1000)
+
+
+def _fill(repo, chats, total_messages):
+    """Заполняет базу: chats чатов, сообщения поровну между ними"""
+    per_chat = max(1, total_messages // chats)
+    cur = repo.conn.cursor()
+    cur.executemany(
+        """INSERT INTO chats (id,user_id,title,status,created_at,updated_at,created_ms,updated_ms)
+           VALUES (?,?,?,?,?,?,?,?)""",
+        ((f"CH-{i:06d}", USER_ID, f"Заявка {i}", "В работе", "2025-10-01 10:00", f"2025-10-01 {i % 24:02d}:00",
+          _ms("2025-10-01 10:00"), _ms(f"2025-10-01 {i % 24:02d}:00"))
+         for i in range(1, chats + 1))
+    )
+    created_ms = _ms("2025-10-01 10:00:00")
+    cur.executemany(
+        "INSERT INTO messages (chat_id,sender,text,time,created_at,created_ms) VALUES (?,?,?,?,?,?)",
+        ((f"CH-{i:06d}", "user" if j % 2 else "operator", f"Сообщение {j}", "10:00", "2025-10-01 10:00:00",
+          created_ms + j * 1000)
+         for i in range(1, chats + 1) for j in range(per_chat))
+    )
+    repo.conn.commit()
+
+
+def _load_user_chats_n_plus_one(repo, user_id):
+    """Прежний загрузчик: отдельный SELECT сообщений на каждый чат"""
+    cur = repo.conn.cursor()
+    chats = []
+    for crow in cur.execute("SELECT * FROM chats WHERE user_id=? ORDER BY updated_at DESC", (user_id,)).fetchall():
+        chat = repo._chat_row_to_dict(crow)
+        mrows = repo.conn.execute("SELECT * FROM messages WHERE chat_id=? ORDER BY id ASC", (crow["id"],)).fetchall()
+        chat["messages"] = [repo._message_row_to_dict(r) for r in mrows]
+        chats.append(chat)
+    return chats
+
+
+def bench_load_user_chats(total_messages=20000, chat_counts=(10, 100, 500, 2000)):
+    """load_user_chats при фиксированном объёме сообщений и растущем числе чатов.
+
+    Два запроса вместо N+1 по времени почти не отличаются: SQLite в том же
+    процессе, и запрос на чат стоит мало по сравнению с чтением сообщений.
+    От объёма сообщений не зависит только with_messages=False (колонка
+    «только чаты») — им и пользуется список чатов в окне.
+    """
+    print(f"load_user_chats, {total_messages} сообщений")
+    print(f"{'чатов':>8} {'N+1, мс':>10} {'2 запроса, мс':>14} {'только чаты, мс':>16}")
+    for chats in chat_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            repo = SQLiteRepo(os.path.join(tmp, "bench.db"))
+            _fill(repo, chats, total_messages)
+            old = _timeit(lambda: _load_user_chats_n_plus_one(repo, USER_ID))
+            new = _timeit(lambda: repo.load_user_chats(USER_ID))
+            lazy = _timeit(lambda: repo.load_user_chats(USER_ID, with_messages=False))
+            repo.close()
+        print(f"{chats:>8} {old * 1000:>10.1f} {new * 1000:>14.1f} {lazy * 1000:>16.1f}")
+
+
+def check_plans():
+    """Планы горячих запросов на заполненной базе"""
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = SQLiteRepo(os.path.join(tmp, "bench.db"))
+        _fill(repo, 200, 20000)
+        repo.conn.execute("ANALYZE")
+        try:
+            check_query_plans(repo.conn)
+            rc = 0
+        except AssertionError as e:
+            print(e)
+            rc = 1
+        repo.close()
+    if not rc:
+        print("Планы горячих запросов: без полного просмотра таблиц")
+    return rc
+
+
+def bench_ingest(messages=2000, chats=20):
+    """Поток входящих сообщений: add_message подряд, как при пачке WS-событий"""
+    modes = [
+        ("синхронно, FULL", dict(synchronous="FULL")),
+        ("синхронно, NORMAL", dict(synchronous="NORMAL")),
+        ("write-behind, FULL", dict(write_behind=True, synchronous="FULL")),
+        ("write-behind, NORMAL", dict(write_behind=True, synchronous="NORMAL")),
+    ]
+    print(f"add_message: {messages} сообщений по {chats} чатам")
+    print(f"{'режим':<22} {'сообщ./с':>10} {'на вызов, мкс':>14} {'до диска, мс':>13} {'пачек':>7}")
+    for name, opts in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            repo = SQLiteRepo(os.path.join(tmp, "bench.db"), **opts)
+            chat_ids = [repo.create_chat(USER_ID, f"Заявка {i}")["id"] for i in range(chats)]
+            t0 = time.perf_counter()
+            for i in range(messages):
+                repo.add_message(chat_ids[i % chats], sender="operator", text=f"Сообщение {i}", operator="Бенч")
+            t_enqueue = time.perf_counter() - t0
+            repo.flush()
+            t_total = time.perf_counter() - t0
+            batches = repo.writer.batches if repo.writer else messages
+            repo.close()
+        print(f"{name:<22} {messages / t_total:>10.0f} {t_enqueue / messages * 1e6:>14.1f} "
+              f"{t_total * 1000:>13.1f} {batches:>7}")
+
+
+def bench_search(total_messages=200000, chats=2000, seed=1):
+    """Полнотекстовый поиск (SQLiteRepo.search) по базе с разнообразной лексикой"""
+    rnd = random.Random(seed)
+    vocab = [f"{stem}{end}" for stem in ("плат", "карт", "вход", "файл", "счет", "довор", "пароль", "доступ",
+                                         "отчет", "сервер", "лимит", "кабинет", "ошибк", "заявк", "подпис")
+             for end in ("", "а", "е", "ы", "ом", "ами", "ой", "ах")]
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = SQLiteRepo(os.path.join(tmp, "bench.db"))
+        cur = repo.conn.cursor()
+        created_ms = _ms("2025-10-01 10:00")
+        cur.executemany(
+            """INSERT INTO chats (id,user_id,title,status,created_at,updated_at,created_ms,updated_ms)
+               VALUES (?,?,?,?,?,?,?,?)""",
+            ((f"CH-{i:06d}", USER_ID, f"Заявка {rnd.choice(vocab)}", "В работе", "2025-10-01 10:00",
+              "2025-10-01 10:00", created_ms, created_ms) for i in range(chats))
+        )
+        t0 = time.perf_counter()
+        cur.executemany(
+            "INSERT INTO messages (chat_id,sender,text,time,created_at,created_ms) VALUES (?,?,?,?,?,?)",
+            ((f"CH-{rnd.randrange(chats):06d}", "user",
+              " ".join(rnd.choice(vocab) for _ in range(rnd.randint(3, 25))) + f" #{rnd.randrange(10 ** 6)}",
+              "10:00", "2025-10-01 10:00:00", created_ms) for _ in range(total_messages))
+        )
+        repo.conn.commit()
+        print(f"search: {total_messages} сообщений, заполнение с FTS-триггерами {time.perf_counter() - t0:.1f} с")
+        for q in ("плата", "карт", "пароль доступ", "#4242", "кабинет ошибк", "нет такого"):
+            res = []
+            dt = _timeit(lambda: res.append(repo.search(USER_ID, q, 50)))
+            print(f"  {q!r:<18} {len(res[-1]):>4} чатов {dt * 1000:>8.1f} мс")
+        repo.close()
+
+
+# ---------- suite ----------
+
+SUITE_SAMPLES = 200        # чатов для замеров get_chat / удаления
+SUITE_WRITES = 5000        # add_message на режим
+PAGE_SIZE = 50             # как MESSAGES_PAGE_SIZE в окне чата
+
+
+def _stats(samples):
+    """Сводка по временам вызовов (секунды) в миллисекундах"""
+    ms = sorted(x * 1000 for x in samples)
+    q = statistics.quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+    return {"n": len(ms), "mean_ms": round(statistics.fmean(ms), 3), "p50_ms": round(q[49], 3),
+            "p95_ms": round(q[94], 3), "max_ms": round(ms[-1], 3)}
+
+
+def _each(fn, args):
+    samples = []
+    for a in args:
+        t0 = time.perf_counter()
+        fn(a)
+        samples.append(time.perf_counter() - t0)
+    return _stats(samples)
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _suite_db(path, params):
+    """Сгенерированная база: берётся готовая, если параметры совпадают, иначе создаётся заново"""
+    meta_path = path + ".json"
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            if json.load(f) == params:
+                return None
+    for suffix in ("", "-wal", "-shm", ".json"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    t0 = time.perf_counter()
+    repo = SQLiteRepo(path)
+    synthetic.populate(repo, **params)
+    repo.conn.execute("ANALYZE")
+    repo.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    repo.close()
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(params, f)
+    return time.perf_counter() - t0
+
+
+def bench_suite(chats=None, messages=None, seed=None, db_path=None, out=None):
+    """load_user_chats, get_chat, add_message, статусы и удаления на синтетической базе"""
+    env = os.environ
+    params = {"chats": chats or int(env.get("BENCH_CHATS", synthetic.DEFAULT_CHATS)),
+              "messages": messages or int(env.get("BENCH_MESSAGES", synthetic.DEFAULT_MESSAGES)),
+              "seed": seed if seed is not None else int(env.get("BENCH_SEED", 1))}
+    out = out or env.get("BENCH_OUT") or os.path.join(
+        "bench_results", f"storage-{datetime.now():%Y%m%d-%H%M%S}.json")
+    rnd = random.Random(params["seed"])
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = db_path or env.get("BENCH_DB") or os.path.join(tmp, "source.db")
+        print(f"suite: {params['chats']} чатов, {params['messages']} сообщений ({source})")
+        generated = _suite_db(source, params)
+        if generated is not None:
+            results["generate_s"] = round(generated, 2)
+            print(f"  база создана за {generated:.1f} с")
+        work = os.path.join(tmp, "bench.db")
+        shutil.copyfile(source, work)
+
+        repo = SQLiteRepo(work, archive_after_days=0)
+        users = [r[0] for r in repo.conn.execute(
+            "SELECT user_id FROM chats GROUP BY user_id ORDER BY count(*) DESC")]
+        heavy, median = users[0], users[len(users) // 2]
+        chat_ids = [r[0] for r in repo.conn.execute("SELECT id FROM chats")]
+        sample = rnd.sample(chat_ids, min(SUITE_SAMPLES, len(chat_ids)))
+
+        for label, user in (("heavy", heavy), ("median", median)):
+            n = repo.conn.execute("SELECT count(*) FROM chats WHERE user_id=?", (user,)).fetchone()[0]
+            results[f"load_user_chats.{label}"] = {
+                "chats": n,
+                "list_ms": round(_timeit(lambda: repo.load_user_chats(user, with_messages=False)) * 1000, 3),
+                "with_messages_ms": round(_timeit(lambda: repo.load_user_chats(user), repeat=1) * 1000, 3),
+            }
+
+        def cold(chat_id):
+            repo.cache.clear()
+            repo.get_chat(chat_id, message_limit=PAGE_SIZE)
+
+        results["get_chat.cold"] = _each(cold, sample)
+        # Повторное открытие недавних чатов — из LRU (выборка помещается в кэш)
+        recent = sample[:20]
+        for chat_id in recent:
+            repo.get_chat(chat_id, message_limit=PAGE_SIZE)
+        results["get_chat.warm"] = _each(lambda c: repo.get_chat(c, message_limit=PAGE_SIZE), recent * 10)
+        results["get_chat.full"] = _each(lambda c: (repo.cache.clear(), repo.get_chat(c)), sample[:50])
+
+        # Аналитика ответов (data/analytics.py): должна оставаться интерактивной
+        month_ago = int(time.time() * 1000) - 30 * 86_400_000
+        results["response_analytics.30d_ms"] = round(
+            _timeit(lambda: repo.response_analytics(since_ms=month_ago), repeat=1) * 1000, 3)
+        results["response_analytics.heavy_user_ms"] = round(
+            _timeit(lambda: repo.response_analytics(user_id=heavy), repeat=1) * 1000, 3)
+        results["chat_analytics"] = _each(repo.chat_analytics, sample[:50])
+
+        # Статусы: по одному и пачкой
+        results["update_chat_status"] = _each(lambda c: repo.update_chat_status(c, "В работе"), sample)
+        bulk = rnd.sample(chat_ids, min(1000, len(chat_ids)))
+        t0 = time.perf_counter()
+        repo.bulk_update_status(bulk, "Закрыта")
+        results["bulk_update_status"] = {"chats": len(bulk), "ms": round((time.perf_counter() - t0) * 1000, 3)}
+        repo.close()
+
+        # Поток add_message в обоих режимах записи — на большой базе с её индексами
+        for label, opts in (("sync", {}), ("write_behind", {"write_behind": True})):
+            repo = SQLiteRepo(work, archive_after_days=0, **opts)
+            t0 = time.perf_counter()
+            for i in range(SUITE_WRITES):
+                repo.add_message(sample[i % len(sample)], sender="operator", text=f"Сообщение {i}", operator="Бенч")
+            repo.flush()
+            dt = time.perf_counter() - t0
+            results[f"add_message.{label}"] = {"messages": SUITE_WRITES, "per_s": round(SUITE_WRITES / dt, 1)}
+            repo.close()
+
+        # Удаления: по одному (каскад сообщений, FTS, сводки) и пачкой
+        repo = SQLiteRepo(work, archive_after_days=0)
+        sampled = set(sample)
+        rest = [c for c in chat_ids if c not in sampled]
+        results["delete_chat"] = _each(repo.delete_chat, sample)
+        bulk = rnd.sample(rest, min(1000, len(rest)))
+        t0 = time.perf_counter()
+        repo.bulk_delete(bulk)
+        results["bulk_delete"] = {"chats": len(bulk), "ms": round((time.perf_counter() - t0) * 1000, 3)}
+        repo.close()
+
+    report = {
+        "suite": "storage",
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git": _git_rev(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for name, value in results.items():
+        print(f"  {name:<28} {json.dumps(value, ensure_ascii=False)}")
+    print(f"Результат: {out}")
+    return 0
+
+
+COMMANDS = {
+    "load": lambda: bench_load_user_chats() or 0,
+    "plans": check_plans,
+    "ingest": lambda: bench_ingest() or 0,
+    "search": lambda: bench_search() or 0,
+    "suite": bench_suite,
+}
+
+
+def main(argv=None):
+    # suite долгий (минуты на генерацию базы) — только по явному запросу
+    names = list(argv or (name for name in COMMANDS if name != "suite"))
+    rc = 0
+    for name in names:
+        if name not in COMMANDS:
+            print(f"Неизвестный замер: {name}. Доступны: {', '.join(COMMANDS)}")
+            return 2
+        rc = COMMANDS[name]() or rc
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
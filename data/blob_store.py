@@ -0,0 +1,128 @@
+"""
+Хранилище вложений по содержимому (content-addressed).
+
+Файл кладётся под именем своего SHA-256: blobs/ab/cdef…; одинаковое
+содержимое хранится один раз, а сообщение ссылается на хеш, а не на путь
+пользователя (исходный файл можно переместить или удалить).
+
+Файл за один проход копируется во временный файл и хешируется, имя в
+хранилище — хеш именно скопированных байтов: если исходник меняется во
+время чтения, под хешем всё равно лежит то, что дало этот хеш. Блоки по
+CHUNK_SIZE; вызывать из рабочего потока (SQLiteRepo.add_attachment_message
+выполняется в потоке AsyncRepo). Повторная отправка того же неизменённого
+файла не читает его заново: (путь, размер, mtime) -> хеш запоминается для
+последних KNOWN_LIMIT файлов.
+
+Учёт ссылок — таблица blobs (см. migrations._m007_attachment_blobs), сборка
+мусора — SQLiteRepo.gc_blobs().
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+CHUNK_SIZE = 1024 * 1024
+KNOWN_LIMIT = 4096
+
+
+def human_size(num) -> str:
+    """Размер в байтах -> человекочитаемая строка (для отображения)"""
+    for unit in ['Б', 'КБ', 'МБ', 'ГБ', 'ТБ']:
+        if abs(num) < 1024.0:
+            return f"{num:.1f} {unit}"
+        num /= 1024.0
+    return f"{num:.1f} ПБ"
+
+
+def hash_file(path, chunk_size: int = CHUNK_SIZE):
+    """Потоковый SHA-256 файла. Возвращает (hex, размер в байтах)."""
+    h = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        # (realpath, size, mtime_ns) -> hash: тот же файл повторно не читаем (LRU на KNOWN_LIMIT)
+        self._known = OrderedDict()
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    def put_file(self, path):
+        """Кладёт файл в хранилище. Возвращает (hash, размер в байтах)."""
+        st = os.stat(path)
+        key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._known.get(key)
+            if digest is not None and os.path.exists(self.path_for(digest)):
+                self._known.move_to_end(key)
+                # Дубликат: копировать нечего, но отмечаем свежее использование для gc
+                os.utime(self.path_for(digest))
+                return digest, st.st_size
+
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        try:
+            h = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, "wb") as out, open(path, "rb") as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            digest = h.hexdigest()
+            dest = self.path_for(digest)
+            with self._lock:
+                if os.path.exists(dest):
+                    os.remove(tmp)
+                    os.utime(dest)
+                else:
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    os.replace(tmp, dest)
+                # Запоминаем, только если файл не менялся, пока его читали
+                after = os.stat(path)
+                if size == st.st_size and (after.st_size, after.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                    self._remember(key, digest)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return digest, size
+
+    def _remember(self, key, digest):
+        self._known[key] = digest
+        self._known.move_to_end(key)
+        while len(self._known) > KNOWN_LIMIT:
+            self._known.popitem(last=False)
+
+    def recently_used(self, digest: str, grace_seconds: float) -> bool:
+        """Файл записан или переиспользован недавно (сообщение с ним может ещё стоять в очереди)"""
+        try:
+            return time.time() - os.path.getmtime(self.path_for(digest)) < grace_seconds
+        except OSError:
+            return False
+
+    def delete(self, digest: str):
+        with self._lock:
+            try:
+                os.remove(self.path_for(digest))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,139 @@
+"""
+LRU-кэш прочитанных чатов и страниц сообщений перед SQLiteRepo.
+
+Ограничение — суммарное число сообщений в кэше (у каждой записи вес
+1 + число сообщений), поэтому длинный чат вытесняет несколько коротких.
+Записи сгруппированы по chat_id: любая запись в чат через SQLiteRepo
+сбрасывает все его записи.
+
+Гонка «читатель прочитал старое, писатель сбросил кэш, читатель положил
+старое» закрыта номером поколения чата: put() принимает поколение, взятое
+до чтения, и ничего не кладёт, если за это время был сброс. Номера берутся
+из общего счётчика, а помнятся только для последних GENERATION_LIMIT
+сброшенных чатов; у забытых поколение — наибольшее из вытесненных (floor),
+так что старое чтение такого чата тоже ничего не положит.
+"""
+import threading
+from collections import OrderedDict
+
+CACHE_MAX_MESSAGES = 5000
+GENERATION_LIMIT = 10_000
+
+
+def _copy(value):
+    """Копия, которую вызывающий может менять: чат (dict) или страница (messages, has_more)"""
+    if isinstance(value, dict):
+        chat = dict(value)
+        chat["messages"] = list(value.get("messages", []))
+        return chat
+    messages, has_more = value
+    return list(messages), has_more
+
+
+def _weight(value):
+    if isinstance(value, dict):
+        return 1 + len(value.get("messages", []))
+    return 1 + len(value[0])
+
+
+class ChatCache:
+    def __init__(self, max_messages: int = CACHE_MAX_MESSAGES):
+        self.max_messages = max_messages
+        self._entries = OrderedDict()   # key -> (value, weight); key[1] — chat_id
+        self._by_chat = {}              # chat_id -> set(key)
+        self._generation = OrderedDict()  # chat_id -> номер последнего сброса (LRU)
+        self._floor = 0                 # поколение чатов, которых нет в _generation
+        self._counter = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self, chat_id):
+        with self._lock:
+            return self._generation.get(chat_id, self._floor)
+
+    def get(self, key):
+        """Копия значения или None (промах)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[0]
+        return _copy(value)
+
+    def put(self, key, value, generation):
+        if value is None or self.max_messages <= 0:
+            return
+        weight = _weight(value)
+        if weight > self.max_messages:
+            return
+        value = _copy(value)
+        chat_id = key[1]
+        with self._lock:
+            if self._generation.get(chat_id, self._floor) != generation:
+                return
+            self._drop(key)
+            self._entries[key] = (value, weight)
+            self._by_chat.setdefault(chat_id, set()).add(key)
+            self._size += weight
+            while self._size > self.max_messages:
+                old_key = next(iter(self._entries))
+                self._drop(old_key)
+                self.evictions += 1
+
+    def invalidate(self, chat_ids):
+        with self._lock:
+            for chat_id in chat_ids:
+                self._bump(chat_id)
+                for key in list(self._by_chat.get(chat_id, ())):
+                    self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            # Сброс всего: чтения, начатые до clear(), не кладут ничего
+            self._counter += 1
+            self._floor = self._counter
+            self._generation.clear()
+            self._entries.clear()
+            self._by_chat.clear()
+            self._size = 0
+
+    def _bump(self, chat_id):
+        self._counter += 1
+        self._generation[chat_id] = self._counter
+        self._generation.move_to_end(chat_id)
+        while len(self._generation) > GENERATION_LIMIT:
+            _, old = self._generation.popitem(last=False)
+            self._floor = max(self._floor, old)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._size -= entry[1]
+        keys = self._by_chat.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_chat[key[1]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "messages": self._size,
+                "max_messages": self.max_messages,
+            }
@@ -0,0 +1,161 @@
+"""
+Соединения SQLite для SQLiteRepo.
+
+Одно пишущее соединение (запись в SQLite всё равно последовательна) и
+небольшой пул соединений только для чтения. В режиме WAL читатели не ждут
+писателя и друг друга, поэтому поиск и история из рабочих потоков идут
+параллельно с записью.
+
+    with db.transaction() as conn:     # BEGIN IMMEDIATE … COMMIT / ROLLBACK
+        conn.execute("UPDATE …")
+
+    with db.read() as conn:            # снимок базы на время блока
+        conn.execute("SELECT …")
+
+Соединение для чтения выдаётся потоку на время блока read(); вложенный
+read() в том же потоке получает то же соединение. Если все соединения
+пула заняты, read() ждёт освобождения.
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+READ_POOL_SIZE = 4
+
+
+def configure(conn, synchronous: str = "NORMAL"):
+    """Общие PRAGMA пишущих соединений"""
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    # Действует только на новую базу (до перехода в WAL и первой таблицы); старую
+    # переводит VACUUM — см. data/maintenance.py
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute(f"PRAGMA synchronous = {synchronous};")
+
+
+class ConnectionManager:
+    def __init__(self, db_path, synchronous: str = "NORMAL", read_pool_size: int = READ_POOL_SIZE):
+        self.db_path = db_path
+        self.read_pool_size = max(1, read_pool_size)
+        self.writer = sqlite3.connect(db_path, check_same_thread=False)
+        configure(self.writer, synchronous)
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._pool = queue.LifoQueue()
+        self._readers = []           # все созданные соединения для чтения
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    @contextmanager
+    def transaction(self):
+        """Пишущая транзакция; вложенный вызов в том же потоке входит во внешнюю"""
+        with self._write_lock:
+            conn = self.writer
+            if self._write_depth:
+                self._write_depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._write_depth -= 1
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            self._write_depth = 1
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._write_depth = 0
+
+    @contextmanager
+    def autocommit(self):
+        """Пишущее соединение вне транзакции — для VACUUM, checkpoint и PRAGMA optimize"""
+        with self._write_lock:
+            if self._write_depth or self.writer.in_transaction:
+                raise RuntimeError("autocommit() внутри транзакции")
+            yield self.writer
+
+    @contextmanager
+    def read(self):
+        """Соединение только для чтения с согласованным снимком на время блока"""
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.execute("COMMIT")
+        finally:
+            self._local.conn = None
+            self._pool.put(conn)
+
+    @contextmanager
+    def exclusive(self):
+        """Пишущее соединение в locking_mode=EXCLUSIVE на время блока: базу не открывает
+        никто другой — ни другой процесс, ни свой пул чтения (его соединения закрываются).
+        Если база уже открыта кем-то ещё (после busy_timeout) — RuntimeError."""
+        with self._write_lock:
+            with self._pool_lock:
+                if self._pool.qsize() != len(self._readers):
+                    raise RuntimeError("exclusive(): соединения чтения заняты")
+                while not self._pool.empty():
+                    self._pool.get_nowait().close()
+                self._readers.clear()
+            conn = self.writer
+            conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+            try:
+                # Блокировка берётся первой записью и держится до возврата в NORMAL
+                conn.execute("BEGIN IMMEDIATE")
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                conn.execute("PRAGMA locking_mode = NORMAL")
+                raise RuntimeError(f"База {self.db_path} открыта другим соединением или процессом") from e
+            try:
+                yield conn
+            finally:
+                conn.execute("PRAGMA locking_mode = NORMAL")
+                # Режим NORMAL отпускает блокировку только при следующем обращении к базе
+                conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if self._closed:
+                raise RuntimeError("ConnectionManager закрыт")
+            if len(self._readers) < self.read_pool_size:
+                conn = self._open_reader()
+                self._readers.append(conn)
+                return conn
+        return self._pool.get()
+
+    def _open_reader(self):
+        uri = f"file:{quote(self.db_path)}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout = 5000;")
+        conn.execute("PRAGMA query_only = ON;")
+        return conn
+
+    def close(self):
+        with self._pool_lock:
+            self._closed = True
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        with self._write_lock:
+            self.writer.close()
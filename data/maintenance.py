@@ -0,0 +1,256 @@
+"""
+Обслуживание базы: перенос в архив, удаление по сроку хранения, возврат места и проверки.
+
+Архив. Закрытые чаты старше archive_after_days задание переносит в холодный
+архив (SQLiteRepo.archive_closed_chats) при первой проверке и затем раз в час —
+в фоне, а не при входе пользователя.
+
+Срок хранения — список правил (статус, дней): чат с этим статусом (None —
+с любым), не менявшийся дольше срока, удаляется вместе с сообщениями,
+в том числе из архива. Правила задаются строкой "Закрыта:365,*:1095"
+(SQLITE_RETENTION) и по умолчанию пусты — ничего не удаляется.
+
+Место. После удаления страницы попадают в freelist, а файл не уменьшается.
+Новые базы создаются с auto_vacuum=INCREMENTAL, и фоновое задание
+(MaintenanceJob) возвращает свободные страницы маленькими порциями
+(PRAGMA incremental_vacuum(N)), пока в базу никто не пишет. Старую базу
+переводит в этот режим однократный полный VACUUM (enable_incremental_vacuum,
+команда vacuum ниже) — он блокирует запись на всё время, поэтому сам
+не запускается.
+
+Проверки: PRAGMA integrity_check (полное чтение базы, только по запросу)
+и PRAGMA optimize (дёшево; задание вызывает его раз в час).
+
+    python -m data.maintenance [report|retention|reclaim|vacuum|check|optimize] [--db PATH]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+AUTO_VACUUM_MODES = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+RECLAIM_SLICE_PAGES = 256    # страниц за одну транзакцию incremental_vacuum
+RECLAIM_PAUSE = 0.05         # с между порциями: писатели успевают вклиниться
+IDLE_SECONDS = 10            # столько секунд без записи — база «простаивает»
+CHECK_INTERVAL = 30          # с между проверками задания
+ARCHIVE_INTERVAL = 3600
+RETENTION_INTERVAL = 3600
+OPTIMIZE_INTERVAL = 3600
+
+
+def parse_retention(spec):
+    """ "Закрыта:365,*:1095" -> [("Закрыта", 365.0), (None, 1095.0)] """
+    policies = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        status, _, days = part.rpartition(":")
+        if not status or not days:
+            raise ValueError(f"Правило хранения должно быть вида 'статус:дней', получено {part!r}")
+        policies.append((None if status.strip() == "*" else status.strip(), float(days)))
+    return policies
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def db_stats(db) -> dict:
+    """Размер файла, страницы и доля свободных (freelist) у базы ConnectionManager"""
+    with db.read() as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    return {
+        "file_bytes": file_size(db.db_path),
+        "wal_bytes": file_size(db.db_path + "-wal"),
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_pages": freelist,
+        "freelist_bytes": freelist * page_size,
+        "fragmentation": round(freelist / page_count, 4) if page_count else 0.0,
+        "auto_vacuum": AUTO_VACUUM_MODES.get(mode, str(mode)),
+    }
+
+
+def reclaim_slice(db, pages=RECLAIM_SLICE_PAGES) -> int:
+    """Одна порция incremental_vacuum. Возвращает число освобождённых страниц."""
+    with db.autocommit() as conn:
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not before:
+            return 0
+        # execute() делает один шаг оператора, а incremental_vacuum освобождает
+        # по странице за шаг; executescript() доводит его до конца (своя транзакция)
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def checkpoint(db):
+    """Переносит WAL в базу: только после этого файл базы физически уменьшается"""
+    with db.autocommit() as conn:
+        return tuple(conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone())
+
+
+def enable_incremental_vacuum(db) -> bool:
+    """Переводит базу в auto_vacuum=INCREMENTAL полным VACUUM. False — уже переведена."""
+    with db.autocommit() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    return True
+
+
+def integrity_check(db, quick=False) -> list:
+    """Список проблем из PRAGMA integrity_check (quick_check); пустой — база цела"""
+    pragma = "quick_check" if quick else "integrity_check"
+    with db.read() as conn:
+        rows = [r[0] for r in conn.execute(f"PRAGMA {pragma}")]
+        rows += [f"FOREIGN KEY: {tuple(r)}" for r in conn.execute("PRAGMA foreign_key_check")]
+    return [r for r in rows if r != "ok"]
+
+
+def optimize(db):
+    with db.autocommit() as conn:
+        conn.execute("PRAGMA optimize")
+
+
+class MaintenanceJob:
+    """Фоновое обслуживание SQLiteRepo: архив, срок хранения, возврат места, optimize.
+
+    Возврат места идёт порциями по slice_pages и только пока база простаивает
+    (idle_seconds без записи); при появлении записи задание уступает до
+    следующей проверки. Итоги — в stats (см. SQLiteRepo.maintenance_report).
+    """
+
+    def __init__(self, repo, *, interval=CHECK_INTERVAL, idle_seconds=IDLE_SECONDS,
+                 slice_pages=RECLAIM_SLICE_PAGES, archive_interval=ARCHIVE_INTERVAL,
+                 retention_interval=RETENTION_INTERVAL, optimize_interval=OPTIMIZE_INTERVAL):
+        self.repo = repo
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.slice_pages = slice_pages
+        self.archive_interval = archive_interval
+        self.retention_interval = retention_interval
+        self.optimize_interval = optimize_interval
+        self._stopping = threading.Event()
+        self._last_archive = 0.0
+        self._last_retention = 0.0
+        self._last_optimize = time.monotonic()
+        self.stats = {"reclaimed_pages": 0, "reclaim_seconds": 0.0, "slices": 0,
+                      "archived": 0, "retention_deleted": 0, "last_run": None, "last_optimize": None, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name="sqlite-maintenance", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Ошибка обслуживания базы: {e}")
+
+    def run_once(self):
+        now = time.monotonic()
+        self.stats["last_run"] = time.time()
+        if now - self._last_archive >= self.archive_interval:
+            self._last_archive = now
+            self.stats["archived"] += self.repo.archive_closed_chats()
+        if self.repo.retention and now - self._last_retention >= self.retention_interval:
+            self._last_retention = now
+            self.stats["retention_deleted"] += self.repo.apply_retention()
+        if self._idle() and now - self._last_optimize >= self.optimize_interval:
+            self._last_optimize = now
+            optimize(self.repo.db)
+            self.stats["last_optimize"] = time.time()
+        self.reclaim_while_idle()
+
+    def _idle(self) -> bool:
+        return time.monotonic() - self.repo.last_write >= self.idle_seconds
+
+    def reclaim_while_idle(self) -> int:
+        total = 0
+        while self._idle() and not self._stopping.is_set():
+            t0 = time.perf_counter()
+            pages = reclaim_slice(self.repo.db, self.slice_pages)
+            self.stats["reclaim_seconds"] += time.perf_counter() - t0
+            if not pages:
+                break
+            total += pages
+            self.stats["reclaimed_pages"] += pages
+            self.stats["slices"] += 1
+            self._stopping.wait(RECLAIM_PAUSE)
+        if total:
+            checkpoint(self.repo.db)
+        return total
+
+
+def _print_report(report):
+    for key, value in report.items():
+        print(f"  {key:<18} {value}")
+
+
+def main(argv=None):
+    from .sqlite_store import SQLiteRepo
+
+    parser = argparse.ArgumentParser(prog="python -m data.maintenance", description="Обслуживание базы чатов")
+    parser.add_argument("command", nargs="?", default="report",
+                        choices=["report", "retention", "reclaim", "vacuum", "check", "optimize"])
+    parser.add_argument("--db", help="путь к support_chat.db")
+    parser.add_argument("--retention", help="правила хранения, напр. 'Закрыта:365,*:1095' (иначе SQLITE_RETENTION)")
+    parser.add_argument("--quick", action="store_true", help="check: quick_check вместо integrity_check")
+    args = parser.parse_args(argv)
+
+    retention = parse_retention(args.retention if args.retention is not None
+                                else os.environ.get("SQLITE_RETENTION", ""))
+    repo = SQLiteRepo(args.db, retention=retention, archive_after_days=0)
+    rc = 0
+    try:
+        if args.command == "retention":
+            print(f"Удалено чатов: {repo.apply_retention()}")
+        elif args.command == "reclaim":
+            t0 = time.perf_counter()
+            pages = 0
+            while True:
+                n = reclaim_slice(repo.db)
+                if not n:
+                    break
+                pages += n
+            checkpoint(repo.db)
+            print(f"Освобождено страниц: {pages} за {time.perf_counter() - t0:.2f} с")
+        elif args.command == "vacuum":
+            t0 = time.perf_counter()
+            changed = enable_incremental_vacuum(repo.db)
+            checkpoint(repo.db)
+            print(("Переведено в auto_vacuum=INCREMENTAL" if changed else "Уже auto_vacuum=INCREMENTAL")
+                  + f" за {time.perf_counter() - t0:.2f} с")
+        elif args.command == "check":
+            problems = repo.check_integrity(quick=args.quick)
+            for p in problems[:50]:
+                print(f"  {p}")
+            print("integrity_check: ok" if not problems else f"Проблем: {len(problems)}")
+            rc = 1 if problems else 0
+        elif args.command == "optimize":
+            optimize(repo.db)
+            print("PRAGMA optimize выполнен")
+        _print_report(repo.maintenance_report())
+    finally:
+        repo.close()
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,417 @@
+"""
+Версионные миграции схемы support_chat.db.
+
+Текущая версия хранится в PRAGMA user_version. Каждая миграция — функция,
+получающая курсор; migrate() применяет все миграции новее текущей версии,
+каждую в своей транзакции вместе с повышением user_version. Так существующие
+базы обновляются на месте, а новые проходят ту же цепочку с нуля.
+
+Новую миграцию добавляют в конец MIGRATIONS; уже выпущенные не меняют.
+"""
+
+
+def _m001_base_schema(cur):
+    """Исходные таблицы (для старых баз — no-op)"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS chats (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        title TEXT NOT NULL,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        text TEXT,
+        time TEXT,               -- "hh:mm" для отображения
+        operator TEXT,
+        attachment_path TEXT,
+        attachment_name TEXT,
+        attachment_size TEXT,
+        is_image INTEGER DEFAULT 0,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY(chat_id) REFERENCES chats(id) ON DELETE CASCADE
+    );
+    """)
+
+
+def _m002_hot_path_indexes(cur):
+    """Индексы под выборку чатов пользователя и сообщений чата (и под ON DELETE CASCADE)"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats(user_id, updated_at)")
+
+
+def _m003_fulltext_search(cur):
+    """FTS5-индексы по тексту сообщений и названиям чатов, синхронизируемые триггерами"""
+    # Сообщения: external content поверх messages (rowid = messages.id, текст не дублируется)
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        text, attachment_name,
+        content='messages', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, text, attachment_name)
+        VALUES (new.id, new.text, new.attachment_name);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, text, attachment_name)
+        VALUES ('delete', old.id, old.text, old.attachment_name);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text, attachment_name ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, text, attachment_name)
+        VALUES ('delete', old.id, old.text, old.attachment_name);
+        INSERT INTO messages_fts(rowid, text, attachment_name)
+        VALUES (new.id, new.text, new.attachment_name);
+    END
+    """)
+    cur.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+    # Чаты: у chats нет целочисленного ключа (неявный rowid может смениться при VACUUM),
+    # поэтому отдельная небольшая таблица с chat_id
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+        chat_id UNINDEXED, title,
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS chats_fts_ai AFTER INSERT ON chats BEGIN
+        INSERT INTO chats_fts(chat_id, title) VALUES (new.id, new.title);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS chats_fts_ad AFTER DELETE ON chats BEGIN
+        DELETE FROM chats_fts WHERE chat_id = old.id;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS chats_fts_au AFTER UPDATE OF title ON chats BEGIN
+        UPDATE chats_fts SET title = new.title WHERE chat_id = old.id;
+    END
+    """)
+    cur.execute("DELETE FROM chats_fts")
+    cur.execute("INSERT INTO chats_fts(chat_id, title) SELECT id, title FROM chats")
+
+
+# Превью последнего сообщения для списка чатов: текст или имя вложения, до 120 символов
+_PREVIEW_SQL = "substr(coalesce({m}.text, '📎 ' || {m}.attachment_name, ''), 1, 120)"
+
+
+def _m004_chat_summaries(cur):
+    """Сводка по чату прямо в chats: список и история рисуются без чтения messages"""
+    cur.execute("ALTER TABLE chats ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE chats ADD COLUMN last_message_preview TEXT")
+    cur.execute("ALTER TABLE chats ADD COLUMN last_message_at TEXT")
+    cur.execute("ALTER TABLE chats ADD COLUMN last_sender TEXT")
+    cur.execute("ALTER TABLE chats ADD COLUMN unread_count INTEGER NOT NULL DEFAULT 0")
+
+    preview_new = _PREVIEW_SQL.format(m="new")
+    preview_last = _PREVIEW_SQL.format(m="l")
+    # Непрочитанными считаются входящие (не от пользователя); сбрасывает SQLiteRepo.mark_read
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS chats_summary_ai AFTER INSERT ON messages BEGIN
+        UPDATE chats SET
+            message_count = message_count + 1,
+            last_message_preview = {preview_new},
+            last_message_at = new.created_at,
+            last_sender = new.sender,
+            unread_count = unread_count + (new.sender <> 'user')
+        WHERE id = new.chat_id;
+    END
+    """)
+    # Удаление одиночного сообщения; при каскадном удалении чата строки chats уже нет
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS chats_summary_ad AFTER DELETE ON messages BEGIN
+        UPDATE chats SET message_count = max(message_count - 1, 0) WHERE id = old.chat_id;
+        UPDATE chats SET
+            (last_message_preview, last_message_at, last_sender) = (
+                SELECT {preview_last}, l.created_at, l.sender FROM messages l
+                WHERE l.chat_id = old.chat_id ORDER BY l.id DESC LIMIT 1
+            )
+        WHERE id = old.chat_id
+          AND NOT EXISTS (SELECT 1 FROM messages WHERE chat_id = old.chat_id AND id > old.id);
+    END
+    """)
+
+    # Заполнение для существующих чатов
+    cur.execute("UPDATE chats SET message_count = (SELECT COUNT(*) FROM messages m WHERE m.chat_id = chats.id)")
+    cur.execute(f"""
+    UPDATE chats SET
+        (last_message_preview, last_message_at, last_sender) = (
+            SELECT {preview_last}, l.created_at, l.sender FROM messages l
+            WHERE l.chat_id = chats.id ORDER BY l.id DESC LIMIT 1
+        )
+    """)
+
+
+def _m005_sequences(cur):
+    """Счётчики идентификаторов: номер нового чата выдаётся за O(1), а не через MAX() по chats"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """)
+    # Продолжаем нумерацию существующих CH-NNNN
+    cur.execute("""
+    INSERT OR IGNORE INTO sequences (name, value)
+    SELECT 'chat', COALESCE(MAX(CAST(SUBSTR(id, 4) AS INTEGER)), 0) FROM chats WHERE id LIKE 'CH-%'
+    """)
+
+
+def _m006_server_message_ids(cur):
+    """Идентификатор сообщения на сервере: повторы событий WS/HTTP схлопываются уникальным индексом"""
+    cur.execute("ALTER TABLE messages ADD COLUMN server_id TEXT")
+    cur.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_server_id
+    ON messages(server_id) WHERE server_id IS NOT NULL
+    """)
+
+
+def _m007_attachment_blobs(cur):
+    """Вложения по хешу содержимого (data/blob_store.py) с подсчётом ссылок"""
+    cur.execute("ALTER TABLE messages ADD COLUMN attachment_hash TEXT")
+    cur.execute("ALTER TABLE messages ADD COLUMN attachment_bytes INTEGER")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        refcount INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """)
+    # Кандидаты на сборку мусора находятся без просмотра всей таблицы
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(hash) WHERE refcount <= 0")
+    # Срабатывают и при каскадном удалении сообщений вместе с чатом
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS blobs_ref_ai AFTER INSERT ON messages
+    WHEN new.attachment_hash IS NOT NULL BEGIN
+        INSERT OR IGNORE INTO blobs (hash, size, refcount)
+        VALUES (new.attachment_hash, coalesce(new.attachment_bytes, 0), 0);
+        UPDATE blobs SET refcount = refcount + 1 WHERE hash = new.attachment_hash;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS blobs_ref_ad AFTER DELETE ON messages
+    WHEN old.attachment_hash IS NOT NULL BEGIN
+        UPDATE blobs SET refcount = refcount - 1 WHERE hash = old.attachment_hash;
+    END
+    """)
+
+
+def _m008_archive_candidates(cur):
+    """Индекс под выбор закрытых чатов для переноса в архив (SQLiteRepo.archive_closed_chats)"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chats_status_updated ON chats(status, updated_at)")
+
+
+# Строка времени, записанная приложением в локальном времени -> эпоха в миллисекундах
+MS_FROM_TEXT_SQL = "(CAST(strftime('%s', {col}, 'utc') AS INTEGER) * 1000)"
+
+
+def _m009_epoch_timestamps(cur):
+    """Время как целое число миллисекунд эпохи: сортировка, выборки по диапазону, аналитика.
+
+    Текстовые created_at/updated_at/time остаются (их читают старые версии
+    приложения), но порядок и диапазоны считаются только по *_ms.
+    """
+    cur.execute("ALTER TABLE messages ADD COLUMN created_ms INTEGER")
+    cur.execute("ALTER TABLE chats ADD COLUMN created_ms INTEGER")
+    cur.execute("ALTER TABLE chats ADD COLUMN updated_ms INTEGER")
+    cur.execute("ALTER TABLE chats ADD COLUMN last_message_ms INTEGER")
+
+    cur.execute(f"UPDATE messages SET created_ms = {MS_FROM_TEXT_SQL.format(col='created_at')}")
+    cur.execute(f"""
+    UPDATE chats SET
+        created_ms = {MS_FROM_TEXT_SQL.format(col='created_at')},
+        updated_ms = {MS_FROM_TEXT_SQL.format(col='updated_at')},
+        last_message_ms = {MS_FROM_TEXT_SQL.format(col='last_message_at')}
+    """)
+
+    # Индексы по строковому updated_at заменяются индексами по updated_ms
+    cur.execute("DROP INDEX IF EXISTS idx_chats_user_updated")
+    cur.execute("DROP INDEX IF EXISTS idx_chats_status_updated")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_updated_ms ON chats(user_id, updated_ms)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chats_status_updated_ms ON chats(status, updated_ms)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages(chat_id, created_ms)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_ms)")
+
+    # Сводка чата: время последнего сообщения тоже в мс
+    preview_new = _PREVIEW_SQL.format(m="new")
+    preview_last = _PREVIEW_SQL.format(m="l")
+    cur.execute("DROP TRIGGER IF EXISTS chats_summary_ai")
+    cur.execute("DROP TRIGGER IF EXISTS chats_summary_ad")
+    cur.execute(f"""
+    CREATE TRIGGER chats_summary_ai AFTER INSERT ON messages BEGIN
+        UPDATE chats SET
+            message_count = message_count + 1,
+            last_message_preview = {preview_new},
+            last_message_at = new.created_at,
+            last_message_ms = new.created_ms,
+            last_sender = new.sender,
+            unread_count = unread_count + (new.sender <> 'user')
+        WHERE id = new.chat_id;
+    END
+    """)
+    cur.execute(f"""
+    CREATE TRIGGER chats_summary_ad AFTER DELETE ON messages BEGIN
+        UPDATE chats SET message_count = max(message_count - 1, 0) WHERE id = old.chat_id;
+        UPDATE chats SET
+            (last_message_preview, last_message_at, last_message_ms, last_sender) = (
+                SELECT {preview_last}, l.created_at, l.created_ms, l.sender FROM messages l
+                WHERE l.chat_id = old.chat_id ORDER BY l.id DESC LIMIT 1
+            )
+        WHERE id = old.chat_id
+          AND NOT EXISTS (SELECT 1 FROM messages WHERE chat_id = old.chat_id AND id > old.id);
+    END
+    """)
+
+# Текущее время в мс эпохи внутри SQL (unixepoch('subsec') есть только с SQLite 3.42)
+NOW_MS_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+
+def _m010_status_log(cur):
+    """Журнал смен статуса чата: из него аналитика считает время в каждом статусе.
+
+    Для уже существующих чатов истории нет: пишется одна запись с текущим
+    статусом от updated_ms (смена статуса всегда обновляет updated_ms).
+    """
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS chat_status_log (
+        id INTEGER PRIMARY KEY,
+        chat_id TEXT NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+        status TEXT NOT NULL,
+        changed_ms INTEGER NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_status_log_chat ON chat_status_log(chat_id, changed_ms)")
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS chats_status_log_ai AFTER INSERT ON chats BEGIN
+        INSERT INTO chat_status_log (chat_id, status, changed_ms)
+        VALUES (new.id, new.status, coalesce(new.created_ms, new.updated_ms, {NOW_MS_SQL}));
+    END
+    """)
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS chats_status_log_au AFTER UPDATE OF status ON chats
+    WHEN new.status IS NOT old.status BEGIN
+        INSERT INTO chat_status_log (chat_id, status, changed_ms)
+        VALUES (new.id, new.status, coalesce(new.updated_ms, {NOW_MS_SQL}));
+    END
+    """)
+    cur.execute("""
+    INSERT INTO chat_status_log (chat_id, status, changed_ms)
+    SELECT id, status, coalesce(updated_ms, created_ms, 0) FROM chats
+    """)
+
+
+MIGRATIONS = [
+    (1, _m001_base_schema),
+    (2, _m002_hot_path_indexes),
+    (3, _m003_fulltext_search),
+    (4, _m004_chat_summaries),
+    (5, _m005_sequences),
+    (6, _m006_server_message_ids),
+    (7, _m007_attachment_blobs),
+    (8, _m008_archive_candidates),
+    (9, _m009_epoch_timestamps),
+    (10, _m010_status_log),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Доводит схему до SCHEMA_VERSION. Возвращает список применённых версий."""
+    current = get_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"База создана более новой версией приложения (схема {current}, поддерживается {SCHEMA_VERSION})"
+        )
+    applied = []
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN")
+            step(cur)
+            cur.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def restore_deferred_ddl(conn):
+    """Создаёт заново индексы и триггеры, снятые на время импорта (data/transfer.py).
+    Возвращает их число; 0 — если импорт ничего не откладывал."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='_import_ddl'").fetchone():
+        return 0
+    rows = conn.execute("SELECT name, sql FROM _import_ddl ORDER BY type").fetchall()
+    for name, sql in rows:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name=?", (name,)).fetchone():
+            conn.execute(sql)
+    conn.execute("DROP TABLE _import_ddl")
+    return len(rows)
+
+# Горячие запросы приложения: по каждому план не должен содержать полного просмотра таблицы
+HOT_QUERIES = [
+    ("чаты пользователя",
+     "SELECT * FROM chats WHERE user_id=? ORDER BY updated_ms DESC", ("u",)),
+    ("чаты, изменённые с момента",
+     "SELECT * FROM chats WHERE user_id=? AND updated_ms>=? ORDER BY updated_ms", ("u", 0)),
+    ("сообщения чата",
+     "SELECT * FROM messages WHERE chat_id=? ORDER BY id ASC", ("c",)),
+    ("страница старых сообщений",
+     "SELECT * FROM messages WHERE chat_id=? AND id<? ORDER BY id DESC LIMIT ?", ("c", 100, 51)),
+    ("дедупликация по server_id",
+     "SELECT 1 FROM messages WHERE server_id=?", ("s",)),
+    ("каскадное удаление сообщений",
+     "DELETE FROM messages WHERE chat_id=?", ("c",)),
+    ("кандидаты в архив",
+     "SELECT * FROM chats WHERE status='Закрыта' AND updated_ms < ? LIMIT ?", (0, 200)),
+    ("сообщения чата за период",
+     "SELECT * FROM messages WHERE chat_id=? AND created_ms>=? AND created_ms<? ORDER BY created_ms, id LIMIT ?",
+     ("c", 0, 1, 100)),
+    ("все сообщения за период",
+     "SELECT * FROM messages WHERE created_ms>=? AND created_ms<? ORDER BY created_ms, id LIMIT ?", (0, 1, 100)),
+    ("журнал статусов чата",
+     "SELECT * FROM chat_status_log WHERE chat_id=? ORDER BY changed_ms", ("c",)),
+    ("каскадное удаление журнала статусов",
+     "DELETE FROM chat_status_log WHERE chat_id=?", ("c",)),
+]
+
+
+def scan_offenders(conn, queries=None):
+    """Возвращает [(название, строка плана)] для горячих запросов, ушедших в полный SCAN"""
+    offenders = []
+    for name, sql, params in (queries or HOT_QUERIES):
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[3]
+            if detail.startswith("SCAN ") and "CONSTANT ROW" not in detail:
+                offenders.append((name, detail))
+    return offenders
+
+
+def check_query_plans(conn, queries=None):
+    """Падает с AssertionError, если хотя бы один горячий запрос сканирует таблицу"""
+    offenders = scan_offenders(conn, queries)
+    if offenders:
+        lines = "\n".join(f"  {name}: {detail}" for name, detail in offenders)
+        raise AssertionError(f"Полный просмотр таблицы в горячих запросах:\n{lines}")
@@ -1,12 +1,33 @@
+import atexit
 import os
-import sqlite3
 import random
-from datetime import datetime
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from .test_data import TEST_CHATS
+from .migrations import migrate, restore_deferred_ddl, MS_FROM_TEXT_SQL
+from .write_behind import WriteBehindWriter
+from .blob_store import BlobStore, human_size
+from .archive import ChatArchive
+from .connections import ConnectionManager, READ_POOL_SIZE
+from .chat_cache import ChatCache, CACHE_MAX_MESSAGES
+from . import analytics, maintenance
 from os import environ
 
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
 OPERATORS = ["Петрова Аня", "Сидоров Михаил", "Головач Лена"]
 
+# Вложение без ссылок удаляется не раньше, чем через столько секунд после последнего
+# использования файла: сообщение с ним может ещё стоять в очереди записи
+BLOB_GC_GRACE_SECONDS = 60
+
+# Закрытые чаты без изменений дольше стольких дней уходят в архив (0 — не архивировать)
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_BATCH = 200
+
 def _now_dt_str():
     return datetime.now().strftime("%Y-%m-%d %H:%M")
 
@@ -16,46 +37,178 @@ def _now_time_str():
 def _now_ts():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+def _now_ms():
+    return int(time.time() * 1000)
+
+# Верхняя граница «до бесконечности» для выборок по времени
+_MAX_MS = 2 ** 63 - 1
+
+
+def ms_to_datetime(ms):
+    """Эпоха в мс -> локальный datetime (для форматирования при выводе)"""
+    return datetime.fromtimestamp(ms / 1000) if ms is not None else None
+
+
+def _opt(row, key):
+    # Строки архива, сохранённые до появления колонки, её не содержат
+    try:
+        return row[key]
+    except (KeyError, IndexError):
+        return None
+
+
+def fts_query(text: str) -> str:
+    """Строка пользователя -> безопасный запрос FTS5.
+
+    Все слова обязательны; последнее ищется по префиксу (его ещё дописывают),
+    остальные — целиком: префиксный поиск по длинному слову заметно дороже.
+    """
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return ""
+    return " ".join([f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*'])
+
+
+def format_chat_id(n: int) -> str:
+    """Отображаемый id чата по номеру из последовательности"""
+    return f"CH-{n:04d}"
+
+
+def make_snippet(text: str, words, context: int = 10) -> str:
+    """Фрагмент текста вокруг первого совпадения; совпавшие слова — в [квадратных скобках]"""
+    prefixes = [w.lower() for w in words]
+    tokens = text.split()
+    hits = [i for i, t in enumerate(tokens)
+            if any(w.lower().startswith(p) for w in re.findall(r"\w+", t) for p in prefixes)]
+    if not hits:
+        return " ".join(tokens[:context]) + ("…" if len(tokens) > context else "")
+    start = max(0, hits[0] - context // 2)
+    end = min(len(tokens), start + context)
+    hit_set = set(hits)
+    out = [f"[{t}]" if i in hit_set else t for i, t in enumerate(tokens[start:end], start)]
+    return ("…" if start > 0 else "") + " ".join(out) + ("…" if end < len(tokens) else "")
+
+
 class SQLiteRepo:
-    def __init__(self, db_path=None):
+    """Локальное хранилище чатов.
+
+    write_behind=True включает отложенную запись (см. data/write_behind.py):
+    add_message / update_chat_status / rename_chat / delete_chat только ставят
+    операцию в очередь, коммит делает поток-писатель пачками. read_your_writes
+    управляет порядком чтения: при True чтение сначала дожидается очереди
+    записи, при False может отставать на flush_interval_ms.
+    synchronous — PRAGMA synchronous для всех соединений (FULL / NORMAL / OFF).
+    blob_dir — каталог вложений (по умолчанию blobs/ рядом с базой).
+    archive_path — база холодного архива (data/archive.py), archive_after_days —
+    возраст закрытого чата для переноса в архив.
+
+    Соединения — data/connections.py: запись идёт через одно пишущее
+    соединение (self.conn), чтение — через пул соединений только для чтения,
+    так что методы чтения можно вызывать из нескольких потоков сразу.
+
+    get_chat / get_messages отвечают из LRU-кэша (data/chat_cache.py) размером
+    cache_messages сообщений; методы записи сбрасывают записи своих чатов.
+    Счётчики попаданий — cache_stats().
+
+    retention — правила срока хранения [(статус или None, дней)], их применяет
+    apply_retention(); start_maintenance() запускает фоновое обслуживание
+    (перенос в архив, срок хранения, возврат места, optimize — см. data/maintenance.py).
+    """
+
+    def __init__(self, db_path=None, *, write_behind=False, synchronous="NORMAL",
+                 flush_interval_ms=5, max_batch=500, read_your_writes=True, blob_dir=None,
+                 archive_path=None, archive_after_days=ARCHIVE_AFTER_DAYS, read_pool_size=READ_POOL_SIZE,
+                 cache_messages=CACHE_MAX_MESSAGES, retention=None):
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous должен быть одним из {SYNCHRONOUS_MODES}, получено {synchronous!r}")
         if db_path is None:
             db_path = os.path.join(os.path.dirname(__file__), "support_chat.db")
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
-        self.conn.execute("PRAGMA foreign_keys = ON;")
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.blobs = BlobStore(blob_dir or os.path.join(os.path.dirname(db_path), "blobs"))
+        self.archive = ChatArchive(archive_path or os.path.splitext(db_path)[0] + "_archive.db",
+                                   synchronous=synchronous)
+        self.archive_after_days = archive_after_days
+        # Перенос в архив (поток обслуживания) и запись в чат (возврат из архива + постановка
+        # записи) не перемежаются: иначе запись могла прийти в чат, который уже удаляется
+        self._archive_lock = threading.RLock()
+        self.cache = ChatCache(cache_messages)
+        self.retention = list(retention or [])
+        # Момент последней записи (time.monotonic): по нему обслуживание определяет простой
+        self.last_write = time.monotonic()
+        self.maintenance = None
+        self.db = ConnectionManager(db_path, synchronous=synchronous, read_pool_size=read_pool_size)
+        # Пишущее соединение; чтение — через self._reading()
+        self.conn = self.db.writer
         self.ensure_schema()
         self.seed_if_empty()
+        self.read_your_writes = read_your_writes
+        # server_id, ещё стоящие в очереди write-behind (их нет в базе, но они уже приняты)
+        self._inflight_server_ids = set()
+        self.writer = None
+        if write_behind:
+            self.writer = WriteBehindWriter(db_path, flush_interval_ms=flush_interval_ms,
+                                            max_batch=max_batch, synchronous=synchronous)
+
+    def _write(self, op, wait=False, chats=()):
+        """Выполняет op(conn): сразу с коммитом или через очередь write-behind.
+        chats — id чатов, которые меняет op: их записи в кэше сбрасываются."""
+        self.last_write = time.monotonic()
+        if self.writer is None:
+            try:
+                with self.db.transaction() as conn:
+                    return op(conn)
+            finally:
+                # После коммита: чтение, начатое до него, не положит в кэш старое (см. ChatCache)
+                if chats:
+                    self.cache.invalidate(chats)
+        fut = self._submit(op, chats)
+        return fut.result() if wait else None
+
+    def _submit(self, op, chats=()):
+        self.last_write = time.monotonic()
+        if chats:
+            # Сейчас — чтобы попаданий не было до коммита, и после коммита — как в синхронном режиме
+            self.cache.invalidate(chats)
+        fut = self.writer.submit(op)
+        if chats:
+            fut.add_done_callback(lambda f: self.cache.invalidate(chats))
+        return fut
+
+    def cache_stats(self) -> dict:
+        """Счётчики кэша чатов: hits, misses, hit_rate, evictions, размер"""
+        return self.cache.stats()
+
+    def _before_read(self):
+        if self.writer is not None and self.read_your_writes:
+            self.writer.flush()
+
+    @contextmanager
+    def _reading(self):
+        """Соединение для чтения (после сброса очереди записи, если read_your_writes)"""
+        self._before_read()
+        with self.db.read() as conn:
+            yield conn
+
+    def flush(self, timeout=None):
+        """Барьер записи: всё, что поставлено в очередь, закоммичено на диск"""
+        if self.writer is not None:
+            self.writer.flush(timeout)
+
+    def close(self):
+        self.stop_maintenance()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.db.close()
+        self.archive.close()
 
     def ensure_schema(self):
-        cur = self.conn.cursor()
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS chats (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            title TEXT NOT NULL,
-            status TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL
-        );
-        """)
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id TEXT NOT NULL,
-            sender TEXT NOT NULL,
-            text TEXT,
-            time TEXT,               -- "hh:mm" для отображения
-            operator TEXT,
-            attachment_path TEXT,
-            attachment_name TEXT,
-            attachment_size TEXT,
-            is_image INTEGER DEFAULT 0,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY(chat_id) REFERENCES chats(id) ON DELETE CASCADE
-        );
-        """)
-        self.conn.commit()
+        """Создаёт/обновляет схему через версионные миграции (см. data/migrations.py)"""
+        # Индексы и триггеры, оставшиеся снятыми после прерванного импорта
+        with self.db.transaction() as conn:
+            restore_deferred_ddl(conn)
+        migrate(self.conn)
 
     def seed_if_empty(self):
         # В "боевом" режиме сидинг тестовыми данными отключён
@@ -75,12 +228,16 @@ class SQLiteRepo:
             )
             for m in c.get("messages", []):
                 cur.execute(
-                    """INSERT INTO messages (chat_id,sender,text,time,operator,created_at)
-                       VALUES (?,?,?,?,?,?)""",
+                    """INSERT INTO messages (chat_id,sender,text,time,operator,created_at,created_ms)
+                       VALUES (?,?,?,?,?,?,?)""",
                     (c["id"], m.get("sender","user"), m.get("text"),
                      m.get("time") or _now_time_str(), m.get("operator"),
-                     _now_ts())
+                     _now_ts(), _now_ms())
                 )
+        # Время тестовых чатов задано строками — переводим в мс так же, как миграция
+        cur.execute(f"""UPDATE chats SET created_ms = {MS_FROM_TEXT_SQL.format(col='created_at')},
+                                         updated_ms = {MS_FROM_TEXT_SQL.format(col='updated_at')}
+                        WHERE updated_ms IS NULL""")
         self.conn.commit()
 
     def _chat_row_to_dict(self, row):
@@ -91,101 +248,744 @@ class SQLiteRepo:
             "status": row["status"],
             "created_at": row["created_at"],
             "updated_at": row["updated_at"],
+            "created_ms": _opt(row, "created_ms"),
+            "updated_ms": _opt(row, "updated_ms"),
+            "message_count": row["message_count"],
+            "last_message_preview": row["last_message_preview"],
+            "last_message_at": row["last_message_at"],
+            "last_message_ms": _opt(row, "last_message_ms"),
+            "last_sender": row["last_sender"],
+            "unread_count": row["unread_count"],
             "messages": []
         }
 
     def _message_row_to_dict(self, row):
+        if row["attachment_hash"]:
+            attach = {
+                "path": self.blobs.path_for(row["attachment_hash"]),
+                "name": row["attachment_name"],
+                "size": human_size(row["attachment_bytes"] or 0),
+                "hash": row["attachment_hash"],
+                "bytes": row["attachment_bytes"],
+                "is_image": bool(row["is_image"])
+            }
+            return {"id": row["id"], "sender": row["sender"], "attachment": attach, "time": row["time"],
+                    "created_ms": _opt(row, "created_ms")}
         if row["attachment_path"]:
+            # Старые вложения: ссылка на исходный файл пользователя
             attach = {
                 "path": row["attachment_path"],
                 "name": row["attachment_name"],
                 "size": row["attachment_size"],
                 "is_image": bool(row["is_image"])
             }
-            return {"sender": row["sender"], "attachment": attach, "time": row["time"]}
-        msg = {"sender": row["sender"], "text": row["text"], "time": row["time"]}
+            return {"id": row["id"], "sender": row["sender"], "attachment": attach, "time": row["time"],
+                    "created_ms": _opt(row, "created_ms")}
+        msg = {"id": row["id"], "sender": row["sender"], "text": row["text"], "time": row["time"],
+               "created_ms": _opt(row, "created_ms")}
         if row["operator"]:
             msg["operator"] = row["operator"]
         return msg
 
-    def load_user_chats(self, user_id: str):
-        cur = self.conn.cursor()
-        chats = []
-        for crow in cur.execute("SELECT * FROM chats WHERE user_id=? ORDER BY updated_at DESC", (user_id,)):
-            chat = self._chat_row_to_dict(crow)
-            mrows = cur.execute("SELECT * FROM messages WHERE chat_id=? ORDER BY id ASC", (crow["id"],)).fetchall()
-            chat["messages"] = [self._message_row_to_dict(r) for r in mrows]
-            chats.append(chat)
+    def load_user_chats(self, user_id: str, with_messages: bool = True):
+        """Чаты пользователя (новее — выше).
+
+        Два запроса: чаты и одним проходом все их сообщения (уже по порядку
+        индекса chat_id, id), которые раскладываются по чатам в Python. Время
+        здесь уходит на чтение самих сообщений, а не на число запросов, так что
+        по скорости это как N+1; список чатов быстрым делает with_messages=False —
+        сообщения не читаются вовсе, их подгружают по требованию (get_chat).
+        """
+        with self._reading() as conn:
+            cur = conn.cursor()
+            chats = [self._chat_row_to_dict(r) for r in cur.execute(
+                "SELECT * FROM chats WHERE user_id=? ORDER BY updated_ms DESC", (user_id,))]
+            if not with_messages or not chats:
+                return chats
+            by_id = {c["id"]: c for c in chats}
+            mrows = cur.execute(
+                """SELECT * FROM messages WHERE chat_id IN (SELECT id FROM chats WHERE user_id=?)
+                   ORDER BY chat_id, id""", (user_id,))
+            for r in mrows:
+                chat = by_id.get(r["chat_id"])
+                if chat is not None:
+                    chat["messages"].append(self._message_row_to_dict(r))
         return chats
 
-    def get_chat(self, chat_id: str):
-        cur = self.conn.cursor()
-        crow = cur.execute("SELECT * FROM chats WHERE id=?", (chat_id,)).fetchone()
-        if not crow:
+    def get_chat(self, chat_id: str, message_limit: int = None):
+        """Чат с сообщениями. С message_limit — только последняя страница
+        (см. get_messages), а chat["has_more"] говорит, есть ли более старые.
+        Недавно открытый чат отдаётся из кэша без обращения к SQLite."""
+        key = ("chat", chat_id, message_limit)
+        chat = self.cache.get(key)
+        if chat is not None:
+            return chat
+        generation = self.cache.generation(chat_id)
+        chat = self._load_chat(chat_id, message_limit)
+        self.cache.put(key, chat, generation)
+        return chat
+
+    def _load_chat(self, chat_id, message_limit):
+        with self._reading() as conn:
+            cur = conn.cursor()
+            crow = cur.execute("SELECT * FROM chats WHERE id=?", (chat_id,)).fetchone()
+            if not crow:
+                return self._get_archived_chat(chat_id, message_limit)
+            chat = self._chat_row_to_dict(crow)
+            if message_limit is None:
+                mrows = cur.execute("SELECT * FROM messages WHERE chat_id=? ORDER BY id ASC", (chat_id,)).fetchall()
+                chat["messages"] = [self._message_row_to_dict(r) for r in mrows]
+                chat["has_more"] = False
+            else:
+                chat["messages"], chat["has_more"] = self._messages_page(cur, chat_id, None, message_limit)
+        return chat
+
+    def get_messages(self, chat_id: str, before_id: int = None, limit: int = 50):
+        """Страница сообщений чата (keyset-пагинация по id).
+
+        Без before_id — самые новые limit сообщений, иначе limit сообщений
+        старше before_id. Внутри страницы порядок хронологический.
+        Возвращает (messages, has_more).
+        """
+        key = ("page", chat_id, before_id, limit)
+        page = self.cache.get(key)
+        if page is not None:
+            return page
+        generation = self.cache.generation(chat_id)
+        page = self._load_page(chat_id, before_id, limit)
+        self.cache.put(key, page, generation)
+        return page
+
+    def _load_page(self, chat_id, before_id, limit):
+        if chat_id in self.archive:
+            entry = self.archive.get(chat_id)
+            if entry:
+                return self._archived_page(entry[1], before_id, limit)
+        with self._reading() as conn:
+            return self._messages_page(conn.cursor(), chat_id, before_id, limit)
+
+    def _messages_page(self, cur, chat_id, before_id, limit):
+        # Берём на одну строку больше, чтобы без COUNT узнать, есть ли что-то старше
+        if before_id is None:
+            rows = cur.execute(
+                "SELECT * FROM messages WHERE chat_id=? ORDER BY id DESC LIMIT ?",
+                (chat_id, limit + 1)).fetchall()
+        else:
+            rows = cur.execute(
+                "SELECT * FROM messages WHERE chat_id=? AND id<? ORDER BY id DESC LIMIT ?",
+                (chat_id, before_id, limit + 1)).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        return [self._message_row_to_dict(r) for r in rows], has_more
+
+    def get_messages_between(self, chat_id: str, since_ms: int, until_ms: int = None, limit: int = 1000):
+        """Сообщения чата с since_ms (включительно) до until_ms (не включительно) по времени.
+        Идёт по индексу (chat_id, created_ms); архив не затрагивает."""
+        until_ms = _MAX_MS if until_ms is None else until_ms
+        with self._reading() as conn:
+            rows = conn.execute(
+                """SELECT * FROM messages WHERE chat_id=? AND created_ms>=? AND created_ms<?
+                   ORDER BY created_ms, id LIMIT ?""", (chat_id, since_ms, until_ms, limit)).fetchall()
+        return [self._message_row_to_dict(r) for r in rows]
+
+    def messages_since(self, since_ms: int, until_ms: int = None, limit: int = 1000):
+        """Сообщения всех чатов за период (синхронизация, аналитика); у каждого — chat_id.
+        Для продолжения передайте created_ms последнего как since_ms (дубли на границе — по id)."""
+        until_ms = _MAX_MS if until_ms is None else until_ms
+        with self._reading() as conn:
+            rows = conn.execute(
+                """SELECT * FROM messages WHERE created_ms>=? AND created_ms<?
+                   ORDER BY created_ms, id LIMIT ?""", (since_ms, until_ms, limit)).fetchall()
+        result = []
+        for r in rows:
+            msg = self._message_row_to_dict(r)
+            msg["chat_id"] = r["chat_id"]
+            result.append(msg)
+        return result
+
+    def chats_updated_since(self, user_id: str, since_ms: int):
+        """Чаты пользователя, изменённые начиная с since_ms (старые — первыми)"""
+        with self._reading() as conn:
+            rows = conn.execute(
+                "SELECT * FROM chats WHERE user_id=? AND updated_ms>=? ORDER BY updated_ms",
+                (user_id, since_ms)).fetchall()
+        return [self._chat_row_to_dict(r) for r in rows]
+
+    def _get_archived_chat(self, chat_id, message_limit):
+        """get_chat для чата из архива: те же поля плюс chat["archived"] = True"""
+        entry = self.archive.get(chat_id)
+        if not entry:
             return None
+        crow, mrows = entry
         chat = self._chat_row_to_dict(crow)
-        mrows = cur.execute("SELECT * FROM messages WHERE chat_id=? ORDER BY id ASC", (chat_id,)).fetchall()
-        chat["messages"] = [self._message_row_to_dict(r) for r in mrows]
+        chat["archived"] = True
+        if message_limit is None:
+            chat["messages"] = [self._message_row_to_dict(r) for r in mrows]
+            chat["has_more"] = False
+        else:
+            chat["messages"], chat["has_more"] = self._archived_page(mrows, None, message_limit)
         return chat
 
-    def _next_chat_id(self):
-        cur = self.conn.cursor()
-        row = cur.execute("SELECT MAX(CAST(SUBSTR(id,4) AS INTEGER)) FROM chats WHERE id LIKE 'CH-%'").fetchone()
-        n = row[0] or 0
-        return f"CH-{n+1:04d}"
+    def _archived_page(self, mrows, before_id, limit):
+        if before_id is not None:
+            mrows = [r for r in mrows if r["id"] < before_id]
+        page = mrows[-limit:] if limit else []
+        return [self._message_row_to_dict(r) for r in page], len(mrows) > len(page)
+
+    def list_archived_chats(self, user_id: str):
+        """Архивные чаты пользователя (без сообщений) — для истории"""
+        chats = []
+        for crow in self.archive.list_chats(user_id):
+            chat = self._chat_row_to_dict(crow)
+            chat["archived"] = True
+            chats.append(chat)
+        return chats
+
+    def search(self, user_id: str, query: str, limit: int = 50, scan: int = 400):
+        """Полнотекстовый поиск чатов пользователя по сообщениям и названиям (FTS5).
+
+        Все слова запроса должны встретиться (см. fts_query). Ранжируются
+        (bm25) только scan самых свежих совпавших сообщений — так частые слова
+        не заставляют оценивать весь индекс. Совпадения в названии весят вдвое.
+        Возвращает чаты по убыванию релевантности, у каждого — snippet
+        с подсвеченным совпадением ([...]). Архивные чаты тоже ищутся
+        (chat["archived"] = True).
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        with self._reading() as conn:
+            results = self._search_hot(conn.cursor(), user_id, match, query, limit, scan)
+        archived = self._search_archive(user_id, match, query, limit)
+        if archived:
+            results = sorted(results + archived, key=lambda sc: sc[0])[:limit]
+        return [chat for _, chat in results]
+
+    def _search_hot(self, cur, user_id, match, query, limit, scan):
+        """[(score, chat)] по горячим таблицам"""
+        best = {}  # chat_id -> (score, message_id | None)
+        for r in cur.execute(
+                """SELECT h.mid, h.score, m.chat_id FROM (
+                       SELECT rowid AS mid, bm25(messages_fts) AS score FROM messages_fts
+                       WHERE messages_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+                   ) h
+                   JOIN messages m ON m.id = h.mid
+                   JOIN chats c ON c.id = m.chat_id AND c.user_id = ?""",
+                (match, scan, user_id)):
+            if r["chat_id"] not in best or r["score"] < best[r["chat_id"]][0]:
+                best[r["chat_id"]] = (r["score"], r["mid"])
+        title_snippets = {}
+        for r in cur.execute(
+                """SELECT f.chat_id, bm25(chats_fts) * 2 AS score,
+                          snippet(chats_fts, 1, '[', ']', '…', 10) AS snippet
+                   FROM chats_fts f JOIN chats c ON c.id = f.chat_id
+                   WHERE chats_fts MATCH ? AND c.user_id = ?""", (match, user_id)):
+            if r["chat_id"] not in best or r["score"] < best[r["chat_id"]][0]:
+                best[r["chat_id"]] = (r["score"], None)
+                title_snippets[r["chat_id"]] = r["snippet"]
+
+        top = sorted(best.items(), key=lambda kv: kv[1][0])[:limit]
+        if not top:
+            return []
+
+        # Сниппеты строим только для попавших в выдачу сообщений, по тексту из messages:
+        # повторный MATCH по rowid для префиксного слова стоил бы дороже самого поиска
+        mids = [mid for _, (_, mid) in top if mid is not None]
+        snippets = {}
+        if mids:
+            words = re.findall(r"\w+", query)
+            marks = ",".join("?" * len(mids))
+            for r in cur.execute(f"SELECT id, text, attachment_name FROM messages WHERE id IN ({marks})", mids):
+                snippets[r["id"]] = make_snippet(r["text"] or r["attachment_name"] or "", words)
+
+        ids = [cid for cid, _ in top]
+        marks = ",".join("?" * len(ids))
+        rows = {r["id"]: r for r in cur.execute(f"SELECT * FROM chats WHERE id IN ({marks})", ids)}
+        results = []
+        for cid, (score, mid) in top:
+            if cid not in rows:
+                continue
+            chat = self._chat_row_to_dict(rows[cid])
+            chat["snippet"] = snippets.get(mid) if mid is not None else title_snippets.get(cid)
+            results.append((score, chat))
+        return results
+
+    def _search_archive(self, user_id, match, query, limit):
+        """[(score, chat)] из архива; сниппет — по первому сообщению со всеми словами запроса"""
+        words = re.findall(r"\w+", query)
+        prefixes = [w.lower() for w in words]
+        results = []
+        for score, crow, mrows in self.archive.search(user_id, match, limit):
+            chat = self._chat_row_to_dict(crow)
+            chat["archived"] = True
+            text = crow["title"]
+            for r in mrows:
+                body = (r.get("text") or r.get("attachment_name") or "")
+                tokens = [t.lower() for t in re.findall(r"\w+", body)]
+                if all(any(t.startswith(p) for t in tokens) for p in prefixes):
+                    text = body
+                    break
+            chat["snippet"] = make_snippet(text, words)
+            results.append((score, chat))
+        return results
+
+    def _next_chat_id(self, conn):
+        """Следующий номер чата из таблицы sequences.
+
+        Вызывается внутри пишущей транзакции: UPDATE берёт блокировку записи,
+        поэтому два писателя (в т.ч. из разных процессов) не получат один номер.
+        """
+        conn.execute("UPDATE sequences SET value = value + 1 WHERE name = 'chat'")
+        n = conn.execute("SELECT value FROM sequences WHERE name = 'chat'").fetchone()[0]
+        return format_chat_id(n)
 
     def create_chat(self, user_id: str, title: str):
-        chat_id = self._next_chat_id()
-        now_dt = _now_dt_str()
-        cur = self.conn.cursor()
-        cur.execute("INSERT INTO chats (id,user_id,title,status,created_at,updated_at) VALUES (?,?,?,?,?,?)",
-                    (chat_id, user_id, (title or "Новая заявка"), "Новая", now_dt, now_dt))
-        # Приветствие оператора
-        op = random.choice(OPERATORS)
-        cur.execute(
-            """INSERT INTO messages (chat_id,sender,text,time,operator,created_at)
-               VALUES (?,?,?,?,?,?)""",
-            (chat_id, "operator", "Здравствуйте! Чем можем помочь?", _now_time_str(), op, _now_ts())
-        )
-        self.conn.commit()
+        def op(conn):
+            chat_id = self._next_chat_id(conn)
+            now_dt = _now_dt_str()
+            now_ms = _now_ms()
+            conn.execute(
+                """INSERT INTO chats (id,user_id,title,status,created_at,updated_at,created_ms,updated_ms)
+                   VALUES (?,?,?,?,?,?,?,?)""",
+                (chat_id, user_id, (title or "Новая заявка"), "Новая", now_dt, now_dt, now_ms, now_ms))
+            # Приветствие оператора
+            op_name = random.choice(OPERATORS)
+            conn.execute(
+                """INSERT INTO messages (chat_id,sender,text,time,operator,created_at,created_ms)
+                   VALUES (?,?,?,?,?,?,?)""",
+                (chat_id, "operator", "Здравствуйте! Чем можем помочь?", _now_time_str(), op_name, _now_ts(), now_ms)
+            )
+            return chat_id
+
+        # id нового чата нужен вызывающему сразу, поэтому ждём коммита и в режиме write-behind
+        chat_id = self._write(op, wait=True)
         return self.get_chat(chat_id)
 
     def add_message(self, chat_id: str, sender: str, text: str = None, operator: str = None,
                     attachment: dict = None, time_str: str = None):
-        cur = self.conn.cursor()
+        with self._unarchived((chat_id,)):
+            self._write(self._insert_message_op(chat_id, sender, text, operator, attachment, time_str),
+                        chats=(chat_id,))
+
+    def add_attachment_message(self, chat_id: str, sender: str, path: str, *, name: str = None,
+                               is_image: bool = False, operator: str = None, time_str: str = None) -> dict:
+        """Кладёт файл в хранилище вложений и добавляет сообщение со ссылкой на него.
+
+        Читает файл (хеш + копия), поэтому вызывается в рабочем потоке.
+        Возвращает словарь вложения в формате _message_row_to_dict.
+        """
+        digest, size = self.blobs.put_file(path)
+        attach = {
+            "path": self.blobs.path_for(digest),
+            "name": name or os.path.basename(path),
+            "size": human_size(size),
+            "hash": digest,
+            "bytes": size,
+            "is_image": bool(is_image),
+        }
+        self.add_message(chat_id, sender, operator=operator, attachment=attach, time_str=time_str)
+        return attach
+
+    def upsert_message(self, chat_id: str, server_id: str, sender: str, text: str = None,
+                       operator: str = None, attachment: dict = None, time_str: str = None) -> bool:
+        """Идемпотентное добавление сообщения с серверным id.
+
+        Повтор уже известного server_id (дубль события WS, эхо HTTP-отправки,
+        повторная синхронизация) ничего не меняет. Возвращает True, если
+        сообщение новое. Стоимость — один поиск по уникальному индексу.
+        """
+        if not server_id:
+            self.add_message(chat_id, sender, text, operator, attachment, time_str)
+            return True
+        server_id = str(server_id)
+        with self._unarchived((chat_id,)):
+            if server_id in self._inflight_server_ids:
+                return False
+            with self.db.read() as conn:
+                if conn.execute("SELECT 1 FROM messages WHERE server_id=?", (server_id,)).fetchone():
+                    return False
+
+            op = self._insert_message_op(chat_id, sender, text, operator, attachment, time_str, server_id)
+            res = self._write_with_server_id(server_id, op, chats=(chat_id,))
+        return True if res is None else bool(res)
+
+    def assign_server_id(self, chat_id: str, server_id: str, text: str = None):
+        """Привязывает server_id к уже сохранённому своему сообщению (ответ HTTP-отправки),
+        чтобы его эхо из WS стало no-op. Берётся самое новое своё сообщение
+        с тем же текстом и ещё без server_id."""
+        if not server_id:
+            return
+        self._write_with_server_id(str(server_id), lambda conn: conn.execute(
+            """UPDATE OR IGNORE messages SET server_id=? WHERE id = (
+                   SELECT id FROM messages
+                   WHERE chat_id=? AND sender='user' AND server_id IS NULL AND text IS ?
+                   ORDER BY id DESC LIMIT 1
+               )""", (str(server_id), chat_id, text)))
+
+    def _write_with_server_id(self, server_id, op, chats=()):
+        """_write, но в режиме write-behind server_id до коммита считается уже известным"""
+        if self.writer is None:
+            return self._write(op, chats=chats)
+        self._inflight_server_ids.add(server_id)
+        fut = self._submit(op, chats)
+        fut.add_done_callback(lambda f: self._inflight_server_ids.discard(server_id))
+        return None
+
+    def _insert_message_op(self, chat_id, sender, text, operator, attachment, time_str, server_id=None):
+        """Операция вставки сообщения; возвращает True, если строка добавлена"""
         t = time_str or _now_time_str()
-        if attachment:
-            cur.execute(
-                """INSERT INTO messages
-                   (chat_id,sender,time,operator,attachment_path,attachment_name,attachment_size,is_image,created_at)
-                   VALUES (?,?,?,?,?,?,?,?,?)""",
-                (chat_id, sender, t, operator,
-                 attachment.get("path"), attachment.get("name"), attachment.get("size"),
-                 1 if attachment.get("is_image") else 0, _now_ts())
-            )
-        else:
-            cur.execute(
-                """INSERT INTO messages (chat_id,sender,text,time,operator,created_at)
-                   VALUES (?,?,?,?,?,?)""",
-                (chat_id, sender, text, t, operator, _now_ts())
-            )
-        cur.execute("UPDATE chats SET updated_at=? WHERE id=?", (_now_dt_str(), chat_id))
-        self.conn.commit()
+        created = _now_ts()
+        updated = _now_dt_str()
+        now_ms = _now_ms()
+
+        def op(conn):
+            if attachment:
+                cur = conn.execute(
+                    """INSERT INTO messages
+                       (chat_id,sender,time,operator,attachment_path,attachment_name,attachment_size,is_image,
+                        attachment_hash,attachment_bytes,created_at,created_ms,server_id)
+                       VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+                       ON CONFLICT(server_id) WHERE server_id IS NOT NULL DO NOTHING""",
+                    (chat_id, sender, t, operator,
+                     # у вложения из хранилища путь вычисляется по хешу, исходный не храним
+                     None if attachment.get("hash") else attachment.get("path"),
+                     attachment.get("name"),
+                     None if attachment.get("hash") else attachment.get("size"),
+                     1 if attachment.get("is_image") else 0,
+                     attachment.get("hash"), attachment.get("bytes"), created, now_ms, server_id)
+                )
+            else:
+                cur = conn.execute(
+                    """INSERT INTO messages (chat_id,sender,text,time,operator,created_at,created_ms,server_id)
+                       VALUES (?,?,?,?,?,?,?,?)
+                       ON CONFLICT(server_id) WHERE server_id IS NOT NULL DO NOTHING""",
+                    (chat_id, sender, text, t, operator, created, now_ms, server_id)
+                )
+            if cur.rowcount != 1:
+                return False
+            conn.execute("UPDATE chats SET updated_at=?, updated_ms=? WHERE id=?", (updated, now_ms, chat_id))
+            return True
+
+        return op
 
     def update_chat_status(self, chat_id: str, status: str):
-        cur = self.conn.cursor()
-        cur.execute("UPDATE chats SET status=?, updated_at=? WHERE id=?", (status, _now_dt_str(), chat_id))
-        self.conn.commit()
+        updated, now_ms = _now_dt_str(), _now_ms()
+        with self._unarchived((chat_id,)):
+            self._write(lambda conn: conn.execute(
+                "UPDATE chats SET status=?, updated_at=?, updated_ms=? WHERE id=?",
+                (status, updated, now_ms, chat_id)), chats=(chat_id,))
 
     def rename_chat(self, chat_id: str, title: str):
-        cur = self.conn.cursor()
-        cur.execute("UPDATE chats SET title=?, updated_at=? WHERE id=?", (title, _now_dt_str(), chat_id))
-        self.conn.commit()
+        updated, now_ms = _now_dt_str(), _now_ms()
+        with self._unarchived((chat_id,)):
+            self._write(lambda conn: conn.execute(
+                "UPDATE chats SET title=?, updated_at=?, updated_ms=? WHERE id=?",
+                (title, updated, now_ms, chat_id)), chats=(chat_id,))
+
+    def bulk_update_status(self, chat_ids, status: str):
+        """Статус для многих чатов: одна транзакция, один executemany"""
+        updated, now_ms = _now_dt_str(), _now_ms()
+        rows = [(status, updated, now_ms, cid) for cid in chat_ids]
+        if rows:
+            with self._unarchived(chat_ids):
+                self._write(lambda conn: conn.executemany(
+                    "UPDATE chats SET status=?, updated_at=?, updated_ms=? WHERE id=?", rows),
+                    chats=list(chat_ids))
+
+    def bulk_delete(self, chat_ids):
+        """Удаление многих чатов (с сообщениями по каскаду) в одной транзакции"""
+        rows = [(cid,) for cid in chat_ids]
+        if rows:
+            with self._archive_lock:
+                self._write(lambda conn: conn.executemany("DELETE FROM chats WHERE id=?", rows),
+                            chats=list(chat_ids))
+                self._drop_archived(chat_ids)
+            self._write(self._gc_blobs_op(BLOB_GC_GRACE_SECONDS))
+
+    def mark_read(self, chat_id: str):
+        """Сбрасывает счётчик непрочитанных (чат открыт)"""
+        self._write(lambda conn: conn.execute(
+            "UPDATE chats SET unread_count=0 WHERE id=? AND unread_count<>0", (chat_id,)), chats=(chat_id,))
 
     def delete_chat(self, chat_id: str):
-        cur = self.conn.cursor()
-        cur.execute("DELETE FROM chats WHERE id=?", (chat_id,))
-        self.conn.commit()
+        with self._archive_lock:
+            self._write(lambda conn: conn.execute("DELETE FROM chats WHERE id=?", (chat_id,)), chats=(chat_id,))
+            self._drop_archived([chat_id])
+        self._write(self._gc_blobs_op(BLOB_GC_GRACE_SECONDS))
+
+    def archive_closed_chats(self, older_than_days: float = None, batch: int = ARCHIVE_BATCH) -> int:
+        """Переносит закрытые чаты без изменений дольше older_than_days в архив.
+
+        Чат сначала записывается в архив, потом удаляется из горячих таблиц;
+        между этими шагами он есть в обоих местах, и чтение берёт горячую копию.
+        Вложения архивного чата остаются в хранилище: архив держит на них ссылку.
+        Пачка идёт под _archive_lock: запись в чат ждёт её конца (см. _unarchived),
+        а уже поставленная запись меняет updated_ms, и такой чат остаётся горячим.
+        Возвращает число перенесённых чатов.
+        """
+        days = self.archive_after_days if older_than_days is None else older_than_days
+        if not days or days <= 0:
+            return 0
+        cutoff_ms = _now_ms() - int(timedelta(days=days).total_seconds() * 1000)
+        moved = 0
+        while True:
+            with self._archive_lock:
+                gone, crows = self._archive_batch(cutoff_ms, batch)
+            if not crows:
+                return moved
+            moved += len(gone)
+            if len(gone) < len(crows):
+                # Остаток изменился в процессе — не крутимся на нём, доберём в следующий раз
+                return moved
+
+    def _archive_batch(self, cutoff_ms, batch):
+        """Одна пачка archive_closed_chats: (перенесённые id, прочитанные строки chats)"""
+        with self._reading() as conn:
+            cur = conn.cursor()
+            crows = cur.execute(
+                "SELECT * FROM chats WHERE status='Закрыта' AND updated_ms < ? LIMIT ?",
+                (cutoff_ms, batch)).fetchall()
+            if not crows:
+                return set(), crows
+            archived_at = _now_dt_str()
+            for crow in crows:
+                mrows = cur.execute("SELECT * FROM messages WHERE chat_id=? ORDER BY id",
+                                    (crow["id"],)).fetchall()
+                log = cur.execute("SELECT status, changed_ms FROM chat_status_log WHERE chat_id=? "
+                                  "ORDER BY changed_ms, id", (crow["id"],)).fetchall()
+                self.archive.put(dict(crow), [dict(r) for r in mrows], archived_at,
+                                 status_log=[tuple(r) for r in log])
+        stamps = [(crow["id"], crow["updated_ms"]) for crow in crows]
+
+        def op(conn):
+            gone = []
+            for chat_id, updated_ms in stamps:
+                hashes = [r[0] for r in conn.execute(
+                    "SELECT attachment_hash FROM messages WHERE chat_id=? AND attachment_hash IS NOT NULL",
+                    (chat_id,))]
+                # Чат мог измениться после чтения — тогда он остаётся горячим
+                if conn.execute("DELETE FROM chats WHERE id=? AND updated_ms=? AND status='Закрыта'",
+                                (chat_id, updated_ms)).rowcount != 1:
+                    continue
+                # Триггер blobs_ref_ad снял ссылки сообщений; ссылку держит теперь архив
+                conn.executemany("UPDATE blobs SET refcount = refcount + 1 WHERE hash=?",
+                                 [(h,) for h in hashes])
+                gone.append(chat_id)
+            return gone
+
+        # Запись архива снимается только после коммита DELETE (или его отказа)
+        gone = set(self._write(op, wait=True))
+        self.cache.invalidate(gone)
+        self.archive.remove([crow["id"] for crow in crows if crow["id"] not in gone])
+        return gone, crows
+
+    @contextmanager
+    def _unarchived(self, chat_ids):
+        """Возвращает чаты из архива и держит _archive_lock, пока вызывающий ставит запись в них"""
+        with self._archive_lock:
+            for chat_id in chat_ids:
+                if chat_id in self.archive:
+                    self.restore_chat(chat_id)
+            yield
+
+    def restore_chat(self, chat_id: str) -> bool:
+        """Возвращает чат из архива в горячие таблицы (перед любой записью в него)"""
+        with self._archive_lock:
+            return self._restore_locked(chat_id)
+
+    def _restore_locked(self, chat_id):
+        entry = self.archive.get(chat_id)
+        if not entry:
+            return False
+        crow, mrows = entry
+        status_log = self.archive.status_log(chat_id)
+
+        def op(conn):
+            if conn.execute("SELECT 1 FROM chats WHERE id=?", (chat_id,)).fetchone():
+                # Горячая копия есть — запись архива не трогаем
+                return False
+            # Сводку (message_count, last_*) пересчитают триггеры при вставке сообщений
+            chat_cols = [c for c in crow if c not in
+                         ("message_count", "last_message_preview", "last_message_at", "last_message_ms",
+                          "last_sender", "unread_count")]
+            conn.execute(f"INSERT INTO chats ({','.join(chat_cols)}) VALUES ({','.join('?' * len(chat_cols))})",
+                         [crow[c] for c in chat_cols])
+            for r in mrows:
+                cols = list(r)
+                conn.execute(f"INSERT INTO messages ({','.join(cols)}) VALUES ({','.join('?' * len(cols))})",
+                             [r[c] for c in cols])
+            conn.execute("UPDATE chats SET unread_count=0 WHERE id=?", (chat_id,))
+            # Чаты, ушедшие в архив до появления колонок *_ms
+            conn.execute(f"""UPDATE chats SET created_ms = coalesce(created_ms, {MS_FROM_TEXT_SQL.format(col='created_at')}),
+                                             updated_ms = coalesce(updated_ms, {MS_FROM_TEXT_SQL.format(col='updated_at')})
+                             WHERE id=?""", (chat_id,))
+            conn.execute(f"""UPDATE messages SET created_ms = {MS_FROM_TEXT_SQL.format(col='created_at')}
+                             WHERE chat_id=? AND created_ms IS NULL""", (chat_id,))
+            if status_log:
+                # Вместо записи, которую добавил триггер chats_status_log_ai, — журнал из архива
+                conn.execute("DELETE FROM chat_status_log WHERE chat_id=?", (chat_id,))
+                conn.executemany("INSERT INTO chat_status_log (chat_id, status, changed_ms) VALUES (?,?,?)",
+                                 [(chat_id, status, changed_ms) for status, changed_ms in status_log])
+            else:
+                # Архив без журнала: как при миграции — текущий статус с момента updated_ms
+                conn.execute("""UPDATE chat_status_log SET changed_ms =
+                                    (SELECT coalesce(updated_ms, created_ms, 0) FROM chats WHERE id=?)
+                                WHERE chat_id=?""", (chat_id, chat_id))
+            # Ссылки на вложения снова держат сообщения (триггер blobs_ref_ai), а не архив
+            conn.executemany("UPDATE blobs SET refcount = refcount - 1 WHERE hash=?",
+                             [(r["attachment_hash"],) for r in mrows if r.get("attachment_hash")])
+            return True
+
+        if not self._write(op, wait=True):
+            return False
+        self.archive.remove([chat_id])
+        self.cache.invalidate([chat_id])
+        return True
+
+    def _drop_archived(self, chat_ids):
+        """Удаление чатов из архива: их ссылки на вложения снимаются, файлы подберёт gc"""
+        hashes = [(r["attachment_hash"],)
+                  for _, mrows in self.archive.remove([cid for cid in chat_ids if cid in self.archive])
+                  for r in mrows if r.get("attachment_hash")]
+        if hashes:
+            self._write(lambda conn: conn.executemany(
+                "UPDATE blobs SET refcount = refcount - 1 WHERE hash=?", hashes))
+
+    def gc_blobs(self, grace_seconds: float = BLOB_GC_GRACE_SECONDS):
+        """Удаляет вложения, на которые не ссылается ни одно сообщение. Возвращает их хеши."""
+        return self._write(self._gc_blobs_op(grace_seconds), wait=True)
+
+    def _gc_blobs_op(self, grace_seconds):
+        def op(conn):
+            removed = []
+            for (digest,) in conn.execute("SELECT hash FROM blobs WHERE refcount <= 0").fetchall():
+                if self.blobs.recently_used(digest, grace_seconds):
+                    continue
+                conn.execute("DELETE FROM blobs WHERE hash=? AND refcount <= 0", (digest,))
+                # Если транзакция не закоммитится, строка с нулём ссылок останется
+                # и будет убрана следующей сборкой; отсутствующий файл не мешает
+                self.blobs.delete(digest)
+                removed.append(digest)
+            return removed
+
+        return op
+
+    # ---------- аналитика ответов (data/analytics.py) ----------
+
+    def chat_analytics(self, chat_id: str) -> dict:
+        """Первый ответ, средняя задержка ответа и время в статусах одного чата"""
+        with self._reading() as conn:
+            metrics = analytics.chat_metrics(conn, chat_id=chat_id)
+        return metrics.get(chat_id) or {"first_response_ms": None, "avg_reply_ms": None, "max_reply_ms": None,
+                                        "replies": 0, "dwell_ms": {}}
+
+    def response_analytics(self, user_id: str = None, since_ms: int = None, until_ms: int = None) -> dict:
+        """Сводка по операторам и статусам (analytics.summary) для чатов пользователя и/или периода"""
+        with self._reading() as conn:
+            return analytics.summary(conn, user_id=user_id, since_ms=since_ms, until_ms=until_ms)
+
+    # ---------- обслуживание (data/maintenance.py) ----------
+
+    def apply_retention(self, policies=None, now_ms: int = None) -> int:
+        """Удаляет чаты (и из архива), вышедшие за срок хранения. Возвращает их число."""
+        policies = self.retention if policies is None else policies
+        now_ms = now_ms or _now_ms()
+        deleted = 0
+        for status, days in policies:
+            cutoff_ms = now_ms - int(days * 86_400_000)
+            with self._reading() as conn:
+                if status is None:
+                    rows = conn.execute("SELECT id FROM chats WHERE updated_ms < ?", (cutoff_ms,)).fetchall()
+                else:
+                    rows = conn.execute("SELECT id FROM chats WHERE status = ? AND updated_ms < ?",
+                                        (status, cutoff_ms)).fetchall()
+            ids = [r["id"] for r in rows]
+            ids += self.archive.expired(status, ms_to_datetime(cutoff_ms).strftime("%Y-%m-%d %H:%M"))
+            for i in range(0, len(ids), ARCHIVE_BATCH):
+                self.bulk_delete(ids[i:i + ARCHIVE_BATCH])
+            deleted += len(ids)
+        self.flush()
+        return deleted
+
+    def check_integrity(self, quick: bool = False) -> list:
+        """PRAGMA integrity_check (или quick_check) и foreign_key_check; пустой список — всё в порядке"""
+        self.flush()
+        return maintenance.integrity_check(self.db, quick=quick)
+
+    def maintenance_report(self) -> dict:
+        """Размер файла, свободные страницы, итоги фонового возврата места"""
+        report = maintenance.db_stats(self.db)
+        report["archive_bytes"] = maintenance.file_size(self.archive.db_path)
+        report["retention"] = [f"{status or '*'}:{days:g}" for status, days in self.retention]
+        if self.maintenance is not None:
+            report.update(self.maintenance.stats)
+        return report
+
+    def start_maintenance(self, **options):
+        """Запускает фоновое обслуживание (параметры — MaintenanceJob); повторный вызов ничего не делает"""
+        if self.maintenance is None:
+            self.maintenance = maintenance.MaintenanceJob(self, **options)
+            self.maintenance.start()
+        return self.maintenance
+
+    def stop_maintenance(self):
+        if self.maintenance is not None:
+            self.maintenance.stop()
+
+
+_repo = None
+_repo_lock = threading.Lock()
+_repo_options = {}
+
+
+def configure_repo(db_path=None, **options):
+    """Задаёт путь и параметры SQLiteRepo до первого get_repo().
+
+    По умолчанию путь берётся из SUPPORT_CHAT_DB, иначе data/support_chat.db.
+    """
+    with _repo_lock:
+        if _repo is not None:
+            raise RuntimeError("Репозиторий уже открыт; configure_repo() вызывается до первого get_repo()")
+        _repo_options.clear()
+        _repo_options.update(options)
+        if db_path is not None:
+            _repo_options["db_path"] = db_path
+
+
+def get_repo():
+    """Глобальный репозиторий: открывается при первом обращении (схема, миграции, сидинг).
+
+    Импорт модуля базу не трогает. В GUI первое обращение происходит
+    в потоке AsyncRepo, а не в UI-потоке.
+    """
+    global _repo
+    if _repo is None:
+        with _repo_lock:
+            if _repo is None:
+                _repo = _repo_from_env(**_repo_options)
+    return _repo
+
+
+def _repo_from_env(**options):
+    """SQLITE_WRITE_BEHIND=1 включает отложенную запись; явные options важнее переменных окружения"""
+    params = dict(
+        db_path=os.environ.get("SUPPORT_CHAT_DB") or None,
+        write_behind=os.environ.get("SQLITE_WRITE_BEHIND", "0") == "1",
+        synchronous=os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        flush_interval_ms=int(os.environ.get("SQLITE_FLUSH_MS", "5")),
+        archive_after_days=float(os.environ.get("SQLITE_ARCHIVE_DAYS", ARCHIVE_AFTER_DAYS)),
+        cache_messages=int(os.environ.get("SQLITE_CACHE_MESSAGES", CACHE_MAX_MESSAGES)),
+        retention=maintenance.parse_retention(os.environ.get("SQLITE_RETENTION", "")),
+    )
+    params.update(options)
+    r = SQLiteRepo(params.pop("db_path"), **params)
+    atexit.register(r.flush)
+    return r
+
 
-# Глобальный экземпляр
-repo = SQLiteRepo()
+def __getattr__(name):
+    # Совместимость со старым `from data.sqlite_store import repo`: открытие по первому обращению
+    if name == "repo":
+        return get_repo()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,176 @@
+"""
+Генератор синтетической базы чатов для замеров (data/bench.py suite).
+
+Детерминирован по seed: одни и те же параметры дают ту же базу (даты отсчитываются
+от now_ms), поэтому результаты замеров разных версий SQLiteRepo сравнимы.
+
+Распределения подобраны «как в жизни»:
+- пользователи неравномерны: у немногих сотни заявок, у большинства — единицы;
+- длина переписки логнормальная: много коротких чатов и длинный хвост;
+- длина сообщения тоже логнормальная (от «ок» до простыни текста);
+- часть сообщений — вложения (картинки и документы, размер логнормальный);
+- большинство чатов закрыты, свежие — в работе.
+
+Записи идут потоком в data.transfer.import_records (вставка пачками с
+отложенными индексами), память постоянна. Вложения существуют только как
+метаданные (hash/bytes в messages и blobs) — файлы в blobs/ не создаются.
+
+    python -m data.synthetic bench.db [--chats 10000] [--messages 1000000] [--seed 1]
+    python -m data.synthetic out.ndjson --ndjson ...   # тот же поток в NDJSON
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import sys
+import time
+from datetime import datetime
+
+from .sqlite_store import SQLiteRepo, OPERATORS, format_chat_id
+from .transfer import FORMAT, FORMAT_VERSION, import_records
+from .migrations import SCHEMA_VERSION
+
+DEFAULT_CHATS = 10_000
+DEFAULT_MESSAGES = 1_000_000
+DEFAULT_USERS = 500
+DAYS = 365
+ATTACHMENT_SHARE = 0.03
+IMAGE_SHARE = 0.6
+
+STATUSES = [("Закрыта", 0.62), ("В работе", 0.14), ("Ожидает клиента", 0.12),
+            ("Ожидает оператора", 0.07), ("Новая", 0.05)]
+
+TITLES = ["Проблема входа в ЛК", "Вопрос по оплате", "Ошибка при загрузке файла", "Не приходит SMS",
+          "Смена тарифа", "Возврат средств", "Доступ к отчётам", "Подключение API", "Изменение реквизитов",
+          "Не работает экспорт", "Блокировка карты", "Вопрос по договору"]
+
+WORDS = ("добрый день здравствуйте спасибо пожалуйста платеж карта лимит ошибка вход пароль "
+         "кабинет отчет файл договор счет доступ сервер заявка подпись номер сумма вчера сегодня "
+         "проверьте уточните попробуйте ещё раз не работает получилось всё понятно подскажите "
+         "когда сколько почему где можно нужно сделать отправил прикрепил скриншот страница").split()
+
+FILE_KINDS = [("scan_{n}.jpg", True), ("photo_{n}.png", True), ("screenshot_{n}.png", True),
+              ("invoice_{n}.pdf", False), ("contract_{n}.docx", False), ("report_{n}.xlsx", False)]
+
+
+def _weighted(rnd, pairs):
+    x = rnd.random()
+    for value, weight in pairs:
+        x -= weight
+        if x <= 0:
+            return value
+    return pairs[-1][0]
+
+
+def _split(rnd, total, parts, sigma):
+    """total сообщений по parts чатам, логнормально, минимум 1 на чат (сумма — ровно total)"""
+    weights = [rnd.lognormvariate(0, sigma) for _ in range(parts)]
+    scale = max(total - parts, 0) / sum(weights)
+    counts = [1 + int(w * scale) for w in weights]
+    for k in rnd.sample(range(parts), total - sum(counts)):
+        counts[k] += 1
+    return counts
+
+
+def _text(rnd):
+    n = max(1, min(300, int(rnd.lognormvariate(2.0, 0.9))))
+    words = [rnd.choice(WORDS) for _ in range(n)]
+    if rnd.random() < 0.05:
+        words.append(f"#{rnd.randrange(10 ** 6)}")
+    return " ".join(words).capitalize()
+
+
+def _stamp(ms):
+    dt = datetime.fromtimestamp(ms / 1000)
+    return dt.strftime("%Y-%m-%d %H:%M"), dt.strftime("%Y-%m-%d %H:%M:%S"), dt.strftime("%H:%M")
+
+
+def generate(chats=DEFAULT_CHATS, messages=DEFAULT_MESSAGES, users=DEFAULT_USERS, seed=1, now_ms=None):
+    """Поток записей {"type": "header"|"chat"|"message", ...} в формате data.transfer"""
+    rnd = random.Random(seed)
+    now_ms = now_ms or int(time.time() * 1000)
+    start_ms = now_ms - DAYS * 86_400_000
+    counts = _split(rnd, max(messages, chats), chats, sigma=1.1)
+    # Пользователь чата по закону Ципфа: CRM00001 — самый активный
+    harmonic = [1 / (k + 1) for k in range(users)]
+    user_of = rnd.choices(range(users), weights=harmonic, k=chats)
+
+    yield {"type": "header", "format": FORMAT, "version": FORMAT_VERSION, "schema": SCHEMA_VERSION}
+    for i in range(chats):
+        n = counts[i]
+        created_ms = start_ms + int((now_ms - start_ms) * i / chats)
+        status = "Новая" if n == 1 else _weighted(rnd, STATUSES)
+        operator = rnd.choice(OPERATORS)
+        ms = created_ms
+        rows = []
+        for j in range(n):
+            if j:
+                ms += int(rnd.expovariate(1 / 180_000))  # в среднем 3 минуты между ответами
+            sender = "user" if (j % 2 == 0) != (rnd.random() < 0.2) else "operator"
+            created_dt, created_ts, hhmm = _stamp(ms)
+            row = {"chat_id": format_chat_id(i + 1), "sender": sender, "text": None, "time": hhmm,
+                   "operator": operator if sender == "operator" else None, "created_at": created_ts,
+                   "created_ms": ms, "is_image": 0}
+            if sender == "user" and rnd.random() < ATTACHMENT_SHARE * 2:
+                image = rnd.random() < IMAGE_SHARE
+                pattern, is_image = rnd.choice([k for k in FILE_KINDS if k[1] == image])
+                name = pattern.format(n=rnd.randrange(10 ** 4))
+                size = int(min(rnd.lognormvariate(math.log(250_000), 1.2), 50 * 2 ** 20))
+                row.update(attachment_name=name, is_image=int(is_image), attachment_bytes=size,
+                           attachment_hash=hashlib.sha256(f"{seed}:{name}:{size}".encode()).hexdigest())
+            else:
+                row["text"] = _text(rnd)
+            rows.append(row)
+        last = rows[-1]
+        chat_dt, _, _ = _stamp(created_ms)
+        last_dt, _, _ = _stamp(last["created_ms"])
+        preview = last["text"] if last["text"] is not None else "📎 " + last["attachment_name"]
+        yield {"type": "chat", "id": format_chat_id(i + 1), "user_id": f"CRM{user_of[i] + 1:05d}",
+               "title": rnd.choice(TITLES), "status": status,
+               "created_at": chat_dt, "updated_at": last_dt, "created_ms": created_ms,
+               "updated_ms": last["created_ms"], "message_count": n,
+               "last_message_preview": preview[:120], "last_message_at": last["created_at"],
+               "last_message_ms": last["created_ms"], "last_sender": last["sender"],
+               "unread_count": 0 if status == "Закрыта" else sum(r["sender"] != "user" for r in rows[-3:])}
+        for row in rows:
+            row["type"] = "message"
+            yield row
+
+
+def populate(repo, **params):
+    """Заполняет repo синтетикой. Возвращает (чатов, сообщений)."""
+    chats, messages, _ = import_records(repo, generate(**params))
+    return chats, messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m data.synthetic", description="Синтетическая база чатов")
+    parser.add_argument("path", help="база SQLite (или файл NDJSON с --ndjson)")
+    parser.add_argument("--chats", type=int, default=DEFAULT_CHATS)
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES)
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ndjson", action="store_true", help="записать поток в NDJSON вместо базы")
+    args = parser.parse_args(argv)
+    params = dict(chats=args.chats, messages=args.messages, users=args.users, seed=args.seed)
+
+    t0 = time.perf_counter()
+    if args.ndjson:
+        with open(args.path, "w", encoding="utf-8") as out:
+            for rec in generate(**params):
+                out.write(json.dumps(rec, ensure_ascii=False))
+                out.write("\n")
+        print(f"{args.path}: {time.perf_counter() - t0:.1f} с")
+        return 0
+    repo = SQLiteRepo(args.path)
+    try:
+        chats, messages = populate(repo, **params)
+    finally:
+        repo.close()
+    print(f"{args.path}: чатов {chats}, сообщений {messages}, {time.perf_counter() - t0:.1f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,349 @@
+"""
+Потоковый экспорт и импорт базы чатов в NDJSON.
+
+Формат — по одному JSON-объекту на строку:
+    {"type": "header", "format": "support-chat-ndjson", "version": 1, "schema": 9}
+    {"type": "chat", ...все колонки chats...}
+    {"type": "message", ...все колонки messages...}   # сообщения чата сразу после него
+    {"type": "checkpoint", "after": "CH-0042"}         # всё до CH-0042 включительно записано
+
+Чаты идут по возрастанию id, сообщения — по id внутри чата; читаются
+страницами (keyset), так что память не зависит от размера базы.
+
+Продолжение прерванного экспорта: --resume обрезает файл после последнего
+checkpoint и дописывает с него. Импорт возвращает (и печатает) id последнего
+закоммиченного чата; его можно передать как --after. Повторный импорт того же
+файла безопасен: существующие чаты и сообщения с известным server_id пропускаются.
+Чат, чей id в базе уже занят другим чатом (другие пользователь, заголовок
+или время создания), не теряется: он получает новый номер из sequences, а
+сообщения идут под ним; такие перенумерации пишутся в лог.
+
+При импорте вторичные индексы и триггеры chats/messages снимаются на время
+вставки и создаются заново в конце (сводки чатов берутся из файла, FTS и
+счётчики ссылок на вложения пополняются пачками). Их DDL хранится в таблице
+_import_ddl, поэтому после сбоя посреди импорта схему восстановит следующий
+импорт или открытие базы (restore_deferred_ddl). Всё время импорта база
+открыта монопольно (locking_mode=EXCLUSIVE): приложение и другие процессы
+должны её закрыть, иначе импорт откажется начинать.
+
+Архив (support_chat_archive.db) и файлы вложений (blobs/) не экспортируются:
+их переносят копированием как есть.
+
+    python -m data.transfer export chats.ndjson [--db PATH] [--user ID] [--resume]
+    python -m data.transfer import chats.ndjson [--db PATH] [--after CHAT_ID]
+"""
+import argparse
+import json
+import os
+import sys
+
+from .migrations import get_version, restore_deferred_ddl
+from .sqlite_store import SQLiteRepo
+
+FORMAT = "support-chat-ndjson"
+FORMAT_VERSION = 1
+CHAT_PAGE = 500
+MESSAGE_PAGE = 2000
+IMPORT_BATCH = 5000  # сообщений на транзакцию (коммит — только на границе чата)
+CHECKPOINT_EVERY = 100  # чатов
+
+
+def _dump(out, obj):
+    out.write(json.dumps(obj, ensure_ascii=False))
+    out.write("\n")
+
+
+def export_ndjson(repo, out, *, user_id=None, after=None, checkpoint_every=CHECKPOINT_EVERY):
+    """Пишет чаты (с id > after) и их сообщения в out. Возвращает (чатов, сообщений, курсор)."""
+    repo.flush()
+    if after is None:
+        with repo.db.read() as conn:
+            schema = get_version(conn)
+        _dump(out, {"type": "header", "format": FORMAT, "version": FORMAT_VERSION, "schema": schema})
+    cursor = after or ""
+    chats = messages = 0
+    while True:
+        with repo.db.read() as conn:
+            if user_id is None:
+                crows = conn.execute("SELECT * FROM chats WHERE id > ? ORDER BY id LIMIT ?",
+                                     (cursor, CHAT_PAGE)).fetchall()
+            else:
+                crows = conn.execute("SELECT * FROM chats WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                                     (user_id, cursor, CHAT_PAGE)).fetchall()
+        if not crows:
+            break
+        for crow in crows:
+            _dump(out, dict(crow, type="chat"))
+            last_id = 0
+            while True:
+                with repo.db.read() as conn:
+                    mrows = conn.execute(
+                        "SELECT * FROM messages WHERE chat_id = ? AND id > ? ORDER BY id LIMIT ?",
+                        (crow["id"], last_id, MESSAGE_PAGE)).fetchall()
+                for m in mrows:
+                    _dump(out, dict(m, type="message"))
+                messages += len(mrows)
+                if len(mrows) < MESSAGE_PAGE:
+                    break
+                last_id = mrows[-1]["id"]
+            cursor = crow["id"]
+            chats += 1
+            if chats % checkpoint_every == 0:
+                _dump(out, {"type": "checkpoint", "after": cursor})
+                out.flush()
+    if chats:
+        _dump(out, {"type": "checkpoint", "after": cursor})
+    out.flush()
+    return chats, messages, cursor or None
+
+
+def last_checkpoint(path):
+    """(курсор, смещение конца строки checkpoint) последнего checkpoint в файле или (None, 0)"""
+    cursor, offset, pos = None, 0, 0
+    with open(path, "rb") as f:
+        for line in f:
+            pos += len(line)
+            if b'"checkpoint"' in line and line.endswith(b"\n"):
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get("type") == "checkpoint":
+                    cursor, offset = rec["after"], pos
+    return cursor, offset
+
+
+def export_file(repo, path, *, user_id=None, resume=False):
+    """Экспорт в файл; resume=True — продолжить с последнего checkpoint"""
+    after = None
+    mode = "w"
+    if resume and os.path.exists(path):
+        after, offset = last_checkpoint(path)
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+        mode = "a" if offset else "w"
+    with open(path, mode, encoding="utf-8") as out:
+        return export_ndjson(repo, out, user_id=user_id, after=after)
+
+
+# ---------- импорт ----------
+
+def _defer_ddl(conn):
+    """Снимает вторичные индексы и триггеры chats/messages, сохраняя их DDL в _import_ddl"""
+    conn.execute("CREATE TABLE IF NOT EXISTS _import_ddl (name TEXT PRIMARY KEY, type TEXT, sql TEXT)")
+    if conn.execute("SELECT 1 FROM _import_ddl LIMIT 1").fetchone():
+        return  # прошлый импорт прервался — DDL уже сохранён и снят
+    rows = conn.execute(
+        """SELECT name, type, sql FROM sqlite_master
+           WHERE type IN ('index', 'trigger') AND tbl_name IN ('chats', 'messages') AND sql IS NOT NULL
+             AND name <> 'idx_messages_server_id'""").fetchall()
+    conn.executemany("INSERT INTO _import_ddl (name, type, sql) VALUES (?,?,?)",
+                     [(r[0], r[1], r[2]) for r in rows])
+    for name, kind, _ in rows:
+        conn.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+
+
+def _columns(conn, table):
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+class _Batch:
+    """Строки одной транзакции импорта"""
+
+    def __init__(self):
+        self.chats = []
+        self.messages = []
+        self.last_chat = None
+
+
+def import_ndjson(repo, lines, *, after=None, batch=IMPORT_BATCH, log=None):
+    """Импорт из итерируемого lines (строки NDJSON). Возвращает (чатов, сообщений, курсор)."""
+    records = (json.loads(line) for line in lines if line.strip())
+    return import_records(repo, records, after=after, batch=batch, log=log)
+
+
+def import_records(repo, records, *, after=None, batch=IMPORT_BATCH, log=None):
+    """Импорт потока записей (dict с ключом "type", как в NDJSON) — им же пользуется data.synthetic"""
+    repo.flush()
+    conn = repo.conn
+    chat_cols = set(_columns(conn, "chats"))
+    msg_cols = set(_columns(conn, "messages")) - {"id"}
+
+    # Пока триггеры сняты, в базу не должен писать никто другой: запись приложения
+    # прошла бы мимо FTS, сводок и счётчиков ссылок, а открытие базы другим
+    # SQLiteRepo вернуло бы триггеры посреди импорта. Поэтому импорт держит
+    # базу монопольно; если она уже открыта — RuntimeError, ничего не меняется.
+    with repo.db.exclusive():
+        return _import_exclusive(repo, records, after, batch, log, chat_cols, msg_cols)
+
+
+def _import_exclusive(repo, records, after, batch, log, chat_cols, msg_cols):
+    with repo.db.transaction() as c:
+        _defer_ddl(c)
+
+    imported_chats = imported_messages = 0
+    cursor = after
+    pending = _Batch()
+    skip_chat = False
+
+    def commit():
+        nonlocal imported_chats, imported_messages, cursor
+        if pending.last_chat is None:
+            return
+        c_added, m_added, remapped = _apply(repo, pending, chat_cols, msg_cols)
+        imported_chats += c_added
+        imported_messages += m_added
+        cursor = pending.last_chat
+        for old_id, new_id in remapped.items():
+            (log or print)(f"  {old_id} занят другим чатом, загружен как {new_id}")
+        if log:
+            log(f"  до {cursor}: чатов {imported_chats}, сообщений {imported_messages}")
+        pending.__init__()
+
+    try:
+        for rec in records:
+            kind = rec.pop("type", None)
+            if kind == "header":
+                if rec.get("format") != FORMAT or rec.get("version", 0) > FORMAT_VERSION:
+                    raise ValueError(f"Неподдерживаемый формат: {rec}")
+            elif kind == "chat":
+                # Граница чата — единственное место, где можно закоммитить пачку
+                if len(pending.messages) >= batch:
+                    commit()
+                skip_chat = after is not None and rec["id"] <= after
+                if not skip_chat:
+                    pending.chats.append(rec)
+                    pending.last_chat = rec["id"]
+            elif kind == "message":
+                if not skip_chat:
+                    pending.messages.append(rec)
+        commit()
+    finally:
+        with repo.db.transaction() as c:
+            restore_deferred_ddl(c)
+        repo.cache.clear()
+    return imported_chats, imported_messages, cursor
+
+
+def _apply(repo, pending, chat_cols, msg_cols):
+    with repo.db.transaction() as conn:
+        fts_from = conn.execute("SELECT coalesce(max(id), 0) FROM messages").fetchone()[0]
+        chats_from = conn.execute("SELECT coalesce(max(rowid), 0) FROM chats").fetchone()[0]
+
+        new_chats = set()
+        collided = []
+        for rec in pending.chats:
+            if _insert_chat(conn, rec, chat_cols):
+                new_chats.add(rec["id"])
+            elif not _same_chat(conn, rec["id"], rec):
+                collided.append(rec)
+
+        # id занят другим чатом: новый номер из sequences (после всех CH-NNNN пачки),
+        # если этот чат не загружен под новым номером ещё при прошлом импорте
+        remapped = {}
+        if collided:
+            _bump_chat_sequence(conn)
+        for rec in collided:
+            if conn.execute("SELECT 1 FROM chats WHERE user_id = ? AND title = ? AND created_at = ?",
+                            (rec.get("user_id"), rec.get("title"), rec.get("created_at"))).fetchone():
+                continue
+            new_id = repo._next_chat_id(conn)
+            _insert_chat(conn, dict(rec, id=new_id), chat_cols)
+            remapped[rec["id"]] = new_id
+            new_chats.add(new_id)
+
+        added = 0
+        refs = {}
+        for rec in pending.messages:
+            chat_id = remapped.get(rec.get("chat_id"), rec.get("chat_id"))
+            # сообщения уже существовавшего чата не дублируем
+            if chat_id not in new_chats:
+                continue
+            rec["chat_id"] = chat_id
+            cols = [k for k in rec if k in msg_cols]
+            cur = conn.execute(
+                f"""INSERT INTO messages ({','.join(cols)}) VALUES ({','.join('?' * len(cols))})
+                    ON CONFLICT(server_id) WHERE server_id IS NOT NULL DO NOTHING""",
+                [rec[k] for k in cols])
+            if cur.rowcount == 1:
+                added += 1
+                if rec.get("attachment_hash"):
+                    h = rec["attachment_hash"]
+                    size, n = refs.get(h, (rec.get("attachment_bytes") or 0, 0))
+                    refs[h] = (size, n + 1)
+
+        # То, что делали бы снятые триггеры, — одним проходом на пачку
+        conn.execute("INSERT INTO messages_fts(rowid, text, attachment_name) "
+                     "SELECT id, text, attachment_name FROM messages WHERE id > ?", (fts_from,))
+        conn.execute("INSERT INTO chats_fts(chat_id, title) SELECT id, title FROM chats WHERE rowid > ?",
+                     (chats_from,))
+        conn.execute("INSERT INTO chat_status_log (chat_id, status, changed_ms) "
+                     "SELECT id, status, coalesce(created_ms, updated_ms, 0) FROM chats WHERE rowid > ?",
+                     (chats_from,))
+        conn.executemany("INSERT OR IGNORE INTO blobs (hash, size, refcount) VALUES (?, ?, 0)",
+                         [(h, size) for h, (size, _) in refs.items()])
+        conn.executemany("UPDATE blobs SET refcount = refcount + ? WHERE hash = ?",
+                         [(n, h) for h, (_, n) in refs.items()])
+        # Нумерация новых чатов продолжается после импортированных CH-NNNN
+        _bump_chat_sequence(conn)
+    return len(new_chats), added, remapped
+
+
+def _insert_chat(conn, rec, chat_cols) -> bool:
+    cols = [k for k in rec if k in chat_cols]
+    cur = conn.execute(
+        f"INSERT OR IGNORE INTO chats ({','.join(cols)}) VALUES ({','.join('?' * len(cols))})",
+        [rec[k] for k in cols])
+    return cur.rowcount == 1
+
+
+def _same_chat(conn, chat_id, rec) -> bool:
+    """Чат с этим id в базе — тот же, что в файле (повторный импорт), а не другой с совпавшим номером"""
+    row = conn.execute("SELECT user_id, title, created_at FROM chats WHERE id = ?", (chat_id,)).fetchone()
+    return row is not None and tuple(row) == (rec.get("user_id"), rec.get("title"), rec.get("created_at"))
+
+
+def _bump_chat_sequence(conn):
+    conn.execute("""UPDATE sequences SET value = max(value, (
+                        SELECT coalesce(max(CAST(substr(id, 4) AS INTEGER)), 0) FROM chats WHERE id LIKE 'CH-%'))
+                    WHERE name = 'chat'""")
+
+
+def import_file(repo, path, *, after=None, log=None):
+    with open(path, encoding="utf-8") as f:
+        return import_ndjson(repo, f, after=after, log=log)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m data.transfer", description="Экспорт/импорт чатов в NDJSON")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="выгрузить базу в NDJSON")
+    exp.add_argument("path")
+    exp.add_argument("--db", help="путь к support_chat.db")
+    exp.add_argument("--user", help="только чаты этого пользователя")
+    exp.add_argument("--resume", action="store_true", help="продолжить с последнего checkpoint файла")
+    imp = sub.add_parser("import", help="загрузить NDJSON в базу")
+    imp.add_argument("path")
+    imp.add_argument("--db", help="путь к support_chat.db")
+    imp.add_argument("--after", help="пропустить чаты с id не больше этого (курсор прошлого запуска)")
+    args = parser.parse_args(argv)
+
+    repo = SQLiteRepo(args.db)
+    try:
+        if args.command == "export":
+            chats, messages, cursor = export_file(repo, args.path, user_id=args.user, resume=args.resume)
+            print(f"Выгружено чатов: {chats}, сообщений: {messages}; курсор: {cursor}")
+        else:
+            try:
+                chats, messages, cursor = import_file(repo, args.path, after=args.after, log=print)
+            except RuntimeError as e:
+                print(f"Импорт не начат: {e}. Закройте приложение и повторите.")
+                return 1
+            print(f"Загружено чатов: {chats}, сообщений: {messages}; курсор: {cursor}")
+    finally:
+        repo.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,130 @@
+"""
+Отложенная запись (write-behind) для SQLiteRepo.
+
+Запись ставится в очередь и возвращает управление сразу; отдельный поток-писатель
+забирает накопившиеся операции и применяет их пачкой в одной транзакции
+(group commit): один fsync на пачку вместо одного на каждое сообщение.
+
+Настройки:
+  flush_interval_ms — сколько писатель ждёт добора пачки после первой операции,
+                      т.е. максимальное окно, в котором запись ещё не на диске;
+  max_batch         — верхняя граница размера пачки;
+  synchronous       — PRAGMA synchronous соединения писателя (FULL / NORMAL / OFF).
+Порядок операций всегда FIFO; согласованность чтения после записи задаётся
+в SQLiteRepo (read_your_writes).
+"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from .connections import configure
+
+_STOP = object()
+
+
+class WriteBehindWriter:
+    def __init__(self, db_path, flush_interval_ms: int = 5, max_batch: int = 500,
+                 synchronous: str = "NORMAL"):
+        self.flush_interval = max(0, flush_interval_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        configure(self.conn, synchronous)
+        self._queue = queue.Queue()
+        self._closed = False
+        self.batches = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._run, name="sqlite-write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn) -> Future:
+        """Ставит fn(conn) в очередь. Future завершится после коммита пачки."""
+        if self._closed:
+            raise RuntimeError("WriteBehindWriter закрыт")
+        fut = Future()
+        self._queue.put((fn, fut))
+        return fut
+
+    def flush(self, timeout=None):
+        """Барьер: ждёт, пока всё поставленное до вызова будет закоммичено"""
+        if self._closed:
+            return
+        barrier = Future()
+        self._queue.put((None, barrier))
+        barrier.result(timeout)
+
+    def close(self, timeout=None):
+        """Сбрасывает очередь на диск и останавливает поток-писатель"""
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self.conn.close()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is _STOP:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._apply(batch)
+
+    def _apply(self, batch):
+        cur = self.conn.cursor()
+        results = []
+        try:
+            # IMMEDIATE: блокировка записи берётся сразу (ждёт busy_timeout), а не на первом
+            # INSERT — иначе снимок, прочитанный до записи ConnectionManager.writer, даёт
+            # SQLITE_BUSY_SNAPSHOT, которого busy_timeout не лечит, и падает вся пачка
+            cur.execute("BEGIN IMMEDIATE")
+            for fn, fut in batch:
+                if fn is None:
+                    results.append((fut, None, None))
+                    continue
+                # Savepoint на каждую операцию: ошибка одной не откатывает всю пачку
+                cur.execute("SAVEPOINT wb_item")
+                try:
+                    res = fn(self.conn)
+                    cur.execute("RELEASE wb_item")
+                    results.append((fut, res, None))
+                except Exception as e:
+                    cur.execute("ROLLBACK TO wb_item")
+                    cur.execute("RELEASE wb_item")
+                    results.append((fut, None, e))
+            self.conn.commit()
+        except Exception as e:
+            try:
+                self.conn.rollback()
+            except Exception:
+                pass
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        self.batches += 1
+        self.writes += sum(1 for fn, _ in batch if fn is not None)
+        for fut, res, err in results:
+            if err is not None:
+                print(f"Write-behind error: {err}")
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
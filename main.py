@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import sys
 from PySide6.QtWidgets import QApplication
@@ -27,9 +28,10 @@ class SupportChatApp:
         self.login_window.show()
 
         # Старт локального демо-сервера ТОЛЬКО если DEMO_WS=1
+        # (DEMO_WS_WORKERS=N — в N процессах, где платформа позволяет; см. realtime.cluster)
         if os.getenv("DEMO_WS", "0") == "1":
-            from realtime.server import ChatServer
-            self.server = ChatServer()
+            from realtime.cluster import create_server
+            self.server = create_server(workers=int(os.getenv("DEMO_WS_WORKERS", "1") or 1))
             self.server.start_in_background()
 
     def load_user_prefs(self):
@@ -60,5 +62,7 @@ class SupportChatApp:
 
 
 if __name__ == "__main__":
+    # Собранный exe: дочерние процессы (воркеры realtime.cluster) не должны запускать GUI заново
+    multiprocessing.freeze_support()
     app = SupportChatApp()
     sys.exit(app.run())
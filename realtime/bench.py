@@ -0,0 +1,358 @@
+"""
+Замеры демо-сервера ChatServer без сети.
+
+Запуск: python -m realtime.bench [fanout] [soak] [backpressure] [cluster]
+
+fanout — рассылка одного кадра 1000 подписчикам комнаты, часть которых
+«медленные» (не читают: send висит). Получатели — поддельные соединения,
+которые запоминают момент получения кадра; сравниваются прежняя
+последовательная рассылка и текущая ChatServer._broadcast (время — до
+доставки последнему быстрому получателю через очереди соединений).
+
+soak — миллионы жизненных циклов комнат через настоящий ChatServer._handler:
+соединение подписывается на свои комнаты и общую, затем отключается.
+Рядом держатся постоянные соединения с большим числом комнат. По окнам
+выводятся число комнат и записей индекса, RSS процесса и стоимость
+отключения — все они должны оставаться ровными. Размер: SOAK_CYCLES
+(по умолчанию 1 000 000), SOAK_ROOMS_PER_CONN, SOAK_RESIDENT_ROOMS.
+
+backpressure — в комнату идут 20 000 кадров (каждый пятый — сообщение,
+остальные — room_update), один из подписчиков не читает совсем. Для каждой
+политики переполнения выводятся глубина его очереди, выброшенные и склеенные
+кадры, закрытие соединения и пик памяти (tracemalloc); для сравнения —
+очередь без ограничения.
+
+cluster — пропускная способность ChatCluster без сети: в каждом из N
+процессов ChatServer с настоящей шиной RoomBus и поддельными подписчиками,
+подписчики каждой комнаты разложены по всем процессам, события комнат
+публикуют все процессы вперемешку. Перебираются N из CLUSTER_WORKERS
+(по умолчанию 1, 2, 4, … до числа ядер, не меньше 1,2,4); выводятся
+доставок в секунду и ускорение относительно одного процесса. Рост с N
+возможен, только пока N не больше числа ядер.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+import tempfile
+import tracemalloc
+
+from .cluster import RoomBus
+from .server import ChatServer, OVERFLOW_COALESCE, OVERFLOW_DISCONNECT, OVERFLOW_DROP_OLDEST, QUEUE_SIZE
+
+ROOM = "dialog:bench"
+
+
+class _FakeWS:
+    """Соединение-приёмник: send() фиксирует время; медленное — ждёт delay секунд"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.received_at = None
+        self.close_code = None
+        self.remote_address = ("bench", id(self))
+
+    async def send(self, msg):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received_at = time.perf_counter()
+
+    async def close(self, code=1000, reason=""):
+        self.close_code = code
+
+
+async def _broadcast_sequential(server, room, payload):
+    """Прежняя рассылка: await ws.send по очереди"""
+    msg = json.dumps(payload, ensure_ascii=False)
+    for ws in list(server._rooms.get(room, set())):
+        try:
+            await ws.send(msg)
+        except Exception:
+            pass
+
+
+class _ScriptedWS(_FakeWS):
+    """Соединение для _handler: отдаёт заранее заданные кадры и закрывается"""
+
+    def __init__(self, frames):
+        super().__init__()
+        self._frames = frames
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for frame in self._frames:
+            yield frame
+
+
+class _TimedServer(ChatServer):
+    """ChatServer, который замеряет собственно отключение (_disconnect)"""
+
+    def __init__(self):
+        super().__init__()
+        self.disconnect_seconds = 0.0
+        self.disconnects = 0
+
+    async def _disconnect(self, ws):
+        t0 = time.perf_counter()
+        await super()._disconnect(ws)
+        self.disconnect_seconds += time.perf_counter() - t0
+        self.disconnects += 1
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return float("nan")
+
+
+def _percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def _fanout_once(broadcast, subscribers, slow, slow_delay, send_timeout):
+    server = ChatServer(send_timeout=send_timeout)
+    conns = [_FakeWS(slow_delay) for _ in range(slow)] + [_FakeWS() for _ in range(subscribers - slow)]
+    for ws in conns:
+        server._register(ws)
+        server._join(ws, ROOM)
+    t0 = time.perf_counter()
+    await broadcast(server, ROOM, {"type": "message", "room": ROOM, "text": "ping"})
+    # _broadcast только ставит кадр в очереди: ждём доставки всем, кто вообще читает
+    waiting = [ws for ws in conns if ws.delay < 1]
+    while any(ws.received_at is None for ws in waiting) and time.perf_counter() - t0 < 10:
+        await asyncio.sleep(0.0005)
+    total = time.perf_counter() - t0
+    if len(waiting) < len(conns):
+        await asyncio.sleep(max(0.0, t0 + send_timeout + 0.05 - time.perf_counter()))
+    fast = [(ws.received_at - t0) * 1000 for ws in conns if not ws.delay and ws.received_at is not None]
+    return fast, total * 1000, len(server.slow_connections())
+
+
+def bench_fanout(subscribers=1000, slow_counts=(0, 1, 5, 20), slow_delay=0.05, send_timeout=0.2,
+                 stalled=5):
+    """Задержка доставки быстрым подписчикам при нескольких медленных.
+
+    Последняя строка — stalled клиентов, которые не читают вовсе: их писатели
+    через send_timeout помечают соединения медленными, остальных это не касается.
+    """
+    modes = [
+        ("последовательно", _broadcast_sequential),
+        ("ChatServer._broadcast", lambda server, room, payload: server._broadcast(room, payload)),
+    ]
+    print(f"fan-out: {subscribers} подписчиков, медленный отвечает за {slow_delay * 1000:.0f} мс, "
+          f"срок отправки {send_timeout * 1000:.0f} мс")
+    print(f"{'рассылка':<24} {'медл.':>6} {'p50, мс':>9} {'p99, мс':>9} {'max, мс':>9} {'вся, мс':>9} {'помечено':>9}")
+    for name, broadcast in modes:
+        for slow in slow_counts:
+            fast, total, flagged = asyncio.run(_fanout_once(broadcast, subscribers, slow, slow_delay, send_timeout))
+            print(f"{name:<24} {slow:>6} {_percentile(fast, 50):>9.2f} {_percentile(fast, 99):>9.2f} "
+                  f"{max(fast):>9.2f} {total:>9.1f} {flagged:>9}")
+    fast, total, flagged = asyncio.run(_fanout_once(modes[1][1], subscribers, stalled, 3600, send_timeout))
+    print(f"{'ChatServer (зависшие)':<24} {stalled:>6} {_percentile(fast, 50):>9.2f} {_percentile(fast, 99):>9.2f} "
+          f"{max(fast):>9.2f} {total:>9.1f} {flagged:>9}")
+
+
+async def _soak(cycles, rooms_per_conn, resident_rooms, windows, concurrency):
+    server = _TimedServer()
+    # Постоянные соединения: держат resident_rooms комнат всё время замера
+    resident = [_FakeWS() for _ in range(10)]
+    for i in range(resident_rooms):
+        server._join(resident[i % len(resident)], f"dialog:resident-{i}")
+
+    def frames(n):
+        own = [json.dumps({"type": "subscribe", "room": f"dialog:{n}-{k}"}) for k in range(rooms_per_conn)]
+        return own + [json.dumps({"type": "subscribe", "room": "dialog:shared"})]
+
+    window = max(cycles // windows, concurrency)
+    print(f"soak: {cycles} соединений × {rooms_per_conn + 1} комнат, постоянных комнат {resident_rooms}")
+    print(f"{'циклов':>10} {'комнат':>8} {'индекс':>8} {'RSS, МБ':>9} {'отключение, мкс':>16} {'цикл, мкс':>10}")
+    done = 0
+    while done < cycles:
+        server.disconnect_seconds, server.disconnects = 0.0, 0
+        t0 = time.perf_counter()
+        end = min(done + window, cycles)
+        while done < end:
+            batch = range(done, min(done + concurrency, end))
+            await asyncio.gather(*(server._handler(_ScriptedWS(frames(n))) for n in batch))
+            done += len(batch)
+        elapsed = time.perf_counter() - t0
+        per_cycle = elapsed / max(server.disconnects, 1) * 1e6
+        per_disconnect = server.disconnect_seconds / max(server.disconnects, 1) * 1e6
+        print(f"{done:>10} {len(server._rooms):>8} {len(server._ws_rooms):>8} {_rss_mb():>9.1f} "
+              f"{per_disconnect:>16.2f} {per_cycle:>10.2f}")
+    leaked = len(server._rooms) - resident_rooms
+    if leaked or len(server._ws_rooms) != len(resident):
+        print(f"Утечка: лишних комнат {leaked}, записей индекса {len(server._ws_rooms)}")
+        return 1
+    return 0
+
+
+def bench_soak(cycles=None, rooms_per_conn=None, resident_rooms=None, windows=10, concurrency=100):
+    """Память и стоимость отключения на длинной серии подключений/отключений"""
+    cycles = cycles or int(os.environ.get("SOAK_CYCLES", 1_000_000))
+    rooms_per_conn = rooms_per_conn or int(os.environ.get("SOAK_ROOMS_PER_CONN", 2))
+    resident_rooms = resident_rooms or int(os.environ.get("SOAK_RESIDENT_ROOMS", 10_000))
+    return asyncio.run(_soak(cycles, rooms_per_conn, resident_rooms, windows, concurrency))
+
+
+async def _backpressure_once(overflow, queue_size, frames, readers):
+    server = ChatServer(queue_size=queue_size, overflow=overflow, send_timeout=0.05)
+    stalled = _FakeWS(3600)
+    conns = [stalled] + [_FakeWS() for _ in range(readers)]
+    for ws in conns:
+        server._register(ws)
+        server._join(ws, ROOM)
+    box = server._outboxes[stalled]
+    depth_max = 0
+    tracemalloc.start()
+    for i in range(frames):
+        if i % 5 == 0:
+            payload = {"type": "message", "room": ROOM, "text": f"сообщение {i} " + "x" * 200}
+        else:
+            payload = {"type": "room_update", "room": ROOM, "participantsCount": i}
+        await server._broadcast(ROOM, payload)
+        await asyncio.sleep(0)
+        depth_max = max(depth_max, len(box))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    await asyncio.sleep(0)
+    readers_dropped = sum(server._outboxes[ws].dropped for ws in conns[1:])
+    return depth_max, box.stats(), stalled.close_code, readers_dropped, peak / 2 ** 20
+
+
+def bench_backpressure(frames=20_000, readers=10, queue_size=QUEUE_SIZE):
+    """Память сервера при подписчике, который перестал читать"""
+    runs = [
+        ("без ограничения", OVERFLOW_DROP_OLDEST, frames + 1),
+        (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_OLDEST, queue_size),
+        (OVERFLOW_COALESCE, OVERFLOW_COALESCE, queue_size),
+        (OVERFLOW_DISCONNECT, OVERFLOW_DISCONNECT, queue_size),
+    ]
+    print(f"backpressure: {frames} кадров, {readers} читающих подписчиков и один зависший, очередь {queue_size}")
+    print(f"{'политика':<16} {'глубина max':>12} {'в конце':>8} {'выброшено':>10} {'склеено':>8} "
+          f"{'закрыт':>7} {'читатели потеряли':>18} {'пик, МБ':>8}")
+    for name, overflow, size in runs:
+        depth_max, st, close_code, readers_dropped, peak = asyncio.run(
+            _backpressure_once(overflow, size, frames, readers))
+        print(f"{name:<16} {depth_max:>12} {st['depth']:>8} {st['dropped']:>10} {st['coalesced']:>8} "
+              f"{close_code or '—':>7} {readers_dropped:>18} {peak:>8.2f}")
+    return 0
+
+
+class _CountingWS(_FakeWS):
+    """Подписчик для cluster: считает доставленные кадры процесса"""
+    delivered = 0
+
+    async def send(self, msg):
+        _CountingWS.delivered += 1
+
+
+async def _cluster_worker_async(index, workers, bus_dir, rooms, subscribers, events, barrier):
+    server = ChatServer(queue_size=events + 16)
+    server.bus = RoomBus(index, workers, bus_dir)
+    await server.bus.start(server)
+    local = 0
+    for r in range(rooms):
+        for k in range(subscribers):
+            if k % workers == index:
+                ws = _CountingWS()
+                server._register(ws)
+                server._join(ws, f"dialog:{r}")
+                local += 1
+    expected = local * events
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, barrier.wait)
+    t0 = time.perf_counter()
+    for j in range(index, events, workers):
+        for r in range(rooms):
+            await server._broadcast(f"dialog:{r}", {"type": "message", "room": f"dialog:{r}", "text": f"#{j}"})
+        await asyncio.sleep(0)
+    while _CountingWS.delivered < expected and time.perf_counter() - t0 < 120:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - t0
+    # Не закрываем шину, пока остальные не доставили своё
+    await loop.run_in_executor(None, barrier.wait)
+    await server.bus.close()
+    return _CountingWS.delivered, expected, elapsed
+
+
+def _cluster_worker(index, workers, bus_dir, rooms, subscribers, events, barrier, results):
+    results.put((index, *asyncio.run(
+        _cluster_worker_async(index, workers, bus_dir, rooms, subscribers, events, barrier))))
+
+
+def _worker_sweep(cores):
+    """1, 2, 4, … до cores (и сам cores), но не короче 1, 2, 4"""
+    counts, n = [], 1
+    while n < max(cores, 4):
+        counts.append(n)
+        n *= 2
+    return sorted(set(counts + [max(cores, 4)]))
+
+
+def bench_cluster(rooms=200, subscribers=20, events=50, worker_counts=None):
+    """Доставок в секунду у ChatCluster при разном числе процессов"""
+    if not worker_counts:
+        spec = os.environ.get("CLUSTER_WORKERS")
+        worker_counts = [int(n) for n in spec.split(",")] if spec else _worker_sweep(os.cpu_count() or 1)
+    ctx = multiprocessing.get_context("spawn")
+    print(f"cluster: {rooms} комнат × {subscribers} подписчиков, {events} событий в комнате, "
+          f"ядер {os.cpu_count()}")
+    print(f"{'воркеров':>9} {'доставлено':>11} {'время, с':>9} {'доставок/с':>11} {'ускорение':>10}")
+    rc = 0
+    base = None
+    for workers in worker_counts:
+        bus_dir = tempfile.mkdtemp(prefix="chatbus-bench-")
+        barrier, results = ctx.Barrier(workers), ctx.Queue()
+        processes = [ctx.Process(target=_cluster_worker,
+                                 args=(i, workers, bus_dir, rooms, subscribers, events, barrier, results))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        rows = [results.get(timeout=300) for _ in processes]
+        for process in processes:
+            process.join()
+        delivered = sum(r[1] for r in rows)
+        expected = sum(r[2] for r in rows)
+        elapsed = max(r[3] for r in rows)
+        rate = delivered / elapsed
+        base = base or (rate if workers == 1 else None)
+        speedup = f"{rate / base:.2f}×" if base else "—"
+        print(f"{workers:>9} {delivered:>11} {elapsed:>9.2f} {rate:>11.0f} {speedup:>10}")
+        if delivered != expected:
+            print(f"Доставлено {delivered} из {expected}")
+            rc = 1
+        for name in os.listdir(bus_dir):
+            os.unlink(os.path.join(bus_dir, name))
+        os.rmdir(bus_dir)
+    return rc
+
+
+COMMANDS = {
+    "fanout": lambda: bench_fanout() or 0,
+    "soak": bench_soak,
+    "backpressure": bench_backpressure,
+    "cluster": bench_cluster,
+}
+
+
+def main(argv=None):
+    names = list(argv or COMMANDS)
+    rc = 0
+    for name in names:
+        if name not in COMMANDS:
+            print(f"Неизвестный замер: {name}. Доступны: {', '.join(COMMANDS)}")
+            return 2
+        rc = COMMANDS[name]() or rc
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -5,6 +5,9 @@ from typing import Optional
 from PySide6.QtCore import QObject, Signal
 import websockets
 
+# Служебные кадры с текущим seq комнаты (не события — не отбрасываются как повторы)
+CONTROL_TYPES = {"subscribe_ack", "start_chat_ack", "resync"}
+
 
 class ChatClient(QObject):
     """
@@ -22,12 +25,15 @@ class ChatClient(QObject):
         self._loop: Optional[asyncio.AbstractEventLoop] = None
         self._ws = None
         self._room_id: Optional[str] = None
+        self._last_seq: Optional[int] = None  # seq последнего полученного события комнаты
         self._stop = threading.Event()
         self._reconnect_attempts = 0
         self._max_reconnect_attempts = 10
 
     def connect_room(self, room_id: str | int):
         """Переподключение к новой комнате"""
+        if str(room_id) != self._room_id:
+            self._last_seq = None
         self._room_id = str(room_id)
         self._reconnect_attempts = 0
         self.stop()
@@ -59,12 +65,14 @@ class ChatClient(QObject):
             return
 
         self._loop = asyncio.get_running_loop()
-        url = f"{self.base_ws}/{self._room_id}/?token={self.token}"
-
-        print(f"DEBUG ChatClient: Attempting to connect to: {url}")
         print(f"DEBUG ChatClient: Token: {self.token[:50]}..." if self.token else "No token")
 
         while not self._stop.is_set() and self._reconnect_attempts < self._max_reconnect_attempts:
+            # После обрыва сервер по last_seq досылает только пропущенные события комнаты
+            url = f"{self.base_ws}/{self._room_id}/?token={self.token}"
+            if self._last_seq is not None:
+                url += f"&last_seq={self._last_seq}"
+            print(f"DEBUG ChatClient: Attempting to connect to: {url}")
             try:
                 self.state_changed.emit("connecting")
                 print(f"DEBUG ChatClient: Connecting, attempt {self._reconnect_attempts + 1}")
@@ -89,6 +97,8 @@ class ChatClient(QObject):
                             print(f"DEBUG ChatClient: Received message: {raw}")
                             try:
                                 evt = json.loads(raw)
+                                if self._seen(evt):
+                                    continue
                                 self.message_received.emit(evt)
                             except json.JSONDecodeError as e:
                                 self.connection_error.emit(f"Ошибка парсинга сообщения: {e}")
@@ -126,6 +136,20 @@ class ChatClient(QObject):
                     self.state_changed.emit("disconnected")
                 self._ws = None
 
+    def _seen(self, evt: dict) -> bool:
+        """True — событие уже получено (повтор при дозагрузке); иначе запоминает его seq"""
+        seq = evt.get("seq")
+        if not isinstance(seq, int):
+            return False
+        if evt.get("type") in CONTROL_TYPES:
+            # ack / resync сообщают текущий seq комнаты, сами событиями не являются
+            self._last_seq = seq
+            return False
+        if self._last_seq is not None and seq <= self._last_seq:
+            return True
+        self._last_seq = seq
+        return False
+
     async def _send_json(self, data: dict):
         """Отправка JSON данных"""
         if self._ws and not self._ws.closed:
@@ -0,0 +1,304 @@
+"""
+Демо-сервер в несколько процессов.
+
+ChatCluster запускает workers процессов ChatServer на одном порту
+(SO_REUSEPORT: ядро само раскладывает подключения по процессам), так что
+сервер занимает столько ядер, сколько воркеров. Подписчики одной комнаты
+оказываются в разных процессах, поэтому воркеры связаны шиной RoomBus —
+Unix-сокетами «каждый с каждым» в общем временном каталоге.
+
+Комната принадлежит одному воркеру (crc32(room) % workers). Событие комнаты
+из любого воркера уходит владельцу; он даёт ему номер seq, кладёт в свою
+историю и рассылает готовый кадр всем воркерам, включая отправителя. Каждый
+воркер добавляет кадр в свою историю и ставит в очереди своих подписчиков.
+Так номера событий комнаты едины для всего кластера, и переподключение с
+last_seq к любому воркеру дозагружает пропущенное. Порядок событий комнаты
+везде один: их выпускает один процесс, а соединение между парой воркеров
+сохраняет порядок кадров.
+
+    python -m realtime.cluster [--workers N] [--host H] [--port P]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import zlib
+
+from .server import ChatServer
+
+CONNECT_TIMEOUT = 10.0  # с на подключение к остальным воркерам при старте
+
+
+def unsupported_reason():
+    """Почему кластер на этой платформе не запустится; None — запустится (Linux, macOS)"""
+    if not hasattr(socket, "AF_UNIX") or not hasattr(asyncio, "start_unix_server"):
+        return "нет Unix-сокетов для шины"
+    if not hasattr(socket, "SO_REUSEPORT"):
+        return "нет SO_REUSEPORT"
+    return None
+
+
+def create_server(host: str = "127.0.0.1", port: int = 8765, *, workers: int = 1, **server_kwargs):
+    """ChatCluster при workers > 1, если платформа его поддерживает; иначе один ChatServer"""
+    if workers > 1:
+        reason = unsupported_reason()
+        if reason is None:
+            return ChatCluster(host, port, workers=workers, **server_kwargs)
+        print(f"ChatCluster недоступен ({reason}), запускается один ChatServer")
+    return ChatServer(host, port, **server_kwargs)
+
+
+def owner_of(room: str, workers: int) -> int:
+    """Номер воркера-владельца комнаты"""
+    return zlib.crc32(room.encode("utf-8")) % workers
+
+
+class RoomBus:
+    """
+    Шина комнат между воркерами: своя ссылка на каждый другой воркер.
+
+    Кадры — строки JSON:
+      {"op": "hello", "index": ...}                      — первый кадр ссылки: чья она;
+      {"op": "publish", "room": ..., "payload": {...}}  — владельцу: событие без номера;
+      {"op": "event", "room": ..., "seq": ..., "type": ..., "msg": "..."} — от владельца всем;
+      {"op": "bye"}                                     — штатное закрытие ссылки.
+
+    Воркер, чья ссылка оборвалась без bye (ошибка записи или EOF у читателя),
+    исключается из шины: события его подписчикам больше не идут, а комнаты,
+    которыми он владел, нумерует тот воркер, в который пришло событие.
+    """
+
+    def __init__(self, index: int, workers: int, bus_dir: str):
+        self.index = index
+        self.workers = workers
+        self.bus_dir = bus_dir
+        self.server = None
+        self._listener = None
+        self._peers = {}    # номер воркера -> StreamWriter
+        self._readers = set()
+        self.published = 0  # событий, которым этот воркер дал номер
+        self.received = 0   # событий, пришедших от владельцев по шине
+        self.lost_peers = 0  # воркеров, выпавших из шины из-за ошибок записи
+
+    def path(self, index: int) -> str:
+        return os.path.join(self.bus_dir, f"worker-{index}.sock")
+
+    async def start(self, server):
+        """Слушает свой сокет и подключается к остальным воркерам (ждёт их запуска)"""
+        self.server = server
+        self._listener = await asyncio.start_unix_server(self._accept, path=self.path(self.index))
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        for peer in range(self.workers):
+            if peer == self.index:
+                continue
+            while True:
+                try:
+                    _, writer = await asyncio.open_unix_connection(self.path(peer))
+                    writer.write(self._line({"op": "hello", "index": self.index}))
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"Воркер {peer} не поднял шину за {CONNECT_TIMEOUT} с")
+                    await asyncio.sleep(0.05)
+            self._peers[peer] = writer
+
+    async def close(self, timeout=1.0):
+        # bye и закрытие ссылок дают читателям на той стороне штатный EOF; своих читателей ждём так же
+        for peer, writer in list(self._peers.items()):
+            self._write(peer, writer, self._line({"op": "bye"}))
+            writer.close()
+        self._peers.clear()
+        if self._listener is not None:
+            self._listener.close()
+        if self._readers:
+            await asyncio.wait(list(self._readers), timeout=timeout)
+        for task in list(self._readers):
+            task.cancel()
+
+    async def publish(self, room: str, payload: dict):
+        owner = owner_of(room, self.workers)
+        writer = self._peers.get(owner)
+        if writer is not None and self._write(owner, writer, self._line({"op": "publish", "room": room,
+                                                                          "payload": payload})):
+            targets = {owner: writer}
+        else:
+            # Владелец — этот воркер, или владельца больше нет: номер даём сами, чтобы
+            # событие дошло до своих подписчиков и до остальных живых воркеров
+            self._publish_owned(room, payload)
+            targets = dict(self._peers)
+        # drain ждём только здесь, в обработчике клиента: читатели шины никогда не
+        # блокируются на записи, иначе два воркера с полными буферами ждали бы друг друга
+        for peer, peer_writer in targets.items():
+            try:
+                await peer_writer.drain()
+            except (ConnectionError, OSError) as e:
+                self._drop_peer(peer, e)
+
+    def _publish_owned(self, room: str, payload: dict):
+        seq, key, msg = self.server._stamp(room, payload)
+        self.server._deliver(room, seq, key, msg)
+        self.published += 1
+        line = self._line({"op": "event", "room": room, "seq": seq, "type": payload.get("type"), "msg": msg})
+        for peer, writer in list(self._peers.items()):
+            self._write(peer, writer, line)
+
+    def _write(self, peer: int, writer, line: bytes) -> bool:
+        """Запись в ссылку на воркер; упавший воркер исключается из шины, а не роняет отправителя"""
+        try:
+            if writer.is_closing():
+                raise ConnectionResetError("ссылка закрыта")
+            writer.write(line)
+            return True
+        except (ConnectionError, OSError) as e:
+            self._drop_peer(peer, e)
+            return False
+
+    def _drop_peer(self, peer: int, error):
+        writer = self._peers.pop(peer, None)
+        if writer is None:
+            return
+        self.lost_peers += 1
+        print(f"RoomBus {self.index}: воркер {peer} недоступен ({error!r}), его подписчики не получат события; "
+              f"комнаты, которыми он владел, нумерует отправитель")
+        writer.close()
+
+    @staticmethod
+    def _line(frame: dict) -> bytes:
+        return (json.dumps(frame, ensure_ascii=False) + "\n").encode("utf-8")
+
+    async def _accept(self, reader, writer):
+        self._readers.add(asyncio.current_task())
+        peer, lost = None, None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    lost = "EOF"
+                    break
+                frame = json.loads(line)
+                op = frame["op"]
+                if op == "event":
+                    self.received += 1
+                    room = frame["room"]
+                    key = self.server._coalesce_key({"type": frame.get("type"), "room": room})
+                    self.server._deliver(room, frame["seq"], key, frame["msg"])
+                elif op == "publish":
+                    self._publish_owned(frame["room"], frame["payload"])
+                elif op == "hello":
+                    peer = frame["index"]
+                elif op == "bye":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            lost = e
+        except (ValueError, KeyError, TypeError) as e:
+            # Битый кадр: дальше по этой ссылке верить нечему — как при обрыве
+            lost = e
+        except asyncio.CancelledError:
+            # Отмена — только из close(): чтение просто заканчивается
+            pass
+        finally:
+            self._readers.discard(asyncio.current_task())
+            writer.close()
+            if lost is not None and peer is not None:
+                self._drop_peer(peer, lost)
+            elif lost is not None:
+                print(f"RoomBus {self.index}: ссылка оборвалась до hello ({lost!r})")
+            elif peer is not None and lost is None:
+                # Штатное закрытие: тот воркер больше не пишет и не читает
+                stale = self._peers.pop(peer, None)
+                if stale is not None:
+                    stale.close()
+
+
+def _worker_main(index, workers, bus_dir, host, port, server_kwargs):
+    server = ChatServer(host, port, **server_kwargs)
+    server.bus = RoomBus(index, workers, bus_dir)
+    try:
+        asyncio.run(server._run(reuse_port=True))
+    except KeyboardInterrupt:
+        pass
+
+
+class ChatCluster:
+    """
+    workers процессов ChatServer на одном порту и шина комнат между ними.
+    Параметры ChatServer (send_timeout, queue_size, overflow, ...) передаются как есть.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, *, workers: int = None, **server_kwargs):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.server_kwargs = server_kwargs
+        self._processes = []
+        self._bus_dir = None
+
+    def start(self):
+        """Запускает воркеры и сразу возвращается (процессы-демоны)"""
+        self._bus_dir = tempfile.mkdtemp(prefix="chatbus-")
+        # spawn, а не fork: родителем может быть Qt-приложение с потоками
+        ctx = multiprocessing.get_context("spawn")
+        for index in range(self.workers):
+            process = ctx.Process(
+                target=_worker_main, name=f"chat-worker-{index}", daemon=True,
+                args=(index, self.workers, self._bus_dir, self.host, self.port, self.server_kwargs))
+            process.start()
+            self._processes.append(process)
+
+    # Тот же вызов, что у ChatServer: main.py запускает кластер так же, как один сервер
+    start_in_background = start
+
+    def alive(self) -> int:
+        return sum(p.is_alive() for p in self._processes)
+
+    def stop(self, timeout=5):
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            process.join(timeout)
+        self._processes = []
+        if self._bus_dir:
+            shutil.rmtree(self._bus_dir, ignore_errors=True)
+            self._bus_dir = None
+
+    def join(self):
+        for process in self._processes:
+            process.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m realtime.cluster", description="Демо-сервер чатов в N процессах")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    cluster = create_server(args.host, args.port, workers=args.workers)
+    if isinstance(cluster, ChatServer):
+        try:
+            asyncio.run(cluster._run())
+        except KeyboardInterrupt:
+            pass
+        return 0
+    cluster.start()
+    print(f"ChatCluster: {cluster.workers} воркеров на ws://{args.host}:{args.port}")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        cluster.join()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        cluster.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
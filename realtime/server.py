@@ -1,39 +1,333 @@
 import asyncio
 import json
 import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
 from websockets.server import serve
-from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
+
+
+# Срок отправки кадра одному получателю (с). Кто не принял за это время —
+# помечается медленным; остальные получатели комнаты его не ждут.
+SEND_TIMEOUT = 1.0
+
+# Исходящая очередь соединения: не больше QUEUE_SIZE кадров, при переполнении —
+# политика overflow. Так клиент, который перестал читать, держит в памяти
+# сервера не больше QUEUE_SIZE кадров, а не всё, что ему разослали.
+QUEUE_SIZE = 256
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # выбросить самый старый кадр
+OVERFLOW_COALESCE = "coalesce"        # заменить устаревшее состояние, иначе как drop_oldest
+OVERFLOW_DISCONNECT = "disconnect"    # закрыть соединение с кодом CLOSE_SLOW_CONSUMER
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_DISCONNECT)
+CLOSE_SLOW_CONSUMER = 1008            # policy violation
+# Кадры-состояния: новый кадр того же типа для той же комнаты делает старый ненужным
+COALESCE_TYPES = {"room_update", "status", "typing", "presence"}
+
+# История комнаты: последние HISTORY_SIZE событий (с номерами seq) для дозагрузки
+# после переподключения по last_seq; история хранится не больше чем для
+# HISTORY_ROOMS комнат, первыми вытесняются давно молчащие комнаты без подписчиков.
+# Историю комнат с подписчиками не вытесняем: если их одних больше HISTORY_ROOMS,
+# предел превышается, а ChatServer.history_overflow считает такие случаи.
+HISTORY_SIZE = 128
+HISTORY_ROOMS = 10_000
 
 
 def now_iso() -> str:
     return datetime.utcnow().isoformat()
 
+
+class Outbox:
+    """
+    Ограниченная очередь исходящих кадров одного соединения и её писатель.
+
+    Писатель — отдельная задача: отправляет кадры по одному, дожидаясь
+    ws.send. Если отправка не уложилась в send_timeout, соединение
+    помечается медленным (on_slow), но отправка не отменяется (кадр уже может быть
+    частично в буфере транспорта) — пока клиент не читает, растёт очередь,
+    и её ограничивает политика overflow.
+    """
+
+    def __init__(self, ws, *, size=QUEUE_SIZE, overflow=OVERFLOW_DROP_OLDEST, send_timeout=SEND_TIMEOUT,
+                 close_code=CLOSE_SLOW_CONSUMER, on_slow=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {overflow!r}")
+        self.ws = ws
+        self.size = size
+        self.overflow = overflow
+        self.send_timeout = send_timeout
+        self.close_code = close_code
+        self._on_slow = on_slow
+        self._frames = deque()   # (ключ склейки или None, текст кадра)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def stats(self) -> dict:
+        return {"depth": len(self._frames), "sent": self.sent, "dropped": self.dropped,
+                "coalesced": self.coalesced, "closed": self.closed}
+
+    def put(self, msg: str, key=None) -> bool:
+        """Ставит кадр в очередь; False — соединение закрыто или закрывается"""
+        if self.closed:
+            return False
+        if key is not None and self.overflow == OVERFLOW_COALESCE:
+            for i, (queued_key, _) in enumerate(self._frames):
+                if queued_key == key:
+                    # Старое состояние больше не нужно; новое — в конец, после всего, что было до него
+                    del self._frames[i]
+                    self.coalesced += 1
+                    break
+        if len(self._frames) >= self.size:
+            if self.overflow == OVERFLOW_DISCONNECT:
+                self._disconnect_slow()
+                return False
+            self._frames.popleft()
+            self.dropped += 1
+        self._frames.append((key, msg))
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        self._wakeup.set()
+        return True
+
+    def _disconnect_slow(self):
+        print(f"ChatServer: очередь {getattr(self.ws, 'remote_address', self.ws)} переполнена "
+              f"({self.size}), соединение закрывается с кодом {self.close_code}")
+        self.dropped += len(self._frames) + 1
+        self.close()
+        self._closing = asyncio.ensure_future(self.ws.close(code=self.close_code, reason="slow consumer"))
+
+    def close(self):
+        self.closed = True
+        self._frames.clear()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self.closed:
+            if not self._frames:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            _, msg = self._frames.popleft()
+            # Срок отправки — таймер, а не отдельная задача на каждый кадр
+            timer = loop.call_later(self.send_timeout, self._on_slow, self.ws) if self._on_slow else None
+            try:
+                await self.ws.send(msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Соединение разорвано: _handler завершится и уберёт его из комнат
+                self.closed = True
+                self._frames.clear()
+                return
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            self.sent += 1
+
+
+class RoomHistory:
+    """Номер последнего события комнаты и кольцевой буфер последних кадров"""
+
+    def __init__(self, size=HISTORY_SIZE):
+        # Первый номер — микросекунды создания: номера растут и после перезапуска
+        # сервера или вытеснения истории, и старый last_seq не спутать с новым
+        self.seq = time.time_ns() // 1000
+        self.frames = deque(maxlen=size)  # (seq, ключ склейки, текст кадра)
+
+    def append(self, seq, key, msg):
+        self.seq = seq
+        self.frames.append((seq, key, msg))
+
+    def since(self, last_seq):
+        """Кадры после last_seq; None — их уже нет в буфере (или last_seq чужой), нужен resync"""
+        if last_seq > self.seq:
+            return None
+        oldest = self.frames[0][0] if self.frames else self.seq + 1
+        if last_seq < oldest - 1:
+            return None
+        return [(key, msg) for seq, key, msg in self.frames if seq > last_seq]
+
+
 class ChatServer:
-    def __init__(self, host: str = "127.0.0.1", port: int = 8765):
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, *, send_timeout: float = SEND_TIMEOUT,
+                 queue_size: int = QUEUE_SIZE, overflow: str = OVERFLOW_DROP_OLDEST,
+                 close_code: int = CLOSE_SLOW_CONSUMER, history_size: int = HISTORY_SIZE,
+                 history_rooms: int = HISTORY_ROOMS):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {overflow!r}")
         self.host = host
         self.port = port
+        self.send_timeout = send_timeout
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.close_code = close_code
+        self.history_size = history_size
+        self.history_rooms = history_rooms
         self._rooms = {}  # room -> set of websockets
+        self._ws_rooms = {}  # ws -> set of rooms (обратный индекс для отключения)
         self._lock = asyncio.Lock()
         self._thread = None
         self._agents = {}   # ws -> {"instance_id":..., "operator_id":...}
+        self._slow = {}     # ws -> сколько раз не уложился в send_timeout
+        self._outboxes = {}  # ws -> Outbox
+        self._history = {}  # room -> RoomHistory
+        self._idle_history = OrderedDict()  # комнаты с историей без подписчиков, давно молчащие — первыми
+        self.history_overflow = 0  # раз, когда предел history_rooms не удалось выдержать
+        self.bus = None  # RoomBus в режиме нескольких процессов (realtime.cluster)
+
+    def slow_connections(self) -> dict:
+        """{ws: число просроченных отправок} — соединения, помеченные медленными"""
+        return dict(self._slow)
+
+    def queue_depths(self) -> dict:
+        """{ws: кадров в исходящей очереди}"""
+        return {ws: len(box) for ws, box in self._outboxes.items()}
+
+    def connection_stats(self) -> dict:
+        """{ws: {depth, sent, dropped, coalesced, closed}} по исходящим очередям"""
+        return {ws: box.stats() for ws, box in self._outboxes.items()}
+
+    def _register(self, ws) -> Outbox:
+        box = self._outboxes.get(ws)
+        if box is None:
+            box = self._outboxes[ws] = Outbox(ws, size=self.queue_size, overflow=self.overflow,
+                                              send_timeout=self.send_timeout, close_code=self.close_code,
+                                              on_slow=self._flag_slow)
+        return box
+
+    @staticmethod
+    def _coalesce_key(payload: dict):
+        return (payload.get("type"), payload.get("room")) if payload.get("type") in COALESCE_TYPES else None
+
+    def _send(self, ws, payload: dict, msg: str = None) -> bool:
+        """Кадр в очередь соединения; msg — уже закодированный payload"""
+        box = self._outboxes.get(ws)
+        if box is None:
+            return False
+        return box.put(msg if msg is not None else json.dumps(payload, ensure_ascii=False),
+                       self._coalesce_key(payload))
+
+    def _room_history(self, room: str) -> RoomHistory:
+        history = self._history.get(room)
+        if history is None:
+            self._evict_history(self.history_rooms - 1)
+            history = self._history[room] = RoomHistory(self.history_size)
+            if room not in self._rooms:
+                self._idle_history[room] = None
+        elif room in self._idle_history:
+            self._idle_history.move_to_end(room)
+        return history
+
+    def _evict_history(self, limit: int):
+        """Вытесняет историю давно молчащих комнат без подписчиков, пока комнат не больше limit"""
+        while len(self._history) > limit and self._idle_history:
+            room, _ = self._idle_history.popitem(last=False)
+            del self._history[room]
+        if len(self._history) > limit:
+            # Остались только комнаты с подписчиками: им история нужна при переподключении
+            self.history_overflow += 1
+            if self.history_overflow == 1:
+                print(f"ChatServer: предел history_rooms={self.history_rooms} превышен — "
+                      f"у всех комнат с историей есть подписчики")
+
+    def _resume(self, ws, room: str, last_seq) -> dict:
+        """
+        Дозагрузка после переподключения: кадры комнаты с номером больше last_seq —
+        в очередь ws. Вызывать сразу после _join, без await между ними, чтобы
+        новые события не проскочили между историей и подпиской.
+        Возвращает поля для ack: текущий seq и сколько кадров отправлено.
+        """
+        history = self._history.get(room)
+        seq = history.seq if history is not None else None
+        if last_seq is None:
+            return {"seq": seq, "replayed": 0}
+        frames = history.since(last_seq) if history is not None else None
+        if frames is None:
+            # Пропущенного уже нет в буфере: клиенту нужна полная загрузка (REST)
+            self._send(ws, {"type": "resync", "room": room, "last_seq": last_seq, "seq": seq})
+            return {"seq": seq, "replayed": 0, "resync": True}
+        box = self._outboxes.get(ws)
+        for key, msg in frames:
+            if box is not None:
+                box.put(msg, key)
+        return {"seq": seq, "replayed": len(frames)}
+
+    @staticmethod
+    def _last_seq(data: dict):
+        try:
+            return int(data["last_seq"]) if data.get("last_seq") is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    def _join(self, ws, room):
+        """Подписка ws на комнату; вызывать под self._lock"""
+        self._rooms.setdefault(room, set()).add(ws)
+        self._ws_rooms.setdefault(ws, set()).add(room)
+        self._idle_history.pop(room, None)
+
+    async def _disconnect(self, ws):
+        # Обходим только комнаты этого соединения, а не все комнаты сервера
+        async with self._lock:
+            for room in self._ws_rooms.pop(ws, ()):
+                conns = self._rooms.get(room)
+                if conns is not None:
+                    conns.discard(ws)
+                    if not conns:
+                        del self._rooms[room]
+                        if room in self._history:
+                            self._idle_history[room] = None
+            if len(self._history) > self.history_rooms:
+                self._evict_history(self.history_rooms)
+            self._agents.pop(ws, None)
+            self._slow.pop(ws, None)
+            box = self._outboxes.pop(ws, None)
+        if box is not None:
+            box.close()
+
+    def _flag_slow(self, ws):
+        missed = self._slow.get(ws, 0) + 1
+        self._slow[ws] = missed
+        if missed == 1:
+            print(f"ChatServer: медленный клиент {getattr(ws, 'remote_address', ws)}, "
+                  f"отправка дольше {self.send_timeout} с")
 
     async def _broadcast(self, room: str, payload: dict):
-        msg = json.dumps(payload, ensure_ascii=False)
-        conns = list(self._rooms.get(room, set()))
-        to_remove = []
-        for ws in conns:
-            try:
-                await ws.send(msg)
-            except Exception:
-                to_remove.append(ws)
-        if to_remove:
-            async with self._lock:
-                for ws in to_remove:
-                    self._rooms.get(room, set()).discard(ws)
+        if self.bus is not None:
+            # Несколько воркеров: номер событию даёт воркер-владелец комнаты,
+            # он же рассылает его всем воркерам (см. realtime.cluster.RoomBus)
+            await self.bus.publish(room, payload)
+            return
+        self._deliver(room, *self._stamp(room, payload))
+
+    def _stamp(self, room: str, payload: dict):
+        """Следующий номер события комнаты и кадр с ним: (seq, ключ склейки, текст кадра)"""
+        payload = dict(payload, seq=self._room_history(room).seq + 1)
+        return payload["seq"], self._coalesce_key(payload), json.dumps(payload, ensure_ascii=False)
+
+    def _deliver(self, room: str, seq: int, key, msg: str):
+        # Событие попадает в историю комнаты, а кадр (закодированный один раз) только
+        # ставится в очереди получателей: доставляют писатели соединений,
+        # медленный получатель никого не задерживает
+        self._room_history(room).append(seq, key, msg)
+        for ws in list(self._rooms.get(room, ())):
+            box = self._outboxes.get(ws)
+            if box is not None:
+                box.put(msg, key)
 
     async def _handler(self, ws):
-        # При подключении клиент может подписываться на комнаты: {"type":"subscribe","room":"dialog:XYZ"}
+        # При подключении клиент может подписываться на комнаты: {"type":"subscribe","room":"dialog:XYZ"}.
+        # Каждое событие комнаты несёт seq; переподключившийся клиент передаёт в subscribe /
+        # start_chat последний полученный "last_seq" и получает только пропущенное, затем ack
+        self._register(ws)
         try:
             async for raw in ws:
                 try:
@@ -46,7 +340,9 @@ class ChatServer:
                     if not room:
                         continue
                     async with self._lock:
-                        self._rooms.setdefault(room, set()).add(ws)
+                        self._join(ws, room)
+                        resumed = self._resume(ws, room, self._last_seq(data))
+                    self._send(ws, {"type": "subscribe_ack", "room": room, "ts": now_iso(), **resumed})
 
                 elif data.get("type") == "hello":
                     ag = data.get("agent") or {}
@@ -55,11 +351,7 @@ class ChatServer:
                         "operator_id": ag.get("operator_id"),
                     }
                     # Ответим ack только этому ws
-                    try:
-                        await ws.send(json.dumps({"type": "hello_ack", "ts": now_iso(), "agent": self._agents[ws]},
-                                                 ensure_ascii=False))
-                    except (ConnectionClosedOK, ConnectionClosedError):
-                        pass
+                    self._send(ws, {"type": "hello_ack", "ts": now_iso(), "agent": self._agents[ws]})
 
                 elif data.get("type") == "start_chat":
                     room = data.get("room")
@@ -67,21 +359,20 @@ class ChatServer:
                         continue
 
                     async with self._lock:
-                        self._rooms.setdefault(room, set()).add(ws)
+                        self._join(ws, room)
+                        resumed = self._resume(ws, room, self._last_seq(data))
 
                     agent = self._agents.get(ws, {})
 
-                    try:
-                        await ws.send(json.dumps({
-                            "type": "start_chat_ack",
-                            "room": room,
-                            "dialog_id": data.get("dialog_id"),
-                            "user_id": data.get("user_id"),
-                            "agent": agent,
-                            "ts": now_iso(),
-                        }, ensure_ascii=False))
-                    except (ConnectionClosedOK, ConnectionClosedError):
-                        pass
+                    self._send(ws, {
+                        "type": "start_chat_ack",
+                        "room": room,
+                        "dialog_id": data.get("dialog_id"),
+                        "user_id": data.get("user_id"),
+                        "agent": agent,
+                        "ts": now_iso(),
+                        **resumed,
+                    })
 
                     await self._broadcast(room, {
                         "type": "system", "room": room, "dialog_id": data.get("dialog_id"),
@@ -96,13 +387,13 @@ class ChatServer:
                     await self._broadcast(room, data)
 
         finally:
-            async with self._lock:
-                for conns in self._rooms.values():
-                    conns.discard(ws)
-                self._agents.pop(ws, None)
+            await self._disconnect(ws)
 
-    async def _run(self):
-        async with serve(self._handler, self.host, self.port):
+    async def _run(self, *, reuse_port: bool = False):
+        if self.bus is not None:
+            await self.bus.start(self)
+        # reuse_port: несколько процессов слушают один порт, ядро делит между ними подключения
+        async with serve(self._handler, self.host, self.port, reuse_port=reuse_port or None):
             # Работаем, пока жив event loop
             await asyncio.Future()
 
@@ -1,23 +1,67 @@
 from PySide6.QtCore import QDateTime, QTimer
 from PySide6.QtWidgets import QInputDialog, QMessageBox
-from data.sqlite_store import repo
 import threading
 from windows.widgets.history_dialog import HistoryDialog
 from windows.settings_dialog import SettingsDialog
 
 
+# Сколько сообщений подгружать при открытии чата и при прокрутке вверх
+MESSAGES_PAGE_SIZE = 50
+
+# Полнотекстовый поиск: задержка после ввода, минимальная длина запроса, размер выдачи
+SEARCH_DEBOUNCE_MS = 250
+SEARCH_MIN_LENGTH = 2
+SEARCH_LIMIT = 100
+
+# Период сводки по скорости ответов в боковой панели
+ANALYTICS_PERIOD_DAYS = 30
+
+
 class ChatManager:
     """Менеджер работы с чатами"""
 
     def __init__(self, main_window):
         self.main_window = main_window
+        self._pending_chat_id = None  # чат, загрузку которого ждём из базы
+        self._loading_older = False   # идёт подгрузка предыдущей страницы сообщений
+        self._search_seq = 0          # номер последнего поискового запроса (старые ответы отбрасываем)
+        self._search_timer = QTimer()
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self._search_timer.timeout.connect(self._run_message_search)
 
     def load_user_chats(self):
-        """Загружаем чаты конкретного пользователя из базы данных"""
+        """Загружаем чаты конкретного пользователя из базы данных (в фоне)"""
         mw = self.main_window
         user_id = mw.user_data["id"]
-        mw.chats = repo.load_user_chats(user_id)
+        # Сообщения не нужны для списка — они подгружаются при открытии чата
+        mw.repo.load_user_chats(user_id, with_messages=False, callback=self._on_chats_loaded)
+
+    def _on_chats_loaded(self, chats):
+        """Чаты загружены — обновляем модель и список"""
+        mw = self.main_window
+        mw.chats = chats
         mw.chats_by_id = {c["id"]: c for c in mw.chats}
+        self.apply_chat_filters()
+        self.refresh_analytics()
+
+    def refresh_analytics(self):
+        """Сводка по операторам для чатов пользователя за ANALYTICS_PERIOD_DAYS (считается в базе, в фоне)"""
+        mw = self.main_window
+        since_ms = QDateTime.currentMSecsSinceEpoch() - ANALYTICS_PERIOD_DAYS * 86_400_000
+        mw.repo.response_analytics(mw.user_data["id"], since_ms=since_ms,
+                                   callback=lambda s: mw.analytics_panel.show_summary(
+                                       s, f"{ANALYTICS_PERIOD_DAYS} дней"))
+
+    def refresh_chat_analytics(self, chat_id):
+        """Показатели чата в боковой панели, если он всё ещё активен"""
+        mw = self.main_window
+
+        def show(metrics):
+            if mw.active_chat and mw.active_chat["id"] == chat_id:
+                mw.analytics_panel.show_chat(chat_id, metrics)
+
+        mw.repo.chat_analytics(chat_id, callback=show)
 
     def build_left_list(self):
         """Построение списка чатов в левой панели"""
@@ -28,6 +72,14 @@ class ChatManager:
         """Применение фильтров к списку чатов"""
         mw = self.main_window
         query = (mw.search_input.text() or "").strip().lower()
+
+        if mw.search_messages_cb.isChecked() and len(query) >= SEARCH_MIN_LENGTH:
+            # Поиск по сообщениям идёт в базе — после паузы в наборе
+            self._search_timer.start()
+            return
+        self._search_timer.stop()
+        self._search_seq += 1
+
         status = mw.status_filter.currentText()
         filtered = []
 
@@ -40,7 +92,47 @@ class ChatManager:
                 continue
             filtered.append(c)
 
-        mw.chat_list.set_chats(filtered)
+        self._show_filtered(filtered)
+
+    def on_search_mode_changed(self, checked):
+        """Переключение поиска: по названию/ID или по тексту сообщений"""
+        mw = self.main_window
+        mw.search_input.setPlaceholderText(
+            "Поиск по тексту сообщений..." if checked else "Поиск по названию или ID..."
+        )
+        self.apply_chat_filters()
+
+    def _run_message_search(self):
+        """Полнотекстовый поиск по сообщениям (в фоне)"""
+        mw = self.main_window
+        query = (mw.search_input.text() or "").strip()
+        self._search_seq += 1
+        seq = self._search_seq
+        mw.repo.search(mw.user_data["id"], query, SEARCH_LIMIT,
+                       callback=lambda results: self._on_search_results(seq, results))
+
+    def _on_search_results(self, seq, results):
+        """Результаты поиска: чаты со сниппетами совпадений"""
+        mw = self.main_window
+        if seq != self._search_seq:
+            return
+
+        status = mw.status_filter.currentText()
+        filtered = []
+        for r in results:
+            if status != "Все статусы" and r.get("status") != status:
+                continue
+            # Берём актуальный объект чата из модели, добавляя сниппет
+            chat = dict(mw.chats_by_id.get(r["id"], r))
+            chat["snippet"] = r.get("snippet")
+            filtered.append(chat)
+
+        self._show_filtered(filtered, keep_order=True)
+        mw.status_bar.showMessage(f"Найдено чатов: {len(filtered)}", 3000)
+
+    def _show_filtered(self, filtered, keep_order=False):
+        mw = self.main_window
+        mw.chat_list.set_chats(filtered, keep_order=keep_order)
         # подсветим активный, если он в фильтре
         if mw.active_chat and any(c["id"] == mw.active_chat["id"] for c in filtered):
             mw.chat_list.select_chat(mw.active_chat["id"])
@@ -63,56 +155,114 @@ class ChatManager:
             chat = mw.chats[0]
 
         if not chat:
-            chat = self._create_chat_object(title="Общая заявка", status="Новая")
-            self._add_chat(chat)
+            # Номер новому чату выдаёт хранилище (таблица sequences)
+            mw.repo.create_chat(mw.user_data["id"], "Общая заявка",
+                                callback=lambda created: self._on_chat_created(created, "Общая заявка"))
+            return
 
         self.set_active_chat(chat["id"])
 
     def set_active_chat(self, chat_id):
-        """Установка активного чата"""
+        """Установка активного чата (чтение из базы — в фоне)"""
+        self._pending_chat_id = chat_id
+        # Открываем только с последней страницей, остальное — при прокрутке вверх
+        self.main_window.repo.get_chat(chat_id, message_limit=MESSAGES_PAGE_SIZE,
+                                       callback=lambda chat: self._show_chat(chat_id, chat))
+
+    def _show_chat(self, chat_id, chat):
+        """Показ загруженного чата"""
         mw = self.main_window
 
-        chat = repo.get_chat(chat_id)
-        if not chat:
+        # Пока чат грузился, пользователь мог выбрать другой
+        if not chat or chat_id != self._pending_chat_id:
             return
 
-        mw.chats_by_id[chat_id] = chat
+        known = mw.chats_by_id.get(chat_id)
+        if known is not None:
+            known.update(chat)
+            chat = known
+        else:
+            self._add_chat(chat)
         mw.active_chat = chat
+        self._loading_older = False
         mw.update_header_for_chat()
 
+        if chat.get("unread_count"):
+            chat["unread_count"] = 0
+            mw.repo.mark_read(chat_id)
+            mw.chat_list.upsert_chat(chat)
+
         # Безопасная загрузка сообщений
         try:
-            mw.chat_area.load_messages(mw.active_chat.get("messages", []))
+            mw.chat_area.load_messages(mw.active_chat.get("messages", []), has_more=chat.get("has_more", False))
         except Exception as e:
             print(f"Error loading messages: {e}")
             mw.chat_area.clear_messages()
 
         mw.center_stack.setCurrentIndex(mw.CENTER_CHAT)
         mw.chat_list.select_chat(chat_id)
+        self.refresh_chat_analytics(chat_id)
 
         # WS подключение только если есть room_id
         if chat_id in mw.backend_rooms:
             mw.realtime_handler.subscribe_ws(chat_id)
 
+    def load_older_messages(self):
+        """Подгрузка предыдущей страницы сообщений активного чата"""
+        mw = self.main_window
+        chat = mw.active_chat
+        if not chat or not chat.get("has_more") or self._loading_older:
+            return
+
+        oldest_id = next((m["id"] for m in chat.get("messages", []) if m.get("id") is not None), None)
+        if oldest_id is None:
+            return
+
+        self._loading_older = True
+        chat_id = chat["id"]
+        mw.repo.get_messages(chat_id, before_id=oldest_id, limit=MESSAGES_PAGE_SIZE,
+                             callback=lambda page: self._on_older_messages(chat_id, page))
+
+    def _on_older_messages(self, chat_id, page):
+        """Предыдущая страница получена — добавляем сверху"""
+        mw = self.main_window
+        self._loading_older = False
+        if not mw.active_chat or mw.active_chat["id"] != chat_id:
+            return
+
+        messages, has_more = page
+        mw.active_chat["messages"][:0] = messages
+        mw.active_chat["has_more"] = has_more
+        mw.chat_area.prepend_messages(messages, has_more=has_more)
+
     def show_empty_state(self):
         """Показать пустое состояние (нет активного чата)"""
         mw = self.main_window
         mw.active_chat = None
+        self._pending_chat_id = None
         mw.center_stack.setCurrentIndex(mw.CENTER_EMPTY)
         mw.update_header_for_chat()
 
-    def create_new_chat(self):
-        """Создание нового чата"""
+    def create_new_chat(self, on_created=None):
+        """Создание нового чата. on_created(chat) — после записи в базу и открытия."""
         mw = self.main_window
 
         title, ok = self._ask_new_chat_title()
         if not ok:
             return
 
-        chat = repo.create_chat(mw.user_data["id"], title or "Новая заявка")
+        mw.repo.create_chat(mw.user_data["id"], title or "Новая заявка",
+                            callback=lambda chat: self._on_chat_created(chat, title, on_created))
+
+    def _on_chat_created(self, chat, title, on_created=None):
+        """Чат создан в базе — показываем и заводим комнату на бэкенде"""
+        mw = self.main_window
+
         self._add_chat(chat)
         mw.chat_list.upsert_chat(chat)
-        self.set_active_chat(chat["id"])
+        # Чат уже прочитан вместе с созданием — показываем без повторного запроса
+        self._pending_chat_id = chat["id"]
+        self._show_chat(chat["id"], chat)
 
         print(f"DEBUG: Created chat with ID: {chat['id']}")
 
@@ -184,11 +334,16 @@ class ChatManager:
         threading.Thread(target=_send_start_backend, daemon=True).start()
         mw.status_bar.showMessage(f"Создан новый чат {chat['id']}")
 
+        if on_created:
+            on_created(chat)
+
     def delete_chat(self, chat_id):
         """Удаление чата"""
         mw = self.main_window
 
         if chat_id not in mw.chats_by_id:
+            # архивный чат (из истории) — в списке его нет, удаляем только из хранилища
+            mw.repo.delete_chat(chat_id)
             return
 
         # сначала попросим сервер «покинуть чат» (если есть room_id)
@@ -197,7 +352,7 @@ class ChatManager:
         except Exception:
             pass  # не мешаем локальному удалению
 
-        repo.delete_chat(chat_id)
+        mw.repo.delete_chat(chat_id)
         deleting_active = (mw.active_chat and mw.active_chat["id"] == chat_id)
         mw.chats = [c for c in mw.chats if c["id"] != chat_id]
         mw.chats_by_id.pop(chat_id, None)
@@ -228,9 +383,9 @@ class ChatManager:
 
         if ok and new_title.strip():
             chat["title"] = new_title.strip()
-            chat["updated_at"] = QDateTime.currentDateTime().toString("yyyy-MM-dd hh:mm")
+            self.touch_chat(chat)
             mw.chat_list.upsert_chat(chat)
-            repo.rename_chat(chat_id, chat["title"])
+            mw.repo.rename_chat(chat_id, chat["title"])
             if mw.active_chat and mw.active_chat["id"] == chat_id:
                 mw.update_header_for_chat()
 
@@ -243,12 +398,13 @@ class ChatManager:
             return
 
         chat["status"] = status
-        chat["updated_at"] = QDateTime.currentDateTime().toString("yyyy-MM-dd hh:mm")
+        self.touch_chat(chat)
         mw.chat_list.upsert_chat(chat)
+        # Время в статусах пересчитывается после записи смены статуса
+        mw.repo.update_chat_status(chat_id, status, callback=lambda _: self.refresh_chat_analytics(chat_id))
 
         if mw.active_chat and mw.active_chat["id"] == chat_id:
             mw.update_header_for_chat()
-            repo.update_chat_status(chat_id, status)
             mw.apply_theme()
 
     def bulk_close_selected(self):
@@ -269,10 +425,21 @@ class ChatManager:
         if reply != QMessageBox.Yes:
             return
 
+        # Одна транзакция в базе и одно перестроение списка на всю пачку
+        now_ms = QDateTime.currentMSecsSinceEpoch()
+        ids = [cid for cid in ids if cid in mw.chats_by_id]
         for cid in ids:
-            self.change_status(cid, "Закрыта")
+            chat = mw.chats_by_id[cid]
+            chat["status"] = "Закрыта"
+            self.touch_chat(chat, now_ms)
+        mw.repo.bulk_update_status(ids, "Закрыта")
         self.apply_chat_filters()
 
+        if mw.active_chat and mw.active_chat["id"] in ids:
+            mw.update_header_for_chat()
+            mw.apply_theme()
+        mw.status_bar.showMessage(f"Закрыто заявок: {len(ids)}", 5000)
+
     def bulk_delete_selected(self):
         """Массовое удаление выбранных чатов"""
         mw = self.main_window
@@ -291,16 +458,45 @@ class ChatManager:
         if reply != QMessageBox.Yes:
             return
 
-        for cid in ids:
-            self.delete_chat(cid)
+        self.delete_chats([cid for cid in ids if cid in mw.chats_by_id])
+
+    def delete_chats(self, ids):
+        """Удаление пачки чатов: одна транзакция, один поток выхода из комнат, одно обновление списка"""
+        mw = self.main_window
+        if not ids:
+            return
+
+        # сначала попросим сервер «покинуть» комнаты (не мешая локальному удалению)
+        try:
+            mw.realtime_handler.leave_chats_for(ids)
+        except Exception:
+            pass
+
+        mw.repo.bulk_delete(ids)
+        removed = set(ids)
+        deleting_active = bool(mw.active_chat and mw.active_chat["id"] in removed)
+        mw.chats = [c for c in mw.chats if c["id"] not in removed]
+        for cid in removed:
+            mw.chats_by_id.pop(cid, None)
         self.apply_chat_filters()
 
+        if deleting_active:
+            if mw.chats:
+                self.set_active_chat(mw.chats[0]["id"])
+            else:
+                self.show_empty_state()
+        mw.status_bar.showMessage(f"Удалено заявок: {len(removed)}", 5000)
+
     def open_history(self):
-        """Открытие диалога истории чатов"""
+        """Открытие диалога истории чатов (вместе с архивными)"""
         mw = self.main_window
+        mw.repo.list_archived_chats(mw.user_data["id"], callback=self._show_history)
 
+    def _show_history(self, archived):
+        mw = self.main_window
+        known = set(mw.chats_by_id)
         dlg = HistoryDialog(
-            chats=mw.chats,
+            chats=mw.chats + [c for c in archived if c["id"] not in known],
             on_open=self.set_active_chat,
             on_delete=self.delete_chat,
             parent=mw
@@ -318,45 +514,34 @@ class ChatManager:
         mw = self.main_window
         return QInputDialog.getText(mw, "Новый чат", "Тема обращения:", text="Новая заявка")
 
-    def _create_chat_object(self, title, status="Новая"):
-        """Создание объекта чата"""
+    def note_message(self, chat, msg):
+        """Добавляет сообщение в модель чата и обновляет его сводку
+        (то же, что делают триггеры chats_summary_* в базе)"""
         mw = self.main_window
+        chat.setdefault("messages", []).append(msg)
+        chat["message_count"] = chat.get("message_count", 0) + 1
+        if "attachment" in msg:
+            preview = f"📎 {msg['attachment'].get('name', '')}"
+        else:
+            preview = msg.get("text") or ""
+        chat["last_message_preview"] = preview[:120]
+        chat["last_message_ms"] = QDateTime.currentMSecsSinceEpoch()
+        msg.setdefault("created_ms", chat["last_message_ms"])
+        chat["last_sender"] = msg.get("sender")
+
+        if msg.get("sender") != "user":
+            if mw.active_chat and mw.active_chat["id"] == chat["id"]:
+                # Чат открыт — входящее сразу прочитано
+                chat["unread_count"] = 0
+                mw.repo.mark_read(chat["id"])
+            else:
+                chat["unread_count"] = chat.get("unread_count", 0) + 1
 
-        new_id = self._next_chat_id()
-        now_dt = QDateTime.currentDateTime().toString("yyyy-MM-dd hh:mm")
-
-        return {
-            "id": new_id,
-            "user_id": mw.user_data["id"],
-            "title": title,
-            "status": status,
-            "created_at": now_dt,
-            "updated_at": now_dt,
-            "messages": [
-                {
-                    "sender": "operator",
-                    "operator": "Головач Лена",
-                    "text": "Здравствуйте! Чем можем помочь?",
-                    "time": QDateTime.currentDateTime().toString("hh:mm")
-                }
-            ]
-        }
-
-    def _next_chat_id(self):
-        """Генерация следующего ID чата"""
-        mw = self.main_window
-
-        existing = [c["id"] for c in mw.chats_by_id.values()]
-        max_n = 0
-
-        for cid in existing:
-            try:
-                n = int(cid.split("-")[1])
-                max_n = max(max_n, n)
-            except Exception:
-                pass
-
-        return f"CH-{max_n + 1:04d}"
+    def touch_chat(self, chat, now_ms=None):
+        """Отметить изменение чата в модели (как updated_ms в базе)"""
+        chat["updated_ms"] = QDateTime.currentMSecsSinceEpoch() if now_ms is None else now_ms
+        # строка — только для старого кода, сортировка идёт по updated_ms
+        chat["updated_at"] = QDateTime.fromMSecsSinceEpoch(chat["updated_ms"]).toString("yyyy-MM-dd hh:mm")
 
     def _add_chat(self, chat):
         """Добавление чата в локальные структуры данных"""
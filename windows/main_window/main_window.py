@@ -4,6 +4,8 @@ from PySide6.QtGui import QCloseEvent
 from styles.theme_manager import theme_manager
 from integrations.backend_agent_api import BackendAgentAPI
 from agent.agent_ids import AgentIDs
+from data.sqlite_store import get_repo
+from data.async_repo import AsyncRepo
 
 from .ui_manager import UIManager
 from .chat_manager import ChatManager
@@ -30,11 +32,15 @@ class MainWindow(QMainWindow):
 
     def _init_data(self):
         """Инициализация базовых данных"""
+        # Хранилище: открывается и работает в фоновом потоке (первая задача его очереди)
+        self.repo = AsyncRepo(get_repo, parent=self)
+        # Срок хранения, возврат места после удалений, optimize — в простое (data/maintenance.py)
+        self.repo.start_maintenance()
+
         # Backend интеграция
         self.backend_api = BackendAgentAPI()
         self.backend_rooms = {}  # local_chat_id -> backend room_id
         self.room_to_local = {}  # backend room_id (str) -> local chat_id
-        self._own_sent_ids = set()  # чтобы не дублировать свои сообщения из WS
         self.jwt_token = None
         self.ws_username = None
 
@@ -201,6 +207,11 @@ class MainWindow(QMainWindow):
             self.realtime_handler.close_connections()
         except Exception:
             pass
+        # Барьер: дождаться очереди операций с базой и сбросить запись на диск
+        try:
+            self.repo.shutdown()
+        except Exception as e:
+            print(f"Error flushing repo: {e}")
         super().closeEvent(event)
 
     # ========== Совместимость (методы которые могут вызываться извне) ==========
@@ -1,8 +1,8 @@
 import os
 from PySide6.QtCore import QDateTime, Qt
 from PySide6.QtWidgets import QFileDialog, QTextEdit, QMessageBox
-from data.sqlite_store import repo
 from styles.theme_manager import theme_manager
+from data.blob_store import human_size
 
 
 class MessageHandler:
@@ -29,14 +29,14 @@ class MessageHandler:
 
         # Сохраняем в базу данных
         msg_time = QDateTime.currentDateTime().toString("hh:mm")
-        mw.active_chat["messages"].append({"sender": "user", "text": text, "time": msg_time})
+        mw.chat_manager.note_message(mw.active_chat, {"sender": "user", "text": text, "time": msg_time})
 
         # Обновляем статус
         mw.active_chat["status"] = "Ожидает оператора"
-        mw.active_chat["updated_at"] = QDateTime.currentDateTime().toString("yyyy-MM-dd hh:mm")
+        mw.chat_manager.touch_chat(mw.active_chat)
 
-        repo.add_message(mw.active_chat["id"], sender="user", text=text, time_str=msg_time)
-        repo.update_chat_status(mw.active_chat["id"], "Ожидает оператора")
+        mw.repo.add_message(mw.active_chat["id"], sender="user", text=text, time_str=msg_time)
+        mw.repo.update_chat_status(mw.active_chat["id"], "Ожидает оператора")
 
         mw.theme_handler.update_header_for_chat()
         mw.chat_list.upsert_chat(mw.active_chat)
@@ -70,20 +70,23 @@ class MessageHandler:
         mw = self.main_window
 
         if not mw.active_chat:
-            # если нет активного чата — создаем новый автоматически
-            mw.chat_manager.create_new_chat()
+            # если нет активного чата — создаем новый и прикладываем файлы, когда он откроется
+            mw.chat_manager.create_new_chat(on_created=lambda chat: self.on_files_dropped(paths))
+            return
 
         for p in paths:
             attach = self._build_attachment_data(p)
             mw.chat_area.add_attachment(attach, is_user=True)
 
             msg_time = QDateTime.currentDateTime().toString("hh:mm")
-            mw.active_chat["messages"].append({"sender": "user", "attachment": attach, "time": msg_time})
-            repo.add_message(mw.active_chat["id"], sender="user", attachment=attach, time_str=msg_time)
+            mw.chat_manager.note_message(mw.active_chat, {"sender": "user", "attachment": attach, "time": msg_time})
+            # Хеш и копия в хранилище вложений — в потоке базы, не в UI
+            mw.repo.add_attachment_message(mw.active_chat["id"], sender="user", path=p, name=attach["name"],
+                                           is_image=attach["is_image"], time_str=msg_time)
 
         # Обновляем статус
         mw.active_chat["status"] = "Ожидает оператора"
-        mw.active_chat["updated_at"] = QDateTime.currentDateTime().toString("yyyy-MM-dd hh:mm")
+        mw.chat_manager.touch_chat(mw.active_chat)
         mw.theme_handler.update_header_for_chat()
         mw.chat_list.upsert_chat(mw.active_chat)
 
@@ -136,11 +139,7 @@ class MessageHandler:
 
     def _human_size(self, num):
         """Конвертация размера файла в человекочитаемый формат"""
-        for unit in ['Б', 'КБ', 'МБ', 'ГБ', 'ТБ']:
-            if abs(num) < 1024.0:
-                return f"{num:.1f} {unit}"
-            num /= 1024.0
-        return f"{num:.1f} ПБ"
+        return human_size(num)
 
     def setup_message_input_handler(self):
         """Настройка обработчика ввода сообщений"""
@@ -157,9 +156,10 @@ class MessageHandler:
         mw.send_btn.clicked.connect(self.send_message)
         mw.attach_btn.clicked.connect(self.attach_file)
 
-        # Подключаем drag&drop
+        # Подключаем drag&drop и подгрузку истории при прокрутке вверх
         if hasattr(mw, 'chat_area'):
             mw.chat_area.files_dropped.connect(self.on_files_dropped)
+            mw.chat_area.older_requested.connect(mw.chat_manager.load_older_messages)
 
         # Подключаем кнопку создания из empty state
         if hasattr(mw, 'empty_create_btn'):
@@ -181,6 +181,7 @@ class MessageHandler:
 
         # Подключаем left panel signals
         mw.search_input.textChanged.connect(mw.chat_manager.apply_chat_filters)
+        mw.search_messages_cb.toggled.connect(mw.chat_manager.on_search_mode_changed)
         mw.status_filter.currentIndexChanged.connect(mw.chat_manager.apply_chat_filters)
         mw.bulk_close_btn.clicked.connect(mw.chat_manager.bulk_close_selected)
         mw.bulk_delete_btn.clicked.connect(mw.chat_manager.bulk_delete_selected)
@@ -2,7 +2,6 @@ import os
 import threading
 from PySide6.QtCore import QDateTime, QMetaObject, Qt, Slot, QTimer
 from realtime.realtime_client import FakeRealtimeClient
-from data.sqlite_store import repo
 
 try:
     from realtime.client import ChatClient
@@ -212,15 +211,15 @@ class RealtimeHandler:
         if not chat:
             return
 
-        chat["messages"].append(msg)
-        repo.add_message(chat_id, sender=msg.get("sender", "operator"), text=msg.get("text"),
-                         operator=msg.get("operator"), time_str=msg.get("time"))
+        mw.chat_manager.note_message(chat, msg)
+        mw.repo.add_message(chat_id, sender=msg.get("sender", "operator"), text=msg.get("text"),
+                            operator=msg.get("operator"), time_str=msg.get("time"))
 
         if chat.get("status") != "В работе":
             chat["status"] = "В работе"
-            repo.update_chat_status(chat_id, "В работе")
+            mw.repo.update_chat_status(chat_id, "В работе")
 
-        chat["updated_at"] = QDateTime.currentDateTime().toString("yyyy-MM-dd hh:mm")
+        mw.chat_manager.touch_chat(chat)
         mw.chat_list.upsert_chat(chat)
 
         if mw.active_chat and mw.active_chat["id"] == chat_id:
@@ -250,32 +249,20 @@ class RealtimeHandler:
                 return
 
             msg_id = str(m.get("id") or "")
-            # отфильтруем эхо наших отправок через HTTP
-            if msg_id and msg_id in mw._own_sent_ids:
-                mw._own_sent_ids.discard(msg_id)
-                return
-
             sender_name = m.get("senderName") or "Оператор"
             text = m.get("content") or ""
             time_str = QDateTime.currentDateTime().toString("hh:mm")
 
-            chat = mw.chats_by_id.get(local_id)
-            if not chat:
+            if local_id not in mw.chats_by_id:
                 return
 
-            chat["messages"].append({"sender": "operator", "operator": sender_name, "text": text, "time": time_str})
-            repo.add_message(local_id, sender="operator", text=text, operator=sender_name, time_str=time_str)
-
-            if chat.get("status") != "В работе":
-                chat["status"] = "В работе"
-                repo.update_chat_status(local_id, "В работе")
-
-            chat["updated_at"] = QDateTime.currentDateTime().toString("yyyy-MM-dd hh:mm")
-            mw.chat_list.upsert_chat(chat)
-
-            if mw.active_chat and mw.active_chat["id"] == local_id:
-                mw.chat_area.add_message(text, is_user=False, operator=sender_name)
-                mw.update_header_for_chat()
+            # Дубли событий, эхо наших HTTP-отправок и повторы после переподключения
+            # отсекаются в хранилище по server_id — UI обновляем только для нового сообщения
+            mw.repo.upsert_message(
+                local_id, msg_id or None, sender="operator", text=text, operator=sender_name, time_str=time_str,
+                callback=lambda inserted: inserted and self._on_incoming_operator_message(
+                    local_id, sender_name, text, time_str)
+            )
 
         elif et == "room_update":
             room = evt.get("room") or {}
@@ -299,6 +286,33 @@ class RealtimeHandler:
                 count_text = f"Операторов: {chat.get('operators_count', 0)}"
                 mw.operator_count_label.setText(count_text)
 
+        elif et == "resync":
+            # Обрыв был дольше, чем сервер хранит историю комнаты: часть событий не дослана
+            mw.status_bar.showMessage("Соединение восстановлено, часть сообщений могла не загрузиться", 8000)
+
+    def _on_incoming_operator_message(self, local_id, sender_name, text, time_str):
+        """Новое (не дублирующееся) сообщение оператора сохранено — показываем"""
+        mw = self.main_window
+
+        chat = mw.chats_by_id.get(local_id)
+        if not chat:
+            return
+
+        mw.chat_manager.note_message(
+            chat, {"sender": "operator", "operator": sender_name, "text": text, "time": time_str}
+        )
+
+        if chat.get("status") != "В работе":
+            chat["status"] = "В работе"
+            mw.repo.update_chat_status(local_id, "В работе")
+
+        mw.chat_manager.touch_chat(chat)
+        mw.chat_list.upsert_chat(chat)
+
+        if mw.active_chat and mw.active_chat["id"] == local_id:
+            mw.chat_area.add_message(text, is_user=False, operator=sender_name)
+            mw.update_header_for_chat()
+
     def send_text_with_retry(self, chat_id: str, text: str, attempt: int = 0, max_attempts: int = 40,
                              delay_ms: int = 100):
         """Отправка текста с повторами"""
@@ -327,7 +341,8 @@ class RealtimeHandler:
                 else:
                     msg_id = str((resp or {}).get("id") or "")
                     if msg_id:
-                        mw._own_sent_ids.add(msg_id)
+                        # Запоминаем серверный id нашего сообщения — его эхо из WS станет no-op
+                        mw.repo.assign_server_id(chat_id, msg_id, text)
             except Exception as e:
                 print(f"Exception during send: {e}")
                 QMetaObject.invokeMethod(mw, "_on_send_error", Qt.QueuedConnection)
@@ -434,3 +449,18 @@ class RealtimeHandler:
                 QMetaObject.invokeMethod(mw, "_on_leave_success_ui", Qt.QueuedConnection)
 
         threading.Thread(target=_leave, daemon=True).start()
+
+    def leave_chats_for(self, chat_ids):
+        """Покинуть несколько чатов одним фоновым потоком (массовое удаление)"""
+        mw = self.main_window
+
+        room_ids = [mw.backend_rooms[cid] for cid in chat_ids if mw.backend_rooms.get(cid)]
+        if not room_ids:
+            return
+
+        def _leave_all():
+            for room_id in room_ids:
+                # ошибки на массовых операциях игнорируем
+                mw.backend_api.client_leave(room_id, mw.agent_ids.instance_id)
+
+        threading.Thread(target=_leave_all, daemon=True).start()
@@ -1,11 +1,12 @@
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QFrame,
                                QLabel, QPushButton, QTextEdit, QSplitter,
                                QStackedWidget, QLineEdit, QComboBox, QListWidget,
-                               QToolBar, QStatusBar)
+                               QToolBar, QStatusBar, QCheckBox)
 from PySide6.QtCore import Qt
 from PySide6.QtGui import QFont, QAction
 from windows.widgets.chat_list import ChatList
 from windows.widgets.chat_area import ChatArea
+from windows.widgets.analytics_panel import AnalyticsPanel
 
 STATUS_CHOICES = ("Новая", "В работе", "Ожидает клиента", "Ожидает оператора", "Закрыта")
 
@@ -147,6 +148,9 @@ class UIManager:
         mw.search_input = QLineEdit()
         mw.search_input.setPlaceholderText("Поиск по названию или ID...")
 
+        # Режим полнотекстового поиска по сообщениям
+        mw.search_messages_cb = QCheckBox("Искать в сообщениях")
+
         # Фильтр статуса
         mw.status_filter = QComboBox()
         mw.status_filter.addItem("Все статусы")
@@ -161,6 +165,7 @@ class UIManager:
         mw.chat_list = ChatList()
 
         lay.addWidget(mw.search_input)
+        lay.addWidget(mw.search_messages_cb)
         lay.addWidget(mw.status_filter)
         lay.addWidget(mw.bulk_close_btn)
         lay.addWidget(mw.bulk_delete_btn)
@@ -274,6 +279,9 @@ class UIManager:
         mw.operators_list.addItem("👨‍💻 Сидоров Михаил")
         mw.operators_list.addItem("👩‍💻 Головач Лена")
 
+        # Скорость ответов: активный чат и сводка за период (ChatManager.refresh_analytics)
+        mw.analytics_panel = AnalyticsPanel()
+
         # Действия
         mw.actions_label = QLabel("Действия:")
         mw.actions_label.setFont(QFont("Arial", 11, QFont.Bold))
@@ -289,6 +297,7 @@ class UIManager:
         layout.addWidget(mw.user_info)
         layout.addWidget(mw.operators_label)
         layout.addWidget(mw.operators_list)
+        layout.addWidget(mw.analytics_panel)
         layout.addWidget(mw.actions_label)
         layout.addWidget(mw.new_chat_btn)
         layout.addWidget(mw.history_btn)
@@ -0,0 +1,88 @@
+from PySide6.QtWidgets import QFrame, QVBoxLayout, QLabel
+from PySide6.QtGui import QFont
+from styles.theme_manager import theme_manager
+from data.analytics import format_duration
+
+STATUS_ORDER = ("Новая", "В работе", "Ожидает клиента", "Ожидает оператора", "Закрыта")
+MAX_OPERATORS = 5
+
+
+class AnalyticsPanel(QFrame):
+    """
+    Блок боковой панели «Скорость ответов»: показатели активного чата и сводка
+    по операторам за период. Данные приходят готовыми агрегатами из
+    SQLiteRepo.chat_analytics / response_analytics (считаются в базе).
+    """
+
+    def __init__(self):
+        super().__init__()
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(6)
+
+        self.title = QLabel("Скорость ответов")
+        self.title.setFont(QFont("Arial", 11, QFont.Bold))
+
+        self.chat_label = QLabel("Чат не выбран")
+        self.chat_label.setWordWrap(True)
+
+        self.summary_label = QLabel("")
+        self.summary_label.setWordWrap(True)
+
+        layout.addWidget(self.title)
+        layout.addWidget(self.chat_label)
+        layout.addWidget(self.summary_label)
+
+        theme_manager.theme_changed.connect(self.apply_theme)
+        self.apply_theme()
+
+    def apply_theme(self):
+        colors = theme_manager.get_theme_styles()["colors"]
+        self.title.setStyleSheet(f"color: {colors['text_primary']};")
+        for label in (self.chat_label, self.summary_label):
+            label.setStyleSheet(f"color: {colors['text_secondary']}; font-size: 11px;")
+
+    @staticmethod
+    def _dwell_lines(dwell):
+        return [f"&nbsp;&nbsp;{status}: {format_duration(dwell[status])}"
+                for status in sorted(dwell, key=lambda s: STATUS_ORDER.index(s) if s in STATUS_ORDER else 99)]
+
+    def show_chat(self, chat_id, metrics):
+        """metrics — результат SQLiteRepo.chat_analytics"""
+        if not metrics:
+            self.chat_label.setText("Чат не выбран")
+            return
+        lines = [
+            f"<b>{chat_id}</b>",
+            f"Первый ответ: {format_duration(metrics.get('first_response_ms'))}",
+            f"Средний ответ: {format_duration(metrics.get('avg_reply_ms'))} "
+            f"(ответов: {metrics.get('replies', 0)})",
+        ]
+        dwell = metrics.get("dwell_ms") or {}
+        if dwell:
+            lines.append("В статусах:")
+            lines += self._dwell_lines(dwell)
+        self.chat_label.setText("<br>".join(lines))
+
+    def show_summary(self, summary, period_label="30 дней"):
+        """summary — результат SQLiteRepo.response_analytics"""
+        if not summary or not summary.get("replies"):
+            self.summary_label.setText(f"За {period_label}: ответов нет")
+            return
+        lines = [
+            f"<b>За {period_label}</b>",
+            f"Первый ответ в среднем: {format_duration(summary.get('avg_first_response_ms'))}",
+            f"Ответ в среднем: {format_duration(summary.get('avg_reply_ms'))} "
+            f"(ответов: {summary['replies']})",
+        ]
+        operators = summary.get("operators") or []
+        if operators:
+            lines.append("Операторы:")
+            for op in operators[:MAX_OPERATORS]:
+                lines.append(f"&nbsp;&nbsp;{op['operator']}: {format_duration(op['avg_reply_ms'])} "
+                             f"× {op['replies']}")
+        dwell = {status: d["avg_ms"] for status, d in (summary.get("dwell") or {}).items()}
+        if dwell:
+            lines.append("Среднее время в статусе:")
+            lines += self._dwell_lines(dwell)
+        self.summary_label.setText("<br>".join(lines))
@@ -6,11 +6,14 @@ from .message_widgets import MessageBubble, AttachmentBubble
 
 class ChatArea(QScrollArea):
     files_dropped = Signal(list)
+    older_requested = Signal()  # прокрутили к началу — нужна предыдущая страница
 
     def __init__(self):
         super().__init__()
-        self.setup_ui()
         self.messages = []
+        self._has_more = False      # в базе есть сообщения старше показанных
+        self._older_armed = False   # не просим новую страницу, пока не отработала прошлая
+        self.setup_ui()
         self.apply_theme()
         self.setAcceptDrops(True)
         self.viewport().setAcceptDrops(True)
@@ -44,6 +47,7 @@ class ChatArea(QScrollArea):
         self.chat_layout.addStretch()
 
         self.setWidget(self.chat_widget)
+        self.verticalScrollBar().valueChanged.connect(self._on_scroll)
 
     def apply_theme(self):
         theme_data = theme_manager.get_theme_styles()
@@ -80,20 +84,54 @@ class ChatArea(QScrollArea):
                 self.chat_layout.removeItem(item)
         self.messages.clear()
 
-    def load_messages(self, messages):
+    def load_messages(self, messages, has_more=False):
         self.clear_messages()
+        self._has_more = has_more
+        self._older_armed = False
         for msg in messages:
-            if "attachment" in msg:
-                self.add_attachment(msg["attachment"], is_user=(msg.get("sender") == "user"), time_text=msg.get("time"))
-            else:
-                is_user = (msg.get("sender") == "user")
-                self.add_message(msg.get("text", ""), is_user=is_user, operator=msg.get("operator"))
+            self._insert_container(self.chat_layout.count() - 1, self._build_container(msg))
+        self.messages.extend(messages)
+        QTimer.singleShot(100, self.scroll_to_bottom)
 
-    def add_attachment(self, attach_data: dict, is_user=True, time_text=None):
-        if not time_text:
-            time_text = QDateTime.currentDateTime().toString("hh:mm")
-        bubble = AttachmentBubble(attach_data, time_text, is_user)
+    def prepend_messages(self, messages, has_more=False):
+        """Добавляет более старую страницу сверху, не сдвигая видимую часть"""
+        sb = self.verticalScrollBar()
+        from_bottom = sb.maximum() - sb.value()
+        for i, msg in enumerate(messages):
+            self._insert_container(i, self._build_container(msg))
+        self.messages[:0] = messages
+        self._has_more = has_more
+
+        def restore():
+            sb.setValue(sb.maximum() - from_bottom)
+            self._older_armed = True
+
+        QTimer.singleShot(0, restore)
+
+    def _on_scroll(self, value):
+        sb = self.verticalScrollBar()
+        if self._has_more and self._older_armed and sb.maximum() > 0 and value <= sb.minimum():
+            self._older_armed = False
+            self.older_requested.emit()
+
+    def _build_container(self, msg):
+        """Пузырь сообщения из словаря хранилища"""
+        is_user = (msg.get("sender") == "user")
+        # Время форматируется здесь, при выводе; в хранилище — миллисекунды эпохи
+        if msg.get("created_ms") is not None:
+            time_text = QDateTime.fromMSecsSinceEpoch(msg["created_ms"]).toString("hh:mm")
+        else:
+            time_text = msg.get("time") or QDateTime.currentDateTime().toString("hh:mm")
+        if "attachment" in msg:
+            bubble = AttachmentBubble(msg["attachment"], time_text, is_user)
+        else:
+            message_data = {"text": msg.get("text", ""), "time": time_text, "delivered": True}
+            if not is_user and msg.get("operator"):
+                message_data["operator"] = msg["operator"]
+            bubble = MessageBubble(message_data, is_user)
+        return self._wrap_bubble(bubble, is_user)
 
+    def _wrap_bubble(self, bubble, is_user):
         container = QWidget()
         cl = QHBoxLayout(container)
         cl.setContentsMargins(0, 0, 0, 0)
@@ -101,8 +139,17 @@ class ChatArea(QScrollArea):
             cl.addStretch(); cl.addWidget(bubble)
         else:
             cl.addWidget(bubble); cl.addStretch()
+        return container
+
+    def _insert_container(self, index, container):
+        self.chat_layout.insertWidget(index, container)
 
-        self.chat_layout.insertWidget(self.chat_layout.count() - 1, container)
+    def add_attachment(self, attach_data: dict, is_user=True, time_text=None):
+        if not time_text:
+            time_text = QDateTime.currentDateTime().toString("hh:mm")
+        bubble = AttachmentBubble(attach_data, time_text, is_user)
+
+        self._insert_container(self.chat_layout.count() - 1, self._wrap_bubble(bubble, is_user))
         QTimer.singleShot(100, self.scroll_to_bottom)
 
         # локальная модель (для автоскролла и простых сценариев)
@@ -121,18 +168,7 @@ class ChatArea(QScrollArea):
 
         bubble = MessageBubble(message_data, is_user)
 
-        container = QWidget()
-        container_layout = QHBoxLayout(container)
-        container_layout.setContentsMargins(0, 0, 0, 0)
-
-        if is_user:
-            container_layout.addStretch()
-            container_layout.addWidget(bubble)
-        else:
-            container_layout.addWidget(bubble)
-            container_layout.addStretch()
-
-        self.chat_layout.insertWidget(self.chat_layout.count() - 1, container)
+        self._insert_container(self.chat_layout.count() - 1, self._wrap_bubble(bubble, is_user))
         QTimer.singleShot(100, self.scroll_to_bottom)
 
         self.messages.append(message_data)
@@ -140,3 +176,4 @@ class ChatArea(QScrollArea):
     def scroll_to_bottom(self):
         scrollbar = self.verticalScrollBar()
         scrollbar.setValue(scrollbar.maximum())
+        self._older_armed = True
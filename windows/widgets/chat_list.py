@@ -49,10 +49,13 @@ class ChatList(QListWidget):
             }}
         """)
 
-    def set_chats(self, chats):
+    def set_chats(self, chats, keep_order=False):
+        """keep_order=True — показать в переданном порядке (выдача поиска по релевантности)"""
         self.clear()
         self.chats_by_id = {c["id"]: c for c in chats}
-        for c in sorted(chats, key=lambda x: x.get("updated_at", ""), reverse=True):
+        if not keep_order:
+            chats = sorted(chats, key=lambda x: x.get("updated_ms") or 0, reverse=True)
+        for c in chats:
             self._add_item(c)
 
     def upsert_chat(self, chat):
@@ -80,12 +83,21 @@ class ChatList(QListWidget):
     def _add_item(self, chat):
         it = QListWidgetItem(self._format_text(chat))
         it.setData(Qt.UserRole, chat["id"])
-        it.setSizeHint(QSize(240, 48))
+        it.setSizeHint(QSize(240, 66))
         self.addItem(it)
 
     def _format_text(self, chat):
         status = chat.get("status", "")
-        return f"{chat['title']}\n{chat['id']} • {status}"
+        unread = chat.get("unread_count") or 0
+        title = f"{chat['title']} ({unread})" if unread else chat["title"]
+        text = f"{title}\n{chat['id']} • {status}"
+        # Третья строка: сниппет совпадения в режиме поиска, иначе превью последнего сообщения
+        if chat.get("snippet"):
+            text += f"\n{chat['snippet']}"
+        elif chat.get("last_message_preview"):
+            who = "Вы" if chat.get("last_sender") == "user" else "Оператор"
+            text += f"\n{who}: {' '.join(chat['last_message_preview'].split())}"
+        return text
 
     def _on_item_clicked(self, item):
         self.chat_selected.emit(item.data(Qt.UserRole))
@@ -1,7 +1,7 @@
 from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout,
                                QListWidget, QListWidgetItem, QPushButton,
                                QMenu, QMessageBox)
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QDateTime
 from styles.theme_manager import theme_manager, ThemeType
 
 
@@ -121,7 +121,7 @@ class HistoryDialog(QDialog):
 
         # новее — выше
         def sort_key(ch):
-            return ch.get("updated_at", ""), ch.get("id", "")
+            return ch.get("updated_ms") or 0, ch.get("id", "")
 
         for chat in sorted(self.chats, key=sort_key, reverse=True):
             item = QListWidgetItem()
@@ -129,9 +129,17 @@ class HistoryDialog(QDialog):
             status = chat['status']
             chat_id = chat['id']
             title = chat['title']
-            updated = chat.get('updated_at', '')
-
-            text = f"{emoji} [{status}] {chat_id} — {title} • {updated}"
+            updated_ms = chat.get('updated_ms')
+            updated = (QDateTime.fromMSecsSinceEpoch(updated_ms).toString("yyyy-MM-dd hh:mm")
+                       if updated_ms is not None else chat.get('updated_at', ''))
+            count = chat.get('message_count', 0)
+
+            text = f"{emoji} [{status}] {chat_id} — {title} • {updated} • сообщений: {count}"
+            if chat.get('archived'):
+                text += " • в архиве"
+            preview = chat.get('last_message_preview')
+            if preview:
+                text += f"\n    {' '.join(preview.split())}"
             item.setText(text)
 
             # Цвет по статусу